@@ -5,20 +5,54 @@ This module provides the application factory pattern for creating Flask app inst
 Routes are organized in separate blueprint modules in the routes package.
 """
 
+from typing import Dict, Optional
+
 from flask import Flask
+import database
+import instrumentation
 from database import init_database, add_sample_data
 from routes import register_blueprints
+from commands import register_commands
+from services import payment_queue, payment_service, reconciliation
 
 
-def create_app():
+def create_app(config: Optional[Dict] = None):
     """
     Application factory function to create and configure Flask app.
     
+    Args:
+        config: Optional settings that override the defaults (e.g. DATABASE, DB_BACKEND,
+                DB_POOL_SIZE, BOOK_CACHE_URL, PROFILING, BACKGROUND_TASKS)
+    
     Returns:
         Flask: Configured Flask application instance
     """
     app = Flask(__name__)
     app.secret_key = "super secret key"
+    app.config.update(
+        DATABASE=database.DATABASE,
+        DB_BACKEND=None,  # 'sqlite' or 'postgresql'; None picks from DATABASE (see database.create_backend)
+        DB_POOL_SIZE=database.POOL_SIZE,
+        DB_POOL_TIMEOUT=database.POOL_TIMEOUT,
+        DB_STORAGE_SETTINGS={},
+        DB_CHECKPOINT_INTERVAL=database.CHECKPOINT_INTERVAL,
+        DB_CHECKPOINT_MODE=database.CHECKPOINT_MODE,
+        BOOK_CACHE_URL=None,
+        BOOK_CACHE_SIZE=database.BOOK_CACHE_SIZE,
+        BOOK_CACHE_TTL=database.BOOK_CACHE_TTL,
+        PAYMENT_WORKERS=payment_queue.PAYMENT_WORKERS,
+        PAYMENT_GATEWAY_URL=None,
+        PAYMENT_API_KEY="test_key_12345",
+        RECONCILE_INTERVAL=reconciliation.RECONCILE_INTERVAL,
+        INSTRUMENTATION=True,
+        PROFILING=False,
+        BACKGROUND_TASKS=True,
+    )
+    if config:
+        app.config.update(config)
+    
+    # Set up the connection pool before anything touches the database
+    database.init_app(app)
     
     # Initialize the database
     init_database()
@@ -26,12 +60,63 @@ def create_app():
     # Add sample data for testing and demonstration
     add_sample_data()
     
+    # Request, SQL and template timing, /metrics, and profiling on request when PROFILING is set
+    instrumentation.init_app(app)
+    
     # Register all route blueprints
     register_blueprints(app)
     
+    # Shared payment gateway (no URL keeps the simulated gateway)
+    payment_service.configure_payment_gateway(app.config['PAYMENT_GATEWAY_URL'], app.config['PAYMENT_API_KEY'])
+    
+    # Checkpointer, payment workers and reconciler (a prefork server starts these per worker, see serving.py)
+    if app.config['BACKGROUND_TASKS']:
+        start_background_tasks(app)
+    else:
+        stop_background_tasks()
+    
+    # Register CLI commands (e.g. flask import-books)
+    register_commands(app)
+    
     return app
 
 
+def start_background_tasks(app, primary: bool = True):
+    """
+    Start the background threads configured on the app.
+
+    Payment workers run in every process (jobs are claimed atomically). The WAL
+    checkpointer and the reconciler only need one copy, so a server with
+    several worker processes starts them in the primary worker alone.
+    """
+    # WAL checkpoints on a timer (0 disables; SQLite only)
+    interval = app.config['DB_CHECKPOINT_INTERVAL']
+    if (primary and interval and database.get_backend().supports_checkpoints
+            and database.STORAGE_SETTINGS['journal_mode'].upper() == 'WAL'):
+        database.start_checkpointer(interval, app.config['DB_CHECKPOINT_MODE'])
+    else:
+        database.stop_checkpointer()
+    
+    # Start the workers that send queued payments to the gateway (0 leaves that to another process)
+    if app.config['PAYMENT_WORKERS']:
+        payment_queue.start_payment_workers(app.config['PAYMENT_WORKERS'])
+    else:
+        payment_queue.stop_payment_workers()
+    
+    # Periodically check unsettled payments against the gateway (0 disables)
+    if primary and app.config['RECONCILE_INTERVAL']:
+        reconciliation.start_reconciler(app.config['RECONCILE_INTERVAL'])
+    else:
+        reconciliation.stop_reconciler()
+
+
+def stop_background_tasks(timeout: Optional[float] = None):
+    """Stop every background thread, letting in-flight payments finish first."""
+    payment_queue.stop_payment_workers(timeout)
+    reconciliation.stop_reconciler(timeout)
+    database.stop_checkpointer()
+
+
 if __name__ == '__main__':
     app = create_app()
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,3 @@
+"""
+Benchmarks Package - Performance harnesses for the Library Management System
+"""
@@ -0,0 +1,250 @@
+"""
+Micro-benchmark harness for the service layer (see service_benchmarks.py).
+
+Provides a `benchmark` fixture in the style of pytest-benchmark: it times a
+function over many rounds, measures the memory it allocates per call with
+tracemalloc, and fails the test when either regresses by more than
+--bench-threshold against the baseline committed in service_baseline.json.
+Times are compared relative to a calibration workload run alongside each
+benchmark, so a baseline recorded on a faster machine doesn't fail every test.
+Without a baseline every benchmark fails rather than silently passing.
+
+Usage:
+    python -m pytest benchmarks/service_benchmarks.py --bench-save    # Record a baseline (commit it)
+    python -m pytest benchmarks/service_benchmarks.py                 # Compare against it
+"""
+
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+from benchmarks.load_test import book_row
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'service_baseline.json')
+BENCH_ROUNDS = 50  # Timed calls per benchmark
+BENCH_THRESHOLD = 0.25  # Allowed slowdown (or extra allocation) against the baseline, as a fraction
+BENCH_PATRON = '500000'  # Patron whose history is sized by the history parameter
+OTHER_PATRONS = 1000  # Background patrons sharing the borrow_records table
+
+
+def calibrate(rounds: int = 5) -> float:
+    """
+    Time a fixed workload (microseconds, best of `rounds`). Each benchmark is
+    calibrated around its timed rounds and compared with its baseline relative
+    to this, so a slower or busier machine isn't reported as a regression.
+    """
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT)')
+    conn.executemany('INSERT INTO t (name) VALUES (?)', ((f'row {i}',) for i in range(2000)))
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        rows = [dict(zip(('id', 'name'), row)) for row in conn.execute('SELECT * FROM t ORDER BY name')]
+        sum(len(row['name']) for row in rows)
+        best = min(best, time.perf_counter() - start)
+    conn.close()
+    return best * 1e6
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('benchmarks')
+    group.addoption('--bench-baseline', default=BASELINE_PATH, help='Baseline JSON to compare against')
+    group.addoption('--bench-save', action='store_true', help='Write this run as the new baseline')
+    group.addoption('--bench-threshold', type=float, default=BENCH_THRESHOLD,
+                    help='Fractional regression that fails a benchmark (default 0.25)')
+    group.addoption('--bench-rounds', type=int, default=BENCH_ROUNDS, help='Timed calls per benchmark')
+
+
+class BenchmarkSession:
+    """Results of this run plus the baseline they are compared with."""
+
+    def __init__(self, config):
+        # Defaults apply when this conftest is only reached while collecting the whole tree
+        self.path = config.getoption('--bench-baseline', BASELINE_PATH)
+        self.save = config.getoption('--bench-save', False)
+        self.threshold = config.getoption('--bench-threshold', BENCH_THRESHOLD)
+        self.rounds = config.getoption('--bench-rounds', BENCH_ROUNDS)
+        self.results = {}
+        self.baseline = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.baseline = json.load(f)['benchmarks']
+
+    def speed(self, name: str) -> float:
+        """How much slower the machine was for this benchmark than for its baseline."""
+        before = self.baseline.get(name)
+        if not before or not before.get('calibration_us'):
+            return 1.0
+        return self.results[name]['calibration_us'] / before['calibration_us']
+
+    def missing_baseline(self, name: str):
+        """Fail if there is no baseline file to compare with; warn if it lacks this benchmark."""
+        if self.save:
+            return
+        if not os.path.exists(self.path):
+            pytest.fail(f'No benchmark baseline at {self.path}; record one with --bench-save', pytrace=False)
+        if name not in self.baseline:
+            warnings.warn(pytest.PytestWarning(
+                f'{name} has no baseline in {self.path} and was not compared; re-record it with --bench-save'))
+
+    def regressions(self, name: str, result: dict):
+        before = self.baseline.get(name)
+        if self.save or not before:
+            return []
+        problems = []
+        # The fastest round is the least disturbed by other work on the machine
+        for key, label, scale in (('min_us', 'fastest time', self.speed(name)), ('alloc_peak_bytes', 'peak allocation', 1)):
+            # Tiny baselines are noise; allow a fixed floor as well as the fraction
+            expected = before[key] * scale
+            allowed = expected * (1 + self.threshold) + (5 if key == 'min_us' else 1024)
+            if result[key] > allowed:
+                problems.append(f'{label} {result[key]:.0f} vs baseline {expected:.0f}')
+        return problems
+
+    def write(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump({'timestamp': datetime.now().isoformat(timespec='seconds'), 'rounds': self.rounds,
+                       'benchmarks': self.results}, f, indent=2, sort_keys=True)
+
+
+def pytest_configure(config):
+    config._bench_session = BenchmarkSession(config)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    bench = session.config._bench_session
+    if bench.save and bench.results:
+        bench.write()
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    bench = config._bench_session
+    if not bench.results:
+        return
+    terminalreporter.section('service benchmarks')
+    terminalreporter.write_line(f"{'benchmark':<60}{'median us':>11}{'min us':>10}{'peak KiB':>10}{'vs base':>9}")
+    for name, result in sorted(bench.results.items()):
+        before = bench.baseline.get(name)
+        change = f"{result['min_us'] / (before['min_us'] * bench.speed(name)) - 1:+.0%}" if before and before['min_us'] else ''
+        terminalreporter.write_line(f"{name:<60}{result['median_us']:>11.1f}{result['min_us']:>10.1f}"
+                                    f"{result['alloc_peak_bytes'] / 1024:>10.1f}{change:>9}")
+    if bench.save:
+        terminalreporter.write_line(f'Baseline written to {bench.path}')
+
+
+@pytest.fixture
+def benchmark(request):
+    """
+    Time func(*args) and fail on regression against the baseline.
+
+    setup() runs untimed before every call and its result (if not None) is
+    passed as the arguments; teardown(result) runs untimed after every call.
+    """
+    bench = request.config._bench_session
+    name = request.node.name
+    bench.missing_baseline(name)
+
+    def run(func, *args, setup=None, teardown=None):
+        def call():
+            call_args = setup() if setup else None
+            call_args = args if call_args is None else call_args
+            start = time.perf_counter()
+            result = func(*call_args)
+            elapsed = time.perf_counter() - start
+            if teardown:
+                teardown(result)
+            return result, elapsed
+
+        result, _ = call()  # Warm-up (connections, caches, imports)
+        calibration_us = calibrate()
+        timings = [call()[1] for _ in range(bench.rounds)]
+        calibration_us = min(calibration_us, calibrate())
+
+        call_args = setup() if setup else None
+        call_args = args if call_args is None else call_args
+        tracemalloc.start()
+        try:
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            result = func(*call_args)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        if teardown:
+            teardown(result)
+
+        bench.results[name] = {
+            'median_us': statistics.median(timings) * 1e6,
+            'mean_us': statistics.fmean(timings) * 1e6,
+            'min_us': min(timings) * 1e6,
+            'alloc_peak_bytes': peak - before,
+            'calibration_us': calibration_us,
+        }
+        problems = bench.regressions(name, bench.results[name])
+        if problems:
+            pytest.fail(f'{name} regressed beyond {bench.threshold:.0%}: ' + '; '.join(problems))
+        return result
+
+    return run
+
+
+def seed_library(num_books: int, history: int):
+    """
+    Seed num_books books, `history` returned loans plus one overdue and one
+    current loan for BENCH_PATRON, and one returned loan per book spread over
+    OTHER_PATRONS background patrons.
+    """
+    database.init_database()
+    for start in range(1, num_books + 1, 50000):
+        database.insert_books_bulk([book_row(i) for i in range(start, min(start + 50000, num_books + 1))])
+    now = datetime.now()
+
+    def returned_loan(patron_id, i):
+        borrowed = now - timedelta(days=30 + i % 700)
+        return (patron_id, i % num_books + 1, borrowed.isoformat(),
+                (borrowed + timedelta(days=14)).isoformat(), (borrowed + timedelta(days=10)).isoformat())
+
+    with database.transaction() as conn:
+        conn.executemany('''
+            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date, return_date)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [returned_loan(f'{400000 + i % OTHER_PATRONS:06d}', i) for i in range(num_books)]
+             + [returned_loan(BENCH_PATRON, i) for i in range(history)]
+             + [(BENCH_PATRON, 1, (now - timedelta(days=20)).isoformat(), (now - timedelta(days=6)).isoformat(), None),
+                (BENCH_PATRON, 2, (now - timedelta(days=3)).isoformat(), (now + timedelta(days=11)).isoformat(), None)])
+        conn.execute('UPDATE books SET available_copies = total_copies - 1 WHERE id IN (1, 2)')
+        conn.execute('ANALYZE')
+
+
+@pytest.fixture(scope='session')
+def library_factory():
+    """Seed (and cache) one scratch database per (catalog size, history size) and switch to it."""
+    original_database = database.DATABASE
+    tmp = tempfile.TemporaryDirectory()
+    seeded = set()
+
+    def use(num_books: int, history: int):
+        path = os.path.join(tmp.name, f'bench-{num_books}-{history}.db')
+        database.configure_pool(path)
+        if path not in seeded:
+            seed_library(num_books, history)
+            seeded.add(path)
+        return path
+
+    yield use
+    database.get_pool().close_all()
+    database.configure_pool(original_database)
+    tmp.cleanup()
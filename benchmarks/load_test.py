@@ -0,0 +1,345 @@
+"""
+Load test for the Flask routes.
+
+Seeds a synthetic library (books, patrons and borrow history) into a scratch
+database, serves create_app() from a threaded WSGI server and drives it with
+concurrent HTTP clients. Each client loops over a weighted mix of /catalog,
+/search, /api/search, /borrow, /return and /api/late_fee. Latency percentiles,
+throughput and error rates are reported per route and written to a JSON file
+so runs can be compared across commits.
+
+Usage:
+    python -m benchmarks.load_test [--books N] [--patrons N] [--loans N] [--clients C] [--seconds S]
+    python -m benchmarks.load_test --database bench.db   # Seed once, reuse on later runs
+    python -m benchmarks.load_test --compare benchmarks/results/<earlier run>.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import requests
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+import database
+from app import create_app
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+SEED_CHUNK = 50000  # Rows per insert transaction while seeding
+LOAN_DAYS = 14
+HISTORY_DAYS = 730  # Seeded borrow dates are spread over this many days
+ACTIVE_LOANS_PER_PATRON = 2  # Open loans given to each seeded patron (the rest are returned)
+
+WORDS = ('river', 'shadow', 'garden', 'winter', 'empire', 'silver', 'forest', 'ocean', 'machine',
+         'letters', 'history', 'island', 'night', 'stone', 'glass', 'fire', 'mountain', 'city',
+         'secret', 'journey', 'kingdom', 'storm', 'light', 'memory', 'harbor', 'desert', 'crown')
+SURNAMES = ('Smith', 'Garcia', 'Nguyen', 'Okafor', 'Tanaka', 'Muller', 'Rossi', 'Kowalski',
+            'Silva', 'Cohen', 'Haddad', 'Larsen', 'Dubois', 'Novak', 'Singh', 'Murphy')
+
+# Weighted route mix: mostly reads, with borrow/return traffic invalidating the catalog
+DEFAULT_MIX = {
+    'catalog': 25,
+    'search': 15,
+    'api_search': 20,
+    'late_fee': 20,
+    'borrow': 10,
+    'return': 10,
+}
+
+
+def book_row(i: int):
+    """(title, author, isbn, total_copies) for the i-th synthetic book."""
+    title = f'{WORDS[i % len(WORDS)].title()} of the {WORDS[(i // len(WORDS)) % len(WORDS)].title()} {i}'
+    author = f'{SURNAMES[i % len(SURNAMES)]} {WORDS[(i // 7) % len(WORDS)].title()}'
+    return title, author, f'{9780000000000 + i}', 3
+
+
+def patron_id(i: int) -> str:
+    return f'{100000 + i:06d}'
+
+
+def seed(num_books: int, num_patrons: int, num_loans: int):
+    """
+    Insert the synthetic library: books through insert_books_bulk, then borrow
+    records (all returned except ACTIVE_LOANS_PER_PATRON per patron), then set
+    available_copies to match the open loans.
+    """
+    database.init_database()
+    for start in range(1, num_books + 1, SEED_CHUNK):
+        database.insert_books_bulk([book_row(i) for i in range(start, min(start + SEED_CHUNK, num_books + 1))])
+
+    rng = random.Random(42)
+    now = datetime.now()
+    active_from = max(0, num_loans - num_patrons * ACTIVE_LOANS_PER_PATRON)
+
+    def loan(i):
+        borrowed = now - timedelta(days=rng.uniform(0, HISTORY_DAYS))
+        if i >= active_from:
+            # Open loans: recent, some of them overdue
+            borrowed = now - timedelta(days=rng.uniform(0, LOAN_DAYS * 2))
+        due = borrowed + timedelta(days=LOAN_DAYS)
+        returned = None if i >= active_from else (borrowed + timedelta(days=rng.uniform(1, LOAN_DAYS + 5))).isoformat()
+        return (patron_id(i % num_patrons), rng.randint(1, num_books), borrowed.isoformat(), due.isoformat(), returned)
+
+    for start in range(0, num_loans, SEED_CHUNK):
+        with database.transaction() as conn:
+            conn.executemany('''
+                INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date, return_date)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [loan(i) for i in range(start, min(start + SEED_CHUNK, num_loans))])
+
+    with database.transaction() as conn:
+        conn.execute('''
+            UPDATE books SET available_copies = MAX(0, total_copies - (
+                SELECT COUNT(*) FROM borrow_records br
+                WHERE br.book_id = books.id AND br.return_date IS NULL
+            ))
+            WHERE id IN (SELECT book_id FROM borrow_records WHERE return_date IS NULL)
+        ''')
+        conn.execute('ANALYZE')
+
+
+def library_size() -> dict:
+    conn = database.get_db_connection()
+    try:
+        return {
+            'books': conn.execute('SELECT COUNT(*) FROM books').fetchone()[0],
+            'patrons': conn.execute('SELECT COUNT(DISTINCT patron_id) FROM borrow_records').fetchone()[0],
+            'loans': conn.execute('SELECT COUNT(*) FROM borrow_records').fetchone()[0],
+        }
+    finally:
+        conn.close()
+
+
+def percentile(sorted_values, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list (0.0 when it's empty)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, errors: int, seconds: float) -> dict:
+    """Latency percentiles (milliseconds), throughput and error rate for one route."""
+    latencies = sorted(latencies)
+    requests_made = len(latencies)
+    return {
+        'requests': requests_made,
+        'errors': errors,
+        'error_rate': errors / requests_made if requests_made else 0.0,
+        'throughput': requests_made / seconds,
+        'mean_ms': sum(latencies) / requests_made * 1000 if requests_made else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+    }
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Skip the per-request access log, which would dominate the output (and the timings)."""
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class Client(threading.Thread):
+    """One simulated user: a keep-alive session issuing requests back to back."""
+
+    def __init__(self, index: int, base_url: str, size: dict, mix: dict, stop: threading.Event,
+                 recording: threading.Event):
+        super().__init__(name=f'load-client-{index}', daemon=True)
+        self.base_url = base_url
+        self.size = size
+        self.stop = stop
+        self.recording = recording
+        self.rng = random.Random(index)
+        self.session = requests.Session()
+        self.routes = list(mix)
+        self.weights = [mix[name] for name in self.routes]
+        # Clients borrow as patrons outside the seeded range so their loans don't hit the limit
+        self.patron = f'9{index:05d}'
+        self.borrowed = []
+        self.latencies = {name: [] for name in mix}
+        self.errors = {name: 0 for name in mix}
+
+    def request(self, name: str):
+        rng = self.rng
+        books = max(1, self.size['books'])
+        if name == 'catalog':
+            return self.session.get(f'{self.base_url}/catalog', params={'limit': 50})
+        if name in ('search', 'api_search'):
+            search_type = rng.choice(('title', 'author'))
+            term = rng.choice(WORDS) if search_type == 'title' else rng.choice(SURNAMES)
+            path = '/search' if name == 'search' else '/api/search'
+            return self.session.get(f'{self.base_url}{path}', params={'q': term, 'type': search_type})
+        if name == 'late_fee':
+            patron = patron_id(rng.randrange(max(1, self.size['patrons'])))
+            return self.session.get(f'{self.base_url}/api/late_fee/{patron}/{rng.randint(1, books)}')
+        if name == 'borrow' or not self.borrowed:
+            book_id = rng.randint(1, books)
+            response = self.session.post(f'{self.base_url}/borrow', allow_redirects=False,
+                                         data={'patron_id': self.patron, 'book_id': book_id})
+            if len(self.borrowed) < 4:
+                self.borrowed.append(book_id)
+            return response
+        return self.session.post(f'{self.base_url}/return',
+                                 data={'patron_id': self.patron, 'book_id': self.borrowed.pop()})
+
+    def run(self):
+        while not self.stop.is_set():
+            name = self.rng.choices(self.routes, self.weights)[0]
+            start = time.perf_counter()
+            try:
+                response = self.request(name)
+                failed = response.status_code >= 500 or response.status_code in (400, 404)
+            except requests.RequestException:
+                failed = True
+            elapsed = time.perf_counter() - start
+            if self.recording.is_set():
+                self.latencies[name].append(elapsed)
+                if failed:
+                    self.errors[name] += 1
+        self.session.close()
+
+
+def run_load(base_url: str, size: dict, clients: int, seconds: float, warmup: float, mix: dict) -> dict:
+    """Run `clients` concurrent clients for warmup + seconds and summarise the measured part."""
+    stop = threading.Event()
+    recording = threading.Event()
+    workers = [Client(i, base_url, size, mix, stop, recording) for i in range(clients)]
+    for worker in workers:
+        worker.start()
+    time.sleep(warmup)
+    recording.set()
+    started = time.perf_counter()
+    time.sleep(seconds)
+    recording.clear()
+    measured = time.perf_counter() - started
+    stop.set()
+    for worker in workers:
+        worker.join()
+
+    routes = {}
+    all_latencies, all_errors = [], 0
+    for name in mix:
+        latencies = [t for worker in workers for t in worker.latencies[name]]
+        errors = sum(worker.errors[name] for worker in workers)
+        routes[name] = summarize(latencies, errors, measured)
+        all_latencies += latencies
+        all_errors += errors
+    return {'routes': routes, 'total': summarize(all_latencies, all_errors, measured)}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_report(report: dict, baseline: dict = None):
+    rows = list(report['routes'].items()) + [('total', report['total'])]
+    print(f"{'route':<12}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>9}")
+    for name, stats in rows:
+        line = (f"{name:<12}{stats['throughput']:>9.1f}{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}"
+                f"{stats['p99_ms']:>9.1f}{stats['error_rate']:>8.1%}")
+        if baseline:
+            before = baseline['total'] if name == 'total' else baseline['routes'].get(name)
+            if before and before['p95_ms']:
+                line += f"   p95 {stats['p95_ms'] / before['p95_ms'] - 1:+.0%}"
+                line += f"  req/s {stats['throughput'] / before['throughput'] - 1:+.0%}" if before['throughput'] else ''
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--books', type=int, default=1000000)
+    parser.add_argument('--patrons', type=int, default=100000)
+    parser.add_argument('--loans', type=int, default=5000000)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=30.0)
+    parser.add_argument('--warmup', type=float, default=5.0)
+    parser.add_argument('--database', help='Database file to seed (or reuse if it is already seeded); '
+                                           'a temporary file by default')
+    parser.add_argument('--url', help='Drive an already running server instead of starting one '
+                                      '(--database must point at the database it serves)')
+    parser.add_argument('--output', help='Where to write the JSON results '
+                                         '(default: benchmarks/results/load_test-<commit>-<time>.json)')
+    parser.add_argument('--compare', help='Earlier JSON results to compare against')
+    args = parser.parse_args(argv)
+
+    original_database = database.DATABASE
+    tmp = None
+    path = args.database
+    if path is None:
+        tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(tmp.name, 'load_test.db')
+    server = None
+    try:
+        database.configure_pool(path, max_size=max(database.POOL_SIZE, args.clients))
+        database.init_database()
+        size = library_size()
+        if size['books'] == 0:
+            print(f'Seeding {args.books} books, {args.patrons} patrons and {args.loans} loans...')
+            started = time.perf_counter()
+            seed(args.books, args.patrons, args.loans)
+            size = library_size()
+            print(f'Seeded in {time.perf_counter() - started:.1f}s')
+
+        base_url = args.url
+        if base_url is None:
+            app = create_app({'DATABASE': path, 'DB_POOL_SIZE': max(database.POOL_SIZE, args.clients),
+                              'PAYMENT_WORKERS': 0, 'RECONCILE_INTERVAL': 0})
+            server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            base_url = f'http://127.0.0.1:{server.server_port}'
+
+        result = run_load(base_url.rstrip('/'), size, args.clients, args.seconds, args.warmup, DEFAULT_MIX)
+    finally:
+        if server is not None:
+            server.shutdown()
+        database.get_pool().close_all()
+        database.configure_pool(original_database)
+        if tmp is not None:
+            tmp.cleanup()
+
+    commit = git_commit()
+    report = {
+        'benchmark': 'load_test',
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': database.sqlite3.sqlite_version,
+        'config': {'clients': args.clients, 'seconds': args.seconds, 'warmup': args.warmup,
+                   'mix': DEFAULT_MIX, 'url': args.url},
+        'library': size,
+        **result,
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"load_test-{commit}-{datetime.now().strftime('%Y%m%d%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    print(f'Results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Micro-benchmarks for the service layer functions, parameterised on catalog
+size (books) and history size (the patron's past loans).
+
+Usage:
+    python -m pytest benchmarks/service_benchmarks.py [--bench-save] [--bench-threshold 0.25]
+"""
+
+import pytest
+
+from benchmarks.conftest import BENCH_PATRON
+from services.library_service import (
+    search_books_in_catalog, calculate_late_fee_for_book, get_patron_status_report,
+    borrow_book_by_patron, return_book_by_patron
+)
+
+CATALOG_SIZES = (1000, 10000, 100000)
+HISTORY_SIZES = (10, 100, 1000)
+DEFAULT_HISTORY = 100
+DEFAULT_CATALOG = 10000
+BORROWER = '600000'  # Patron with no loans, so borrowing never hits the limit
+
+
+@pytest.mark.parametrize('books', CATALOG_SIZES)
+@pytest.mark.parametrize('search_type, term', [('title', 'river'), ('title', 'shadow of the gard'),
+                                               ('author', 'Okafor'), ('isbn', '9780000000500')])
+def test_search_books_in_catalog(benchmark, library_factory, books, search_type, term):
+    library_factory(books, DEFAULT_HISTORY)
+    results = benchmark(search_books_in_catalog, term, search_type)
+    assert results
+
+
+@pytest.mark.parametrize('books', CATALOG_SIZES)
+@pytest.mark.parametrize('history', HISTORY_SIZES)
+def test_calculate_late_fee_for_book(benchmark, library_factory, books, history):
+    library_factory(books, history)
+    result = benchmark(calculate_late_fee_for_book, BENCH_PATRON, 1)
+    assert result['days_overdue'] == 6
+
+
+@pytest.mark.parametrize('books', CATALOG_SIZES)
+@pytest.mark.parametrize('history', HISTORY_SIZES)
+def test_get_patron_status_report(benchmark, library_factory, books, history):
+    library_factory(books, history)
+    report = benchmark(get_patron_status_report, BENCH_PATRON)
+    assert report['num_currently_borrowed'] == 2
+
+
+@pytest.mark.parametrize('books', CATALOG_SIZES)
+@pytest.mark.parametrize('history', HISTORY_SIZES)
+def test_borrow_book_by_patron(benchmark, library_factory, books, history):
+    library_factory(books, history)
+    book_id = books // 2
+    # Return the copy (untimed) after every borrow so each round sees the same state
+    result = benchmark(borrow_book_by_patron, BORROWER, book_id,
+                       teardown=lambda result: return_book_by_patron(BORROWER, book_id))
+    assert result[0], result[1]
+
+
+@pytest.mark.parametrize('books', CATALOG_SIZES)
+@pytest.mark.parametrize('history', HISTORY_SIZES)
+def test_return_book_by_patron(benchmark, library_factory, books, history):
+    library_factory(books, history)
+    book_id = books // 2 + 1
+
+    def borrow():
+        borrow_book_by_patron(BORROWER, book_id)
+
+    result = benchmark(return_book_by_patron, BORROWER, book_id, setup=borrow)
+    assert result[0], result[1]
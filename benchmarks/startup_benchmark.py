@@ -0,0 +1,131 @@
+"""
+Startup-time benchmark.
+
+Starts fresh Python processes that import the app, run create_app() and
+serve a first request, and reports the median time of each step over
+several runs. Two cases are measured: a new database file (schema and sample
+data are created) and an existing one (init_database should do no schema
+work). Each probe also records whether the payment stack's HTTP client
+(`requests`) was loaded, which only a real payment gateway should need.
+
+Usage:
+    python -m benchmarks.startup_benchmark [--runs N]
+    python -m benchmarks.startup_benchmark --compare benchmarks/results/<earlier run>.json
+"""
+
+# Only the standard library here: probes time the app's imports from a clean interpreter
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+RUNS = 10
+FIRST_REQUEST_PATH = '/catalog'
+TIMINGS = ('process_ms', 'import_ms', 'create_app_ms', 'first_request_ms', 'total_ms')
+
+
+def probe(path: str) -> dict:
+    """Time one cold start in this (fresh) process."""
+    started = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    from app import create_app
+    imported = time.perf_counter()
+    app = create_app({'DATABASE': path, 'PAYMENT_WORKERS': 0, 'RECONCILE_INTERVAL': 0})
+    created = time.perf_counter()
+    response = app.test_client().get(FIRST_REQUEST_PATH)
+    served = time.perf_counter()
+    return {
+        'import_ms': (imported - started) * 1000,
+        'create_app_ms': (created - imported) * 1000,
+        'first_request_ms': (served - created) * 1000,
+        'total_ms': (served - started) * 1000,
+        'status': response.status_code,
+        'requests_loaded': 'requests' in sys.modules,
+    }
+
+
+def run_probe(path: str) -> dict:
+    """Run probe() in a new interpreter and add the whole process's wall time."""
+    started = time.perf_counter()
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--probe', path],
+                               capture_output=True, text=True, cwd=ROOT)
+    elapsed = time.perf_counter() - started
+    if completed.returncode != 0:
+        raise RuntimeError(f'Startup probe failed:\n{completed.stderr}')
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['process_ms'] = elapsed * 1000
+    return result
+
+
+def measure(runs: int, existing: bool) -> dict:
+    """Median of each timing over `runs` cold starts, on new database files or on one existing file."""
+    with tempfile.TemporaryDirectory() as tmp:
+        shared = os.path.join(tmp, 'existing.db')
+        if existing:
+            run_probe(shared)  # Create the schema and sample data once, untimed
+        results = [run_probe(shared if existing else os.path.join(tmp, f'new-{i}.db')) for i in range(runs)]
+    summary = {key: statistics.median(r[key] for r in results) for key in TIMINGS}
+    summary['min_total_ms'] = min(r['total_ms'] for r in results)
+    summary['errors'] = sum(r['status'] >= 400 for r in results)
+    summary['requests_loaded'] = any(r['requests_loaded'] for r in results)
+    return summary
+
+
+def print_report(report: dict, baseline: dict = None):
+    print(f"{'database':<10}" + ''.join(f'{key[:-3]:>16}' for key in TIMINGS) + f"{'requests':>10}")
+    for name, stats in report['cases'].items():
+        line = f'{name:<10}' + ''.join(f'{stats[key]:>14.1f}ms' for key in TIMINGS)
+        line += f"{'loaded' if stats['requests_loaded'] else 'no':>10}"
+        before = baseline['cases'].get(name) if baseline else None
+        if before and before['total_ms']:
+            line += f"   total {stats['total_ms'] / before['total_ms'] - 1:+.0%}"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=RUNS, help='Cold starts per case')
+    parser.add_argument('--output', help='Where to write the JSON results '
+                                         '(default: benchmarks/results/startup-<commit>-<time>.json)')
+    parser.add_argument('--compare', help='Earlier JSON results to compare against')
+    parser.add_argument('--probe', metavar='DATABASE', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.probe:
+        print(json.dumps(probe(args.probe)))
+        return
+
+    from benchmarks.load_test import RESULTS_DIR, git_commit
+
+    commit = git_commit()
+    report = {
+        'benchmark': 'startup',
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'config': {'runs': args.runs, 'first_request': FIRST_REQUEST_PATH},
+        'cases': {'new': measure(args.runs, existing=False), 'existing': measure(args.runs, existing=True)},
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"startup-{commit}-{datetime.now().strftime('%Y%m%d%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    print(f'Results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
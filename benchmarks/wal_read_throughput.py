@@ -0,0 +1,117 @@
+"""
+Read throughput while writes are in flight.
+
+Seeds a scratch database, then runs borrow/return writers against it while
+reader threads hammer the catalog and lookup helpers. The same workload is run
+with the rollback journal (DELETE) and with WAL so the two can be compared.
+
+Usage:
+    python -m benchmarks.wal_read_throughput [--books N] [--seconds S] [--readers R] [--writers W]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+
+
+def seed(num_books: int):
+    """Create the schema and insert num_books books."""
+    database.init_database()
+    conn = database.get_db_connection()
+    try:
+        conn.executemany('''
+            INSERT INTO books (title, author, isbn, total_copies, available_copies)
+            VALUES (?, ?, ?, ?, ?)
+        ''', ((f'Book {i:07d}', f'Author {i % 997}', f'{i:013d}', 5, 5) for i in range(1, num_books + 1)))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def run_workload(num_books: int, seconds: float, readers: int, writers: int) -> dict:
+    """Run readers and writers concurrently and count completed operations."""
+    stop = threading.Event()
+    counts = {'reads': 0, 'writes': 0, 'write_errors': 0}
+    lock = threading.Lock()
+
+    def reader(worker: int):
+        done = 0
+        book_id = worker + 1
+        while not stop.is_set():
+            database.get_book_by_id(book_id)
+            database.get_patron_borrow_count(f'{worker:06d}')
+            book_id = book_id % num_books + 1
+            done += 1
+        with lock:
+            counts['reads'] += done
+
+    def writer(worker: int):
+        done = errors = 0
+        patron_id = f'9{worker:05d}'
+        book_id = worker + 1
+        while not stop.is_set():
+            now = datetime.now()
+            ok = database.insert_borrow_record(patron_id, book_id, now, now + timedelta(days=14))
+            ok = ok and database.update_book_availability(book_id, -1)
+            ok = ok and database.update_borrow_record_return_date(patron_id, book_id, now)
+            ok = ok and database.update_book_availability(book_id, 1)
+            if ok:
+                done += 1
+            else:
+                errors += 1
+        with lock:
+            counts['writes'] += done
+            counts['write_errors'] += errors
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads += [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    return {
+        'reads_per_sec': counts['reads'] / seconds,
+        'writes_per_sec': counts['writes'] / seconds,
+        'write_errors': counts['write_errors'],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    args = parser.parse_args(argv)
+
+    original_settings = database.configure_storage()
+    original_database = database.DATABASE
+    try:
+        for journal_mode in ('DELETE', 'WAL'):
+            with tempfile.TemporaryDirectory() as tmp:
+                database.configure_storage({'journal_mode': journal_mode})
+                database.configure_pool(os.path.join(tmp, 'bench.db'), max_size=args.readers + args.writers)
+                seed(args.books)
+                result = run_workload(args.books, args.seconds, args.readers, args.writers)
+                database.get_pool().close_all()
+            print(f"{journal_mode:>6}: {result['reads_per_sec']:>10.0f} reads/s  "
+                  f"{result['writes_per_sec']:>8.0f} borrow+return/s  "
+                  f"{result['write_errors']} write errors")
+    finally:
+        database.configure_storage(original_settings)
+        database.configure_pool(original_database)
+
+
+if __name__ == '__main__':
+    main()
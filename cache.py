@@ -0,0 +1,161 @@
+"""
+Cache module for Library Management System
+Small key/value caches with hit/miss/eviction counters, used as read-through
+caches in front of hot database lookups
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# Returned by get() when a key is not cached (None is a valid cached value)
+MISSING = object()
+
+
+class LRUCache:
+    """
+    In-process least-recently-used cache with an optional time-to-live.
+
+    Safe to share between threads. Each worker process has its own copy, so
+    use a shared backend (RedisCache) when several workers must agree.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: Optional[float] = None):
+        """
+        Args:
+            max_size: Maximum number of entries before the least recently used is evicted
+            ttl: Seconds an entry stays valid (None keeps entries until evicted)
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    def get(self, key: str) -> Any:
+        """Get a cached value, or MISSING if it is absent or expired."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return MISSING
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self._stats['hits'] += 1
+            return value
+
+    def set(self, key: str, value: Any):
+        """Cache a value, evicting the least recently used entry if the cache is full."""
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def delete(self, *keys: str):
+        """Remove entries from the cache."""
+        with self._lock:
+            for key in keys:
+                if self._data.pop(key, None) is not None:
+                    self._stats['invalidations'] += 1
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        with self._lock:
+            self._stats['invalidations'] += len(self._data)
+            self._data.clear()
+
+    def stats(self) -> Dict:
+        """Return hit/miss/eviction counters and the current size."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._data)
+        stats['max_size'] = self.max_size
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+class RedisCache:
+    """
+    Cache backend stored in a Redis-compatible server so several worker
+    processes share one cache. Values must be JSON-serialisable.
+
+    Requires the optional ``redis`` package.
+    """
+
+    def __init__(self, url: str = 'redis://localhost:6379/0', ttl: Optional[float] = None,
+                 prefix: str = 'library:', client=None):
+        """
+        Args:
+            url: Server URL, used when no client is given
+            ttl: Seconds an entry stays valid (None keeps entries until invalidated)
+            prefix: Namespace for this cache's keys on the shared server
+            client: Pre-built client with get/set/delete/scan_iter (e.g. for tests)
+        """
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("RedisCache requires the 'redis' package (pip install redis).")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def get(self, key: str) -> Any:
+        """Get a cached value, or MISSING if it is absent or expired."""
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            self._count('misses')
+            return MISSING
+        self._count('hits')
+        return json.loads(raw)
+
+    def set(self, key: str, value: Any):
+        """Cache a value. The server expires it after ttl seconds."""
+        ttl_ms = int(self.ttl * 1000) if self.ttl else None
+        self.client.set(self.prefix + key, json.dumps(value), px=ttl_ms)
+
+    def delete(self, *keys: str):
+        """Remove entries from the cache."""
+        if keys:
+            removed = self.client.delete(*(self.prefix + key for key in keys))
+            self._count('invalidations', removed or 0)
+
+    def clear(self):
+        """Remove every entry under this cache's prefix."""
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+        self._count('invalidations', len(keys))
+
+    def stats(self) -> Dict:
+        """Return this process's hit/miss counters (size is not tracked for a shared server)."""
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+def create_cache(url: Optional[str] = None, max_size: int = 10000, ttl: Optional[float] = None):
+    """Build a cache backend: an in-process LRUCache, or a RedisCache for a redis:// URL."""
+    if url:
+        return RedisCache(url, ttl=ttl)
+    return LRUCache(max_size=max_size, ttl=ttl)
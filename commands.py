@@ -0,0 +1,38 @@
+"""
+CLI Commands - Flask command line interface for maintenance tasks
+
+Usage:
+    flask --app app import-books catalog.csv
+    flask --app app import-books catalog.jsonl --format jsonl --chunk-size 10000
+"""
+
+import click
+from services.import_service import import_books, detect_format, IMPORT_CHUNK_SIZE, IMPORT_FORMATS
+
+
+@click.command('import-books')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(IMPORT_FORMATS), default=None,
+              help='Input format (guessed from the file extension by default).')
+@click.option('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE, show_default=True,
+              help='Rows written per transaction.')
+@click.option('--show-rejects/--no-show-rejects', default=True,
+              help='Print each rejected row.')
+def import_books_command(path, fmt, chunk_size, show_rejects):
+    """Bulk import books from a CSV or JSON Lines file."""
+    fmt = fmt or detect_format(path)
+    with open(path, newline='', encoding='utf-8') as f:
+        report = import_books(f, fmt, chunk_size)
+
+    if show_rejects:
+        for reject in report['rejects']:
+            click.echo(f"line {reject['line']}: {reject['error']} (isbn={reject['isbn']})", err=True)
+    click.echo(
+        f"{report['rows']} rows read, {report['inserted']} inserted, {report['rejected']} rejected "
+        f"in {report['elapsed_seconds']:.2f}s ({report['rows_per_sec']:.0f} rows/sec)"
+    )
+
+
+def register_commands(app):
+    """Register all CLI commands with the Flask app."""
+    app.cli.add_command(import_books_command)
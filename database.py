@@ -3,57 +3,842 @@ Database module for Library Management System
 Handles all database operations and connections
 """
 
+import base64
+import json
+import queue
+import re
 import sqlite3
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from flask import g, has_app_context
+
+from cache import MISSING, create_cache
 
 # Database configuration
 DATABASE = 'library.db'
+POOL_SIZE = 8  # Maximum number of open connections kept by the pool
+POOL_TIMEOUT = 5.0  # Seconds to wait for a free connection before giving up
+SEARCH_LIMIT = 100  # Maximum number of results returned by a title/author search
+CATALOG_PAGE_SIZE = 50  # Books per catalog page
+MAX_PAGE_SIZE = 500  # Upper bound on a requested page size
+HISTORY_PAGE_SIZE = 50  # Borrow records per page of a patron's history
+BOOK_CACHE_SIZE = 10000  # Books kept in the in-process lookup cache
+BOOK_CACHE_TTL = 60.0  # Seconds a cached book stays valid (bounds staleness across workers)
+ISBN_LOOKUP_CHUNK = 500  # ISBNs per IN (...) query, well under SQLite's bound-parameter limit
 
-def get_db_connection():
-    """Get a database connection."""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row  # This enables column access by name
+# Storage tuning. journal_mode is stored in the database file and is applied once
+# at startup; everything else is applied to every connection when it is opened.
+STORAGE_SETTINGS = {
+    'journal_mode': 'WAL',  # Readers no longer block on /borrow and /return writes
+    'synchronous': 'NORMAL',  # Safe with WAL, skips an fsync per commit
+    'busy_timeout': 5000,  # Milliseconds a writer waits on a lock before "database is locked"
+    'cache_size': -16000,  # Negative means KiB, so ~16 MB of page cache per connection
+    'mmap_size': 134217728,  # Memory-map up to 128 MB of the database file
+    'temp_store': 'MEMORY',
+    'wal_autocheckpoint': 1000,  # Pages written before a commit triggers a checkpoint
+}
+STARTUP_PRAGMAS = ('journal_mode',)
+
+# Background WAL checkpoint policy (interval in seconds, 0 disables the checkpointer)
+CHECKPOINT_INTERVAL = 30.0
+CHECKPOINT_MODE = 'PASSIVE'
+CHECKPOINT_MODES = ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE')
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    SQLite connection handed out by a ConnectionPool.
+
+    Calling close() returns the connection to its pool instead of closing it,
+    so existing code that does ``conn = get_db_connection() ... conn.close()``
+    keeps working unchanged. Connections pinned to a Flask app context are
+    only released when that context is torn down.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+        self.pinned = False
+        self.changed_books = set()  # Books written in the open transaction (see transaction())
+
+    def close(self):
+        if self.pinned:
+            # Owned by the current app context; just drop any unfinished work
+            if self.in_transaction:
+                self.rollback()
+            return
+        if self.pool is not None:
+            self.pool.release(self)
+        else:
+            super().close()
+
+    def discard(self):
+        """Really close the underlying SQLite connection."""
+        self.pool = None
+        self.pinned = False
+        super().close()
+
+    def execute(self, sql, parameters=()):
+        observer = _observer
+        if observer is None:
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            observer.on_statement(sql, parameters, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        observer = _observer
+        if observer is None:
+            return super().executemany(sql, seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            observer.on_statement(sql, None, time.perf_counter() - start)
+
+
+class ConnectionPool:
+    """
+    Bounded pool of warmed database connections.
+
+    Connections are created lazily up to ``max_size`` and reused in LIFO order
+    so the most recently used (and best cached) connection is handed out first.
+    The backend (see create_backend) opens them; by default it is picked from
+    the database name.
+    """
+
+    def __init__(self, database: str, max_size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT,
+                 backend: Optional['StorageBackend'] = None):
+        self.database = database
+        self.backend = backend or create_backend(database)
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._size = 0
+        self._closed = False
+        self._stats = {
+            'acquired': 0,
+            'created': 0,
+            'timeouts': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+        }
+
+    def _connect(self) -> PooledConnection:
+        return self.backend.connect(self)
+
+    def acquire(self) -> PooledConnection:
+        """Take a connection from the pool, opening a new one if there is room."""
+        start = time.perf_counter()
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._size < self.max_size:
+                    self._size += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._size -= 1
+                    raise
+                with self._lock:
+                    self._stats['created'] += 1
+            else:
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._stats['timeouts'] += 1
+                    raise sqlite3.OperationalError(
+                        f'Timed out after {self.timeout}s waiting for a database connection'
+                    )
+
+        waited = time.perf_counter() - start
+        with self._lock:
+            self._stats['acquired'] += 1
+            self._stats['wait_time_total'] += waited
+            self._stats['wait_time_max'] = max(self._stats['wait_time_max'], waited)
+        if _observer is not None:
+            _observer.on_connection(waited)
+        return conn
+
+    def release(self, conn: PooledConnection):
+        """Return a connection to the pool, rolling back anything left uncommitted."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except self.backend.Error:
+            self._drop(conn)
+            return
+        if self._closed:
+            self._drop(conn)
+            return
+        self._idle.put(conn)
+
+    def _drop(self, conn: PooledConnection):
+        with self._lock:
+            self._size -= 1
+        conn.discard()
+
+    def warm(self, count: Optional[int] = None):
+        """Open connections ahead of time so the first requests don't pay for them."""
+        count = self.max_size if count is None else min(count, self.max_size)
+        conns = [self.acquire() for _ in range(count)]
+        for conn in conns:
+            self.release(conn)
+
+    def close_all(self):
+        """Close every idle connection and stop pooling new ones."""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._drop(conn)
+
+    def stats(self) -> Dict:
+        """Return pool size and wait-time metrics."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+        stats['idle'] = self._idle.qsize()
+        stats['in_use'] = stats['size'] - stats['idle']
+        stats['max_size'] = self.max_size
+        stats['wait_time_avg'] = (
+            stats['wait_time_total'] / stats['acquired'] if stats['acquired'] else 0.0
+        )
+        return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_inherited_pools = []  # Pools copied from the parent process by fork; kept so they are never closed here
+
+# Told about every statement and connection checkout when set (see set_observer)
+_observer = None
+
+# Read-through cache in front of get_book_by_id / get_book_by_isbn
+book_cache = create_cache(max_size=BOOK_CACHE_SIZE, ttl=BOOK_CACHE_TTL)
+
+
+def configure_book_cache(url: Optional[str] = None, max_size: int = BOOK_CACHE_SIZE,
+                         ttl: Optional[float] = BOOK_CACHE_TTL):
+    """Replace the book cache, e.g. with a shared RedisCache (redis://...) for multiple workers."""
+    global book_cache
+    book_cache = create_cache(url, max_size=max_size, ttl=ttl)
+    return book_cache
+
+
+def invalidate_book(book_id: int):
+    """Drop a book from the cache after it has been written."""
+    key = _book_cache_key(book_id)
+    if key:
+        book_cache.delete(key)
+
+
+def get_book_cache_stats() -> Dict:
+    """Get hit/miss/eviction counters for the book cache."""
+    return book_cache.stats()
+
+
+# Catalog version: bumped with every write that changes what the catalog and
+# search pages show, so rendered responses can be cached per version. The
+# counter is a row in the database (see migration 8), so every worker process
+# and the import CLI see the same version.
+CATALOG_VERSION_BUMP = 'UPDATE catalog_version SET version = version + 1, modified_at = ? WHERE id = 1'
+
+
+def bump_catalog_version(conn: Optional[sqlite3.Connection] = None):
+    """
+    Record that the books table changed. Pass the connection of an open
+    transaction to bump the version in the same commit as the change;
+    without one the bump is committed on its own.
+    """
+    if conn is not None:
+        conn.execute(CATALOG_VERSION_BUMP, (time.time(),))
+        return
+    conn = get_db_connection()
+    try:
+        conn.execute(CATALOG_VERSION_BUMP, (time.time(),))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_catalog_version() -> Tuple[int, float]:
+    """Get (version, time of the last change as a Unix timestamp) for the catalog."""
+    conn = get_db_connection()
+    try:
+        row = conn.execute('SELECT version, modified_at FROM catalog_version WHERE id = 1').fetchone()
+    finally:
+        conn.close()
+    return row['version'], row['modified_at']
+
+
+def _catalog_reset():
+    """Forget everything cached in this process about the catalog (cleared or switched to another file)."""
+    book_cache.clear()
+
+
+_checkpointer = None
+
+
+def configure_connection(conn: sqlite3.Connection):
+    """
+    Apply the per-connection storage pragmas to a freshly opened connection.
+
+    They go through sqlite3.Connection.execute directly so the observer doesn't
+    count them against the query budget of the request that opened it.
+    """
+    for pragma, value in STORAGE_SETTINGS.items():
+        if pragma not in STARTUP_PRAGMAS:
+            sqlite3.Connection.execute(conn, f'PRAGMA {pragma} = {value}')
+
+
+def configure_storage(settings: Optional[Dict] = None) -> Dict:
+    """
+    Override storage tuning settings.
+
+    Only connections opened afterwards pick up the new values, so callers
+    should reconfigure the pool (init_app does this) after changing them.
+    """
+    if settings:
+        unknown = set(settings) - set(STORAGE_SETTINGS)
+        if unknown:
+            raise ValueError(f"Unknown storage settings: {', '.join(sorted(unknown))}")
+        STORAGE_SETTINGS.update(settings)
+    return dict(STORAGE_SETTINGS)
+
+
+def apply_startup_pragmas(conn: sqlite3.Connection):
+    """Apply the pragmas that persist in the database file (e.g. journal_mode), unobserved."""
+    for pragma in STARTUP_PRAGMAS:
+        sqlite3.Connection.execute(conn, f'PRAGMA {pragma} = {STORAGE_SETTINGS[pragma]}').fetchone()
+
+
+def run_checkpoint(mode: str = CHECKPOINT_MODE) -> Dict:
+    """Checkpoint the write-ahead log into the main database file."""
+    mode = mode.upper()
+    if mode not in CHECKPOINT_MODES:
+        raise ValueError(f"Unknown checkpoint mode: {mode}")
+    conn = get_pool().acquire()
+    try:
+        busy, log_frames, checkpointed = conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+    finally:
+        conn.close()
+    return {'busy': bool(busy), 'log_frames': log_frames, 'checkpointed_frames': checkpointed}
+
+
+class WalCheckpointer(threading.Thread):
+    """Daemon thread that checkpoints the WAL on a fixed interval."""
+
+    def __init__(self, interval: float = CHECKPOINT_INTERVAL, mode: str = CHECKPOINT_MODE):
+        super().__init__(name='wal-checkpointer', daemon=True)
+        self.interval = interval
+        self.mode = mode
+        self.runs = 0
+        self.last_result = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.last_result = run_checkpoint(self.mode)
+                self.runs += 1
+            except sqlite3.Error as e:
+                self.last_result = {'error': str(e)}
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop_event.set()
+        self.join(timeout)
+
+
+def start_checkpointer(interval: float = CHECKPOINT_INTERVAL, mode: str = CHECKPOINT_MODE) -> WalCheckpointer:
+    """Start the background checkpointer, replacing any that is already running."""
+    global _checkpointer
+    stop_checkpointer()
+    _checkpointer = WalCheckpointer(interval, mode)
+    _checkpointer.start()
+    return _checkpointer
+
+
+def stop_checkpointer():
+    """Stop the background checkpointer if one is running."""
+    global _checkpointer
+    if _checkpointer is not None:
+        _checkpointer.stop()
+        _checkpointer = None
+
+
+def get_pool() -> ConnectionPool:
+    """Get the process-wide connection pool, creating it on first use."""
+    global _pool
+    pool = _pool
+    if pool is None or pool.database != DATABASE:
+        with _pool_lock:
+            if _pool is None or _pool.database != DATABASE:
+                if _pool is not None:
+                    _pool.close_all()
+                _pool = ConnectionPool(DATABASE)
+                _catalog_reset()
+            pool = _pool
+    return pool
+
+
+def configure_pool(database: Optional[str] = None, max_size: int = POOL_SIZE,
+                   timeout: float = POOL_TIMEOUT, backend: Optional['StorageBackend'] = None) -> ConnectionPool:
+    """Replace the connection pool, e.g. to point it at another database file or server."""
+    global DATABASE, _pool
+    with _pool_lock:
+        if database is not None:
+            DATABASE = database
+        if _pool is not None:
+            _pool.close_all()
+        _pool = ConnectionPool(DATABASE, max_size=max_size, timeout=timeout, backend=backend)
+    _catalog_reset()
+    return _pool
+
+
+def reset_pool_after_fork() -> ConnectionPool:
+    """
+    Give a forked worker process a pool of its own.
+
+    Database connections must not cross a fork, so the inherited pool is set
+    aside without closing its connections (that would touch the parent's
+    handles) and a new, empty pool with the same settings replaces it. The
+    checkpointer thread doesn't survive a fork either and is forgotten.
+    """
+    global _pool, _pool_lock, _checkpointer
+    _pool_lock = threading.Lock()  # May have been held by another thread at fork time
+    inherited = _pool
+    if inherited is not None:
+        _inherited_pools.append(inherited)
+        _pool = ConnectionPool(inherited.database, max_size=inherited.max_size, timeout=inherited.timeout,
+                               backend=inherited.backend)
+    _checkpointer = None
+    return get_pool()
+
+
+def set_observer(observer):
+    """
+    Install an object whose on_statement(sql, parameters, seconds) is called
+    after every statement run on a pooled connection (parameters is None for
+    executemany) and on_connection(seconds) after every pool checkout, or
+    None to stop. Used by the instrumentation module.
+    """
+    global _observer
+    _observer = observer
+
+
+def get_backend() -> 'StorageBackend':
+    """Get the storage backend behind the connection pool."""
+    return get_pool().backend
+
+
+def get_pool_stats() -> Dict:
+    """Get size and wait-time metrics for the connection pool."""
+    return get_pool().stats()
+
+
+def _app_context_connection() -> Optional[PooledConnection]:
+    """Reuse one pooled connection for the lifetime of a Flask app context."""
+    if not has_app_context():
+        return None
+    conn = g.get('_db_conn')
+    if conn is None:
+        conn = get_pool().acquire()
+        conn.pinned = True
+        g._db_conn = conn
     return conn
 
+
+def release_app_context_connection(exception=None):
+    """Return the app context's pinned connection to the pool (teardown hook)."""
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        conn.pinned = False
+        conn.close()
+
+
+def init_app(app):
+    """Configure the connection pool from the Flask app config and tie it to the app context."""
+    database = app.config.get('DATABASE', DATABASE)
+    backend = create_backend(database, app.config.get('DB_BACKEND'))
+    max_size = app.config.get('DB_POOL_SIZE', POOL_SIZE)
+    timeout = app.config.get('DB_POOL_TIMEOUT', POOL_TIMEOUT)
+    storage = app.config.get('DB_STORAGE_SETTINGS') or {}
+    storage_changed = any(STORAGE_SETTINGS.get(k) != v for k, v in storage.items())
+    configure_storage(storage)
+    pool = get_pool()
+    if storage_changed or (pool.database, pool.max_size, pool.timeout, pool.backend.name) != (
+            database, max_size, timeout, backend.name):
+        pool = configure_pool(database, max_size, timeout, backend)
+    if app.config.get('DB_POOL_WARM', True):
+        pool.warm(app.config.get('DB_POOL_WARM_SIZE', 2))
+    configure_book_cache(
+        app.config.get('BOOK_CACHE_URL'),
+        app.config.get('BOOK_CACHE_SIZE', BOOK_CACHE_SIZE),
+        app.config.get('BOOK_CACHE_TTL', BOOK_CACHE_TTL),
+    )
+    app.teardown_appcontext(release_app_context_connection)
+
+
+def get_db_connection():
+    """Get a database connection from the pool. Call close() to hand it back."""
+    conn = _app_context_connection()
+    if conn is not None:
+        return conn
+    return get_pool().acquire()
+
 def init_database():
-    """Initialize the database with required tables."""
+    """
+    Initialize the database with required tables.
+
+    A database already at SCHEMA_VERSION is left as it is: one read of
+    schema_version replaces the CREATE TABLE and migration statements.
+    """
+    backend = get_backend()
     conn = get_db_connection()
+    backend.prepare(conn)
+    if read_schema_version(conn) >= SCHEMA_VERSION:
+        conn.close()
+        return
     
-    # Create books table
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS books (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            author TEXT NOT NULL,
-            isbn TEXT UNIQUE NOT NULL,
-            total_copies INTEGER NOT NULL,
-            available_copies INTEGER NOT NULL
-        )
-    ''')
-    
-    # Create borrow_records table
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS borrow_records (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            patron_id TEXT NOT NULL,
-            book_id INTEGER NOT NULL,
-            borrow_date TEXT NOT NULL,
-            due_date TEXT NOT NULL,
-            return_date TEXT,
-            FOREIGN KEY (book_id) REFERENCES books (id)
-        )
-    ''')
+    # Create the books and borrow_records tables
+    for statement in backend.base_schema:
+        conn.execute(statement)
     
     conn.commit()
+    migrate_database(conn)
     conn.close()
 
+# Tables the schema started with, before any migration
+BASE_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS books (
+           id INTEGER PRIMARY KEY AUTOINCREMENT,
+           title TEXT NOT NULL,
+           author TEXT NOT NULL,
+           isbn TEXT UNIQUE NOT NULL,
+           total_copies INTEGER NOT NULL,
+           available_copies INTEGER NOT NULL
+       )''',
+    '''CREATE TABLE IF NOT EXISTS borrow_records (
+           id INTEGER PRIMARY KEY AUTOINCREMENT,
+           patron_id TEXT NOT NULL,
+           book_id INTEGER NOT NULL,
+           borrow_date TEXT NOT NULL,
+           due_date TEXT NOT NULL,
+           return_date TEXT,
+           FOREIGN KEY (book_id) REFERENCES books (id)
+       )''',
+]
+
+# Schema migrations, applied in order on top of the base tables. Each entry is
+# (version, description, statements); the highest applied version is kept in
+# the schema_version table so every migration runs exactly once per database.
+MIGRATIONS = [
+    (1, 'Indexes for borrow_records and books hot queries', [
+        # Active loans per patron: borrow counts, loan lookups and returns
+        '''CREATE INDEX IF NOT EXISTS idx_borrow_records_active_patron
+           ON borrow_records (patron_id, book_id, borrow_date) WHERE return_date IS NULL''',
+        # Loans of a given book
+        '''CREATE INDEX IF NOT EXISTS idx_borrow_records_book_patron
+           ON borrow_records (book_id, patron_id)''',
+        # Patron history, newest first
+        '''CREATE INDEX IF NOT EXISTS idx_borrow_records_patron_borrow_date
+           ON borrow_records (patron_id, borrow_date)''',
+        # Overdue lookups across all active loans
+        '''CREATE INDEX IF NOT EXISTS idx_borrow_records_active_due
+           ON borrow_records (due_date) WHERE return_date IS NULL''',
+        # Case-insensitive title/author lookups and prefix LIKE searches
+        '''CREATE INDEX IF NOT EXISTS idx_books_title_nocase
+           ON books (title COLLATE NOCASE)''',
+        '''CREATE INDEX IF NOT EXISTS idx_books_author_nocase
+           ON books (author COLLATE NOCASE)''',
+    ]),
+    (2, 'Full-text search over book titles and authors', [
+        # External-content FTS5 index: the text lives in books, only the index is stored here
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+               title, author,
+               content='books', content_rowid='id',
+               tokenize='unicode61 remove_diacritics 2'
+           )''',
+        '''CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+               INSERT INTO books_fts (rowid, title, author) VALUES (new.id, new.title, new.author);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+               INSERT INTO books_fts (books_fts, rowid, title, author)
+               VALUES ('delete', old.id, old.title, old.author);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author ON books BEGIN
+               INSERT INTO books_fts (books_fts, rowid, title, author)
+               VALUES ('delete', old.id, old.title, old.author);
+               INSERT INTO books_fts (rowid, title, author) VALUES (new.id, new.title, new.author);
+           END''',
+        # Index the books that were added before this migration
+        "INSERT INTO books_fts (books_fts) VALUES ('rebuild')",
+    ]),
+    (3, 'Keyset pagination index for the catalog listing', [
+        'CREATE INDEX IF NOT EXISTS idx_books_title_id ON books (title, id)',
+    ]),
+    (4, 'Durable queue of payment and refund jobs', [
+        '''CREATE TABLE IF NOT EXISTS payment_jobs (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               kind TEXT NOT NULL,
+               patron_id TEXT,
+               book_id INTEGER,
+               amount REAL NOT NULL,
+               description TEXT,
+               status TEXT NOT NULL DEFAULT 'queued',
+               transaction_id TEXT,
+               message TEXT,
+               idempotency_key TEXT NOT NULL UNIQUE,
+               attempts INTEGER NOT NULL DEFAULT 0,
+               created_at TEXT NOT NULL,
+               updated_at TEXT NOT NULL
+           )''',
+        # Workers pick the oldest queued job
+        '''CREATE INDEX IF NOT EXISTS idx_payment_jobs_status
+           ON payment_jobs (status, id)''',
+    ]),
+    (5, 'Payments ledger with per-loan fee allocations', [
+        # One row per gateway charge; status is pending until the gateway answers
+        '''CREATE TABLE IF NOT EXISTS payments (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               patron_id TEXT NOT NULL,
+               amount REAL NOT NULL,
+               description TEXT,
+               status TEXT NOT NULL DEFAULT 'pending',
+               transaction_id TEXT,
+               idempotency_key TEXT NOT NULL UNIQUE,
+               created_at TEXT NOT NULL,
+               updated_at TEXT NOT NULL
+           )''',
+        # How much of a payment went to each loan's late fee
+        '''CREATE TABLE IF NOT EXISTS payment_allocations (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               payment_id INTEGER NOT NULL REFERENCES payments (id),
+               borrow_record_id INTEGER NOT NULL REFERENCES borrow_records (id),
+               book_id INTEGER NOT NULL,
+               amount REAL NOT NULL
+           )''',
+        '''CREATE INDEX IF NOT EXISTS idx_payment_allocations_borrow_record
+           ON payment_allocations (borrow_record_id)''',
+        '''CREATE INDEX IF NOT EXISTS idx_payment_allocations_payment
+           ON payment_allocations (payment_id)''',
+    ]),
+    (6, 'Refunds in the payments ledger and indexed payment lookups', [
+        "ALTER TABLE payments ADD COLUMN kind TEXT NOT NULL DEFAULT 'charge'",
+        # For refunds: the charge being refunded
+        'ALTER TABLE payments ADD COLUMN refund_of INTEGER REFERENCES payments (id)',
+        # Ledger entry reserved for a queued job
+        'ALTER TABLE payment_jobs ADD COLUMN payment_id INTEGER REFERENCES payments (id)',
+        # A patron's payments, newest first
+        '''CREATE INDEX IF NOT EXISTS idx_payments_patron
+           ON payments (patron_id, created_at)''',
+        # Status checks and refund validation by gateway transaction ID
+        '''CREATE INDEX IF NOT EXISTS idx_payments_transaction
+           ON payments (transaction_id)''',
+        '''CREATE INDEX IF NOT EXISTS idx_payments_refund_of
+           ON payments (refund_of) WHERE refund_of IS NOT NULL''',
+    ]),
+    (7, 'Payment reconciliation against the gateway', [
+        # When the gateway was last asked about this entry
+        'ALTER TABLE payments ADD COLUMN reconciled_at TEXT',
+        # Pending and uncertain entries old enough to reconcile
+        """CREATE INDEX IF NOT EXISTS idx_payments_status
+           ON payments (status, updated_at) WHERE status IN ('pending', 'uncertain')""",
+        # Completed charges never checked against the gateway
+        """CREATE INDEX IF NOT EXISTS idx_payments_unreconciled
+           ON payments (id) WHERE reconciled_at IS NULL AND status = 'completed' AND kind = 'charge'""",
+        # Disagreements between the ledger and the gateway, one row per payment and gateway status
+        '''CREATE TABLE IF NOT EXISTS payment_drift (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               payment_id INTEGER NOT NULL REFERENCES payments (id),
+               transaction_id TEXT,
+               local_status TEXT NOT NULL,
+               gateway_status TEXT NOT NULL,
+               resolved INTEGER NOT NULL DEFAULT 0,
+               detected_at TEXT NOT NULL,
+               last_seen_at TEXT NOT NULL,
+               UNIQUE (payment_id, gateway_status)
+           )''',
+        '''CREATE INDEX IF NOT EXISTS idx_payment_drift_resolved
+           ON payment_drift (resolved, id)''',
+    ]),
+    (8, 'Catalog version shared by every process', [
+        # One row, bumped by every write to books (see bump_catalog_version)
+        '''CREATE TABLE IF NOT EXISTS catalog_version (
+               id INTEGER PRIMARY KEY CHECK (id = 1),
+               version INTEGER NOT NULL,
+               modified_at REAL NOT NULL
+           )''',
+        '''INSERT OR IGNORE INTO catalog_version (id, version, modified_at)
+           VALUES (1, 0, (julianday('now') - 2440587.5) * 86400.0)''',
+    ]),
+    (9, 'Payment jobs by ledger entry', [
+        # The reconciler skips ledger entries whose job hasn't finished
+        '''CREATE INDEX IF NOT EXISTS idx_payment_jobs_payment
+           ON payment_jobs (payment_id, status)''',
+    ]),
+]
+
+# Version of the newest migration; init_database does no schema work on a database at this version
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+class StorageBackend:
+    """
+    A database engine behind the helpers in this module.
+
+    The helpers are written once, in SQLite's dialect with ``?`` and ``:name``
+    parameters, against connections with the sqlite3 interface: execute and
+    executemany return cursors with fetchone/fetchall/rowcount/lastrowid,
+    rows can be read by position or column name, and connections have
+    commit, rollback, in_transaction and the pool attributes of
+    PooledConnection. A backend opens such connections and provides the
+    parts that can't be shared: its schema and full-text search.
+    """
+
+    name = None
+    Error = Exception  # Base class of the driver's errors
+    supports_checkpoints = False  # Whether the WAL checkpointer applies
+    base_schema = ()  # Statements creating the tables, run before MIGRATIONS
+    migrations = ()  # Same versions and meaning as MIGRATIONS
+
+    def connect(self, pool: ConnectionPool):
+        """Open a connection to pool.database that the pool can hand out."""
+        raise NotImplementedError
+
+    def prepare(self, conn):
+        """Settings applied once at startup, before any schema work."""
+
+    def lock(self, conn, key: str):
+        """
+        Hold a lock on key until conn's open transaction ends (see lock_for_write).
+        Nothing to do where BEGIN IMMEDIATE already locks the whole database, as on SQLite.
+        """
+
+    def search_query(self, search_type: str, words: List[str], limit: int) -> Tuple[str, tuple]:
+        """(sql, parameters) selecting books whose search_type column matches the words, best first."""
+        raise NotImplementedError
+
+
+class SQLiteBackend(StorageBackend):
+    """A SQLite database file, tuned with STORAGE_SETTINGS. The default backend."""
+
+    name = 'sqlite'
+    Error = sqlite3.Error
+    supports_checkpoints = True
+    base_schema = BASE_SCHEMA
+    migrations = MIGRATIONS
+
+    def connect(self, pool: ConnectionPool) -> PooledConnection:
+        conn = sqlite3.connect(
+            pool.database,
+            factory=PooledConnection,
+            check_same_thread=False,
+            timeout=STORAGE_SETTINGS['busy_timeout'] / 1000,
+        )
+        conn.row_factory = sqlite3.Row  # This enables column access by name
+        configure_connection(conn)
+        conn.pool = pool
+        return conn
+
+    def prepare(self, conn: sqlite3.Connection):
+        apply_startup_pragmas(conn)
+
+    def search_query(self, search_type: str, words: List[str], limit: int) -> Tuple[str, tuple]:
+        # FTS5 phrase with the last word as a prefix, ranked by bm25
+        match = f'{search_type} : "{" ".join(words)}"*'
+        return '''
+            SELECT b.* FROM books_fts f 
+            JOIN books b ON b.id = f.rowid 
+            WHERE books_fts MATCH ? 
+            ORDER BY f.rank 
+            LIMIT ?
+        ''', (match, limit)
+
+
+BACKENDS = ('sqlite', 'postgresql')
+
+
+def create_backend(database: str, name: Optional[str] = None) -> StorageBackend:
+    """
+    Build the storage backend for a database: SQLite for a file path, or
+    PostgreSQL for a postgres:// or postgresql:// URL. Pass a name from
+    BACKENDS to choose explicitly (e.g. 'postgresql' for a key=value DSN).
+    """
+    if name is None:
+        name = 'postgresql' if database.startswith(('postgres://', 'postgresql://')) else 'sqlite'
+    if name == 'sqlite':
+        return SQLiteBackend()
+    if name == 'postgresql':
+        from postgres_backend import PostgresBackend
+        return PostgresBackend()
+    raise ValueError(f"Unknown database backend: {name}")
+
+
+def read_schema_version(conn: sqlite3.Connection) -> int:
+    """Get the highest migration version applied, without creating anything (0 for a new database)."""
+    try:
+        version = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0]
+    except get_backend().Error:
+        return 0  # No schema_version table yet
+    return version or 0
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Get the highest migration version applied to the database."""
+    conn.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)')
+    version = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0]
+    return version or 0
+
+def migrate_database(conn: sqlite3.Connection) -> int:
+    """Apply any pending schema migrations and return the resulting version."""
+    current = get_schema_version(conn)
+    conn.commit()
+    for version, description, statements in get_backend().migrations:
+        if version <= current:
+            continue
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            lock_for_write(conn, 'schema')
+            # Another process may have migrated while we waited for the lock
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute('INSERT INTO schema_version (version) VALUES (?)', (version,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        current = version
+    return current
+
 def add_sample_data():
     """Add sample data to the database if it's empty."""
     conn = get_db_connection()
-    book_count = conn.execute('SELECT COUNT(*) as count FROM books').fetchone()['count']
+    # EXISTS stops at the first row, where COUNT(*) would scan the whole table
+    has_books = conn.execute('SELECT EXISTS (SELECT 1 FROM books) AS has_books').fetchone()['has_books']
     
-    if book_count == 0:
+    if not has_books:
         # Add sample books
         sample_books = [
             ('The Great Gatsby', 'F. Scott Fitzgerald', '9780743273565', 3),
@@ -61,22 +846,24 @@ def add_sample_data():
             ('1984', 'George Orwell', '9780451524935', 1)
         ]
         
+        book_ids = {}
         for title, author, isbn, copies in sample_books:
-            conn.execute('''
+            book_ids[isbn] = conn.execute('''
                 INSERT INTO books (title, author, isbn, total_copies, available_copies)
                 VALUES (?, ?, ?, ?, ?)
-            ''', (title, author, isbn, copies, copies))
+            ''', (title, author, isbn, copies, copies)).lastrowid
         
-        # Make 1984 unavailable by adding a borrow record
+        # Make 1984 unavailable by adding a borrow record (IDs aren't reused after clear_database)
         conn.execute('''
             INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
             VALUES (?, ?, ?, ?)
-        ''', ('123456', 3, 
+        ''', ('123456', book_ids['9780451524935'], 
               (datetime.now() - timedelta(days=5)).isoformat(),
               (datetime.now() + timedelta(days=9)).isoformat()))
         
         # Update available copies for 1984
-        conn.execute('UPDATE books SET available_copies = 0 WHERE id = 3')
+        conn.execute('UPDATE books SET available_copies = 0 WHERE id = ?', (book_ids['9780451524935'],))
+        bump_catalog_version(conn)
         
         conn.commit()
     
@@ -87,35 +874,154 @@ def add_sample_data():
 def get_all_books() -> List[Dict]:
     """Get all books from the database."""
     conn = get_db_connection()
-    books = conn.execute('SELECT * FROM books ORDER BY title').fetchall()
-    conn.close()
+    try:
+        books = conn.execute('SELECT * FROM books ORDER BY title').fetchall()
+    finally:
+        conn.close()
     return [dict(book) for book in books]
 
+def encode_cursor(sort_key: str, row_id: int) -> str:
+    """Encode the (sort key, id) of the last row on a page, e.g. (title, id), as an opaque cursor."""
+    raw = json.dumps([sort_key, row_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """Decode a cursor made by encode_cursor. Raises ValueError if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort_key, row_id = json.loads(raw)
+    except Exception:
+        raise ValueError("Invalid cursor.")
+    if not isinstance(sort_key, str) or not isinstance(row_id, int):
+        raise ValueError("Invalid cursor.")
+    return sort_key, row_id
+
+def get_books_page(limit: int = CATALOG_PAGE_SIZE, cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Get one page of the catalog ordered by title, using keyset pagination.
+
+    Pass the returned cursor back in to get the following page; it is None on
+    the last page. Each page is a single index range scan on (title, id), so
+    deep pages cost the same as the first one.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    conn = get_db_connection()
+    try:
+        if cursor:
+            title, book_id = decode_cursor(cursor)
+            rows = conn.execute('''
+                SELECT * FROM books 
+                WHERE (title, id) > (?, ?) 
+                ORDER BY title, id 
+                LIMIT ?
+            ''', (title, book_id, limit + 1)).fetchall()
+        else:
+            rows = conn.execute('''
+                SELECT * FROM books ORDER BY title, id LIMIT ?
+            ''', (limit + 1,)).fetchall()
+    finally:
+        conn.close()
+
+    books = [dict(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = books[-1]
+        next_cursor = encode_cursor(last['title'], last['id'])
+    return books, next_cursor
+
+def iter_books(batch_size: int = MAX_PAGE_SIZE, cursor: Optional[str] = None) -> Iterator[Dict]:
+    """
+    Yield every book in title order without building the whole catalog in memory.
+
+    Rows are read a page at a time, and the connection goes back to the pool
+    between pages, so a slow consumer doesn't hold a connection open.
+    """
+    while True:
+        books, cursor = get_books_page(batch_size, cursor)
+        yield from books
+        if cursor is None:
+            return
+
+def _book_cache_key(book_id) -> Optional[str]:
+    """Cache key for a book ID, or None for IDs that aren't plain integers (not cached)."""
+    if isinstance(book_id, int) and not isinstance(book_id, bool):
+        return f'book:id:{book_id}'
+    return None
+
 def get_book_by_id(book_id: int) -> Optional[Dict]:
-    """Get a specific book by ID."""
+    """Get a specific book by ID (read-through cached)."""
+    key = _book_cache_key(book_id)
+    if key:
+        cached = book_cache.get(key)
+        if cached is not MISSING:
+            return dict(cached)
     conn = get_db_connection()
-    book = conn.execute('SELECT * FROM books WHERE id = ?', (book_id,)).fetchone()
-    conn.close()
-    return dict(book) if book else None
+    try:
+        book = conn.execute('SELECT * FROM books WHERE id = ?', (book_id,)).fetchone()
+    finally:
+        conn.close()
+    if not book:
+        return None
+    book = dict(book)
+    if key:
+        book_cache.set(key, book)
+    return dict(book)
 
 def get_book_by_isbn(isbn: str) -> Optional[Dict]:
-    """Get a specific book by ISBN."""
+    """Get a specific book by ISBN (read-through cached)."""
+    # ISBNs never change, so the cache maps ISBN -> ID and the book itself is
+    # read through the ID entry, which is the only one writes need to invalidate
+    book_id = book_cache.get(f'book:isbn:{isbn}')
+    if book_id is not MISSING:
+        book = get_book_by_id(book_id)
+        if book and book['isbn'] == isbn:
+            return book
     conn = get_db_connection()
-    book = conn.execute('SELECT * FROM books WHERE isbn = ?', (isbn,)).fetchone()
-    conn.close()
-    return dict(book) if book else None
+    try:
+        book = conn.execute('SELECT * FROM books WHERE isbn = ?', (isbn,)).fetchone()
+    finally:
+        conn.close()
+    if not book:
+        return None
+    book = dict(book)
+    book_cache.set(f'book:isbn:{isbn}', book['id'])
+    book_cache.set(_book_cache_key(book['id']), book)
+    return dict(book)
+
+def search_books(search_term: str, search_type: str, limit: int = SEARCH_LIMIT) -> List[Dict]:
+    """
+    Search books by title or author through the full-text index.
+
+    Words are matched as a phrase in order, with the last word treated as a
+    prefix, so "great gat" finds "The Great Gatsby". Results are ranked by
+    relevance (bm25 on SQLite), best first.
+    """
+    if search_type not in ('title', 'author'):
+        raise ValueError(f"Unsupported full-text search type: {search_type}")
+    words = re.findall(r'\w+', search_term)
+    if not words:
+        return []
+    sql, params = get_backend().search_query(search_type, words, limit)
+    conn = get_db_connection()
+    try:
+        books = conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+    return [dict(book) for book in books]
 
 def get_patron_borrowed_books(patron_id: str) -> List[Dict]:
     """Get currently borrowed books for a patron."""
     conn = get_db_connection()
-    records = conn.execute('''
-        SELECT br.*, b.title, b.author 
-        FROM borrow_records br 
-        JOIN books b ON br.book_id = b.id 
-        WHERE br.patron_id = ? AND br.return_date IS NULL
-        ORDER BY br.borrow_date
-    ''', (patron_id,)).fetchall()
-    conn.close()
+    try:
+        records = conn.execute('''
+            SELECT br.*, b.title, b.author 
+            FROM borrow_records br 
+            JOIN books b ON br.book_id = b.id 
+            WHERE br.patron_id = ? AND br.return_date IS NULL
+            ORDER BY br.borrow_date
+        ''', (patron_id,)).fetchall()
+    finally:
+        conn.close()
     
     borrowed_books = []
     for record in records:
@@ -130,14 +1036,189 @@ def get_patron_borrowed_books(patron_id: str) -> List[Dict]:
     
     return borrowed_books
 
+def get_active_loan(patron_id: str, book_id: int) -> Optional[Dict]:
+    """Get a patron's unreturned borrow record for a book in a single indexed query."""
+    conn = get_db_connection()
+    try:
+        return find_active_loan(conn, patron_id, book_id)
+    finally:
+        conn.close()
+
+# Fee per active loan computed in SQL: whole days overdue from julianday() and
+# the tiered schedule as a CASE expression. Parameters come from a fee policy
+# (see services/fee_policy.py) plus :today as an ISO date. The cap is a CASE
+# rather than SQLite's two-argument MIN() so other backends can run it too.
+OVERDUE_FEES_CTE = '''
+    WITH overdue AS (
+        SELECT br.id, br.patron_id, br.book_id, b.title, b.author, br.due_date,
+               CAST(julianday(:today) - julianday(substr(br.due_date, 1, 10)) AS INTEGER) AS days_overdue
+        FROM borrow_records br
+        JOIN books b ON br.book_id = b.id
+        WHERE br.return_date IS NULL AND br.due_date < :today {patron_filter}
+    ),
+    tiered AS (
+        SELECT overdue.*,
+               CASE WHEN days_overdue <= :first_tier_days THEN days_overdue * :first_tier_rate
+                    ELSE :first_tier_days * :first_tier_rate + (days_overdue - :first_tier_days) * :later_rate
+               END AS uncapped_fee
+        FROM overdue
+        WHERE days_overdue > 0
+    ),
+    fees AS (
+        SELECT tiered.*,
+               ROUND(CASE WHEN uncapped_fee > :max_fee THEN :max_fee ELSE uncapped_fee END, 2) AS fee_amount
+        FROM tiered
+    ),
+    outstanding AS (
+        SELECT fees.*, ROUND(fee_amount - COALESCE((
+                   SELECT SUM(pa.amount)
+                   FROM payment_allocations pa
+                   JOIN payments p ON p.id = pa.payment_id
+                   WHERE pa.borrow_record_id = fees.id AND p.status IN ('pending', 'completed', 'uncertain')
+               ), 0), 2) AS outstanding_amount
+        FROM fees
+    )
+'''
+
+# Payment statuses whose allocations count against a loan's fee. Uncertain
+# payments (the gateway didn't answer) hold their allocation until reconciled.
+ALLOCATED_PAYMENT_STATUSES = ('pending', 'completed', 'uncertain')
+
+def _fee_params(today: date, policy) -> Dict:
+    """Bind parameters for OVERDUE_FEES_CTE."""
+    return {
+        'today': today.isoformat(),
+        'first_tier_rate': policy.first_tier_rate,
+        'first_tier_days': policy.first_tier_days,
+        'later_rate': policy.later_rate,
+        'max_fee': policy.max_fee,
+    }
+
+def get_overdue_fee_totals(today: date, policy) -> Dict:
+    """
+    Compute outstanding late fees for every active loan in the library.
+
+    Day differences and the tiered schedule are evaluated in SQL over the
+    active-loan due-date index, so no per-loan rows are parsed in Python.
+    Amounts already allocated to payments are subtracted.
+
+    Args:
+        today: Date to compute fees as of
+        policy: Fee schedule (first_tier_rate, first_tier_days, later_rate, max_fee)
+
+    Returns:
+        dict: {'patrons': [...], 'books': [...]} with per-patron and per-book totals,
+              each sorted by total fee, highest first
+    """
+    cte = OVERDUE_FEES_CTE.format(patron_filter='')
+    params = _fee_params(today, policy)
+    conn = get_db_connection()
+    try:
+        patrons = conn.execute(cte + '''
+            SELECT patron_id, COUNT(*) AS overdue_loans, SUM(days_overdue) AS days_overdue,
+                   ROUND(SUM(outstanding_amount), 2) AS fee_total
+            FROM outstanding
+            WHERE outstanding_amount > 0
+            GROUP BY patron_id
+            ORDER BY fee_total DESC, patron_id
+        ''', params).fetchall()
+        books = conn.execute(cte + '''
+            SELECT book_id, title, author, COUNT(*) AS overdue_loans,
+                   ROUND(SUM(outstanding_amount), 2) AS fee_total
+            FROM outstanding
+            WHERE outstanding_amount > 0
+            GROUP BY book_id, title, author
+            ORDER BY fee_total DESC, book_id
+        ''', params).fetchall()
+    finally:
+        conn.close()
+    return {'patrons': [dict(row) for row in patrons], 'books': [dict(row) for row in books]}
+
+def get_patron_active_loans(patron_id: str, now: datetime) -> List[Dict]:
+    """Get a patron's unreturned loans, newest first, flagging those past their due date."""
+    conn = get_db_connection()
+    try:
+        records = conn.execute('''
+            SELECT b.title, b.author, b.isbn, br.borrow_date, br.due_date, br.return_date,
+                   br.due_date < ? AS is_overdue
+            FROM borrow_records br 
+            JOIN books b ON br.book_id = b.id 
+            WHERE br.patron_id = ? AND br.return_date IS NULL
+            ORDER BY br.borrow_date DESC
+        ''', (now.isoformat(), patron_id)).fetchall()
+    finally:
+        conn.close()
+    loans = [dict(record) for record in records]
+    for loan in loans:
+        loan['is_overdue'] = bool(loan['is_overdue'])
+    return loans
+
+def get_patron_late_fee_total(patron_id: str, today: date, policy) -> float:
+    """Sum the outstanding late fees on a patron's active loans in SQL."""
+    params = _fee_params(today, policy)
+    params['patron_id'] = patron_id
+    conn = get_db_connection()
+    try:
+        total = conn.execute(
+            OVERDUE_FEES_CTE.format(patron_filter='AND br.patron_id = :patron_id')
+            + 'SELECT ROUND(COALESCE(SUM(outstanding_amount), 0), 2) FROM outstanding WHERE outstanding_amount > 0',
+            params
+        ).fetchone()[0]
+    finally:
+        conn.close()
+    return float(total)
+
+def get_patron_history(patron_id: str, limit: int = HISTORY_PAGE_SIZE,
+                       cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Get one page of a patron's borrowing history, newest first, using keyset pagination.
+
+    Returns:
+        tuple: (records, cursor for the next page or None on the last page)
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    conn = get_db_connection()
+    try:
+        if cursor:
+            borrow_date, record_id = decode_cursor(cursor)
+            rows = conn.execute('''
+                SELECT br.id, b.title, b.author, b.isbn, br.borrow_date, br.due_date, br.return_date
+                FROM borrow_records br
+                JOIN books b ON br.book_id = b.id
+                WHERE br.patron_id = ? AND (br.borrow_date, br.id) < (?, ?)
+                ORDER BY br.borrow_date DESC, br.id DESC
+                LIMIT ?
+            ''', (patron_id, borrow_date, record_id, limit + 1)).fetchall()
+        else:
+            rows = conn.execute('''
+                SELECT br.id, b.title, b.author, b.isbn, br.borrow_date, br.due_date, br.return_date
+                FROM borrow_records br
+                JOIN books b ON br.book_id = b.id
+                WHERE br.patron_id = ?
+                ORDER BY br.borrow_date DESC, br.id DESC
+                LIMIT ?
+            ''', (patron_id, limit + 1)).fetchall()
+    finally:
+        conn.close()
+
+    history = [dict(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(history[-1]['borrow_date'], history[-1]['id'])
+    for record in history:
+        del record['id']
+    return history, next_cursor
+
 def get_patron_borrow_count(patron_id: str) -> int:
     """Get the number of books currently borrowed by a patron."""
     conn = get_db_connection()
-    count = conn.execute('''
-        SELECT COUNT(*) as count FROM borrow_records 
-        WHERE patron_id = ? AND return_date IS NULL
-    ''', (patron_id,)).fetchone()['count']
-    conn.close()
+    try:
+        count = conn.execute('''
+            SELECT COUNT(*) as count FROM borrow_records 
+            WHERE patron_id = ? AND return_date IS NULL
+        ''', (patron_id,)).fetchone()['count']
+    finally:
+        conn.close()
     return count
 
 def insert_book(title: str, author: str, isbn: str, total_copies: int, available_copies: int) -> bool:
@@ -148,6 +1229,7 @@ def insert_book(title: str, author: str, isbn: str, total_copies: int, available
             INSERT INTO books (title, author, isbn, total_copies, available_copies)
             VALUES (?, ?, ?, ?, ?)
         ''', (title, author, isbn, total_copies, available_copies))
+        bump_catalog_version(conn)
         conn.commit()
         conn.close()
         return True
@@ -155,6 +1237,36 @@ def insert_book(title: str, author: str, isbn: str, total_copies: int, available
         conn.close()
         return False
 
+def insert_books_bulk(books: List[Tuple[str, str, str, int]]) -> Tuple[int, List[str]]:
+    """
+    Insert many (title, author, isbn, total_copies) rows in one transaction.
+
+    ISBNs already in the catalog are checked in chunks inside the same write
+    transaction, so a concurrent insert can't slip in between the check and
+    the executemany.
+
+    Returns:
+        tuple: (number of books inserted, ISBNs skipped because they already exist)
+    """
+    if not books:
+        return 0, []
+    with transaction() as conn:
+        existing = set()
+        isbns = [book[2] for book in books]
+        for start in range(0, len(isbns), ISBN_LOOKUP_CHUNK):
+            chunk = isbns[start:start + ISBN_LOOKUP_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(f'SELECT isbn FROM books WHERE isbn IN ({placeholders})', chunk)
+            existing.update(row['isbn'] for row in rows)
+        new_books = [book for book in books if book[2] not in existing]
+        conn.executemany('''
+            INSERT INTO books (title, author, isbn, total_copies, available_copies)
+            VALUES (?, ?, ?, ?, ?)
+        ''', ((title, author, isbn, copies, copies) for title, author, isbn, copies in new_books))
+        if new_books:
+            bump_catalog_version(conn)
+    return len(new_books), [isbn for isbn in isbns if isbn in existing]
+
 def insert_borrow_record(patron_id: str, book_id: int, borrow_date: datetime, due_date: datetime) -> bool:
     """Insert a new borrow record into the database."""
     conn = get_db_connection()
@@ -177,8 +1289,10 @@ def update_book_availability(book_id: int, change: int) -> bool:
         conn.execute('''
             UPDATE books SET available_copies = available_copies + ? WHERE id = ?
         ''', (change, book_id))
+        bump_catalog_version(conn)
         conn.commit()
         conn.close()
+        invalidate_book(book_id)
         return True
     except Exception as e:
         conn.close()
@@ -200,11 +1314,419 @@ def update_borrow_record_return_date(patron_id: str, book_id: int, return_date:
         conn.close()
         return False
     
+def get_payment_job(job_id: int) -> Optional[Dict]:
+    """Get a payment job by ID."""
+    conn = get_db_connection()
+    try:
+        job = conn.execute('SELECT * FROM payment_jobs WHERE id = ?', (job_id,)).fetchone()
+    finally:
+        conn.close()
+    return dict(job) if job else None
+
+def claim_payment_job() -> Optional[Dict]:
+    """
+    Mark the oldest queued job as running and return it, or None if the queue is empty.
+    The claim is a single UPDATE that re-checks the status, so concurrent workers
+    never get the same job.
+    """
+    conn = get_db_connection()
+    try:
+        job = conn.execute('''
+            UPDATE payment_jobs
+            SET status = 'running', attempts = attempts + 1, updated_at = ?
+            WHERE id = (SELECT id FROM payment_jobs WHERE status = 'queued' ORDER BY id LIMIT 1)
+              AND status = 'queued'
+            RETURNING *
+        ''', (datetime.now().isoformat(),)).fetchone()
+        conn.commit()
+    finally:
+        conn.close()
+    return dict(job) if job else None
+
+def finish_payment_job(job_id: int, status: str, message: str, transaction_id: Optional[str] = None) -> bool:
+    """Record the outcome ('succeeded' or 'failed') of a running job."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute('''
+            UPDATE payment_jobs
+            SET status = ?, message = ?, transaction_id = COALESCE(?, transaction_id), updated_at = ?
+            WHERE id = ? AND status = 'running'
+        ''', (status, message, transaction_id, datetime.now().isoformat(), job_id))
+        conn.commit()
+        return cursor.rowcount == 1
+    finally:
+        conn.close()
+
+def requeue_running_payment_jobs(claimed_before: datetime) -> int:
+    """Put jobs claimed before a cutoff and never finished back on the queue. Returns how many."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute('''
+            UPDATE payment_jobs SET status = 'queued', updated_at = ?
+            WHERE status = 'running' AND updated_at < ?
+        ''', (datetime.now().isoformat(), claimed_before.isoformat()))
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        conn.close()
+
+# Transactional helpers: these run on a connection owned by transaction() and
+# leave committing (or rolling back) to the caller.
+
+@contextmanager
+def transaction():
+    """
+    Run a block of statements in one BEGIN IMMEDIATE transaction.
+
+    On SQLite the write lock is taken up front, so concurrent borrows and
+    returns are serialised instead of racing between their read and write
+    steps. Backends with row-level locking only serialise what the block
+    locks with lock_for_write, and rely on conditional UPDATEs for the rest.
+    The transaction is committed when the block exits normally and rolled
+    back if it raises.
+    """
+    conn = get_db_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        yield conn
+        if conn.changed_books:
+            bump_catalog_version(conn)
+        conn.commit()
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        # Drop cached copies of changed books only once the change is visible
+        if conn.changed_books:
+            for book_id in conn.changed_books:
+                invalidate_book(book_id)
+            conn.changed_books.clear()
+        conn.close()
+
+def lock_for_write(conn: sqlite3.Connection, key: str):
+    """
+    Serialise transaction() blocks that read rows and then write based on
+    what they read, e.g. a patron's loan count before a borrow. Blocks locking
+    the same key (such as 'patron:123456') run one at a time until commit.
+    """
+    get_backend().lock(conn, key)
+
+def fetch_book(conn: sqlite3.Connection, book_id: int) -> Optional[Dict]:
+    """Get a specific book by ID on an existing connection."""
+    book = conn.execute('SELECT * FROM books WHERE id = ?', (book_id,)).fetchone()
+    return dict(book) if book else None
+
+def count_active_loans(conn: sqlite3.Connection, patron_id: str) -> int:
+    """Get the number of books currently borrowed by a patron on an existing connection."""
+    return conn.execute('''
+        SELECT COUNT(*) as count FROM borrow_records 
+        WHERE patron_id = ? AND return_date IS NULL
+    ''', (patron_id,)).fetchone()['count']
+
+def find_active_loan(conn: sqlite3.Connection, patron_id: str, book_id: int) -> Optional[Dict]:
+    """Get the oldest unreturned borrow record of a book by a patron (with its title and author) on an existing connection."""
+    record = conn.execute('''
+        SELECT br.*, b.title, b.author 
+        FROM borrow_records br 
+        JOIN books b ON br.book_id = b.id 
+        WHERE br.patron_id = ? AND br.book_id = ? AND br.return_date IS NULL
+        ORDER BY br.borrow_date
+        LIMIT 1
+    ''', (patron_id, book_id)).fetchone()
+    if not record:
+        return None
+    loan = dict(record)
+    loan['borrow_date'] = datetime.fromisoformat(loan['borrow_date'])
+    loan['due_date'] = datetime.fromisoformat(loan['due_date'])
+    return loan
+
+def claim_book_copy(conn: sqlite3.Connection, book_id: int) -> bool:
+    """Take one available copy of a book. Returns False if none are left."""
+    cursor = conn.execute('''
+        UPDATE books SET available_copies = available_copies - 1 
+        WHERE id = ? AND available_copies > 0
+    ''', (book_id,))
+    conn.changed_books.add(book_id)
+    return cursor.rowcount == 1
+
+def release_book_copy(conn: sqlite3.Connection, book_id: int) -> bool:
+    """Put one copy of a book back on the shelf."""
+    cursor = conn.execute('''
+        UPDATE books SET available_copies = available_copies + 1 WHERE id = ?
+    ''', (book_id,))
+    conn.changed_books.add(book_id)
+    return cursor.rowcount == 1
+
+def create_borrow_record(conn: sqlite3.Connection, patron_id: str, book_id: int,
+                         borrow_date: datetime, due_date: datetime) -> int:
+    """Insert a new borrow record on an existing connection and return its ID."""
+    cursor = conn.execute('''
+        INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+        VALUES (?, ?, ?, ?)
+    ''', (patron_id, book_id, borrow_date.isoformat(), due_date.isoformat()))
+    return cursor.lastrowid
+
+def close_borrow_record(conn: sqlite3.Connection, record_id: int, return_date: datetime) -> bool:
+    """Set the return date of an open borrow record on an existing connection."""
+    cursor = conn.execute('''
+        UPDATE borrow_records SET return_date = ? 
+        WHERE id = ? AND return_date IS NULL
+    ''', (return_date.isoformat(), record_id))
+    return cursor.rowcount == 1
+
+def fetch_outstanding_fees(conn: sqlite3.Connection, patron_id: str, today: date, policy) -> List[Dict]:
+    """
+    Get a patron's loans that still owe late fees, oldest due first, in one query.
+    Each row has borrow_record_id, book_id, title, days_overdue, fee_amount and outstanding_amount.
+    """
+    params = _fee_params(today, policy)
+    params['patron_id'] = patron_id
+    rows = conn.execute(
+        OVERDUE_FEES_CTE.format(patron_filter='AND br.patron_id = :patron_id') + '''
+        SELECT id AS borrow_record_id, book_id, title, author, due_date, days_overdue,
+               fee_amount, outstanding_amount
+        FROM outstanding
+        WHERE outstanding_amount > 0
+        ORDER BY due_date, id
+        ''', params).fetchall()
+    return [dict(row) for row in rows]
+
+def create_payment(conn: sqlite3.Connection, patron_id: str, amount: float, description: str,
+                   idempotency_key: str, allocations: List[Tuple[int, int, float]] = (),
+                   kind: str = 'charge', refund_of: Optional[int] = None,
+                   transaction_id: Optional[str] = None) -> int:
+    """
+    Record a pending ledger entry: a charge with its (borrow_record_id, book_id, amount)
+    allocations, or a refund of an earlier charge. Returns the payment ID.
+    """
+    now = datetime.now().isoformat()
+    cursor = conn.execute('''
+        INSERT INTO payments (patron_id, kind, amount, description, status, transaction_id, refund_of,
+                              idempotency_key, created_at, updated_at)
+        VALUES (?, ?, ?, ?, 'pending', ?, ?, ?, ?, ?)
+    ''', (patron_id, kind, amount, description, transaction_id, refund_of, idempotency_key, now, now))
+    payment_id = cursor.lastrowid
+    conn.executemany('''
+        INSERT INTO payment_allocations (payment_id, borrow_record_id, book_id, amount)
+        VALUES (?, ?, ?, ?)
+    ''', ((payment_id, record_id, book_id, share) for record_id, book_id, share in allocations))
+    return payment_id
+
+def fetch_paid_amount(conn: sqlite3.Connection, borrow_record_id: int) -> float:
+    """Sum the payment allocations that count against a loan's late fee."""
+    placeholders = ','.join('?' * len(ALLOCATED_PAYMENT_STATUSES))
+    paid = conn.execute(f'''
+        SELECT COALESCE(SUM(pa.amount), 0)
+        FROM payment_allocations pa
+        JOIN payments p ON p.id = pa.payment_id
+        WHERE pa.borrow_record_id = ? AND p.status IN ({placeholders})
+    ''', (borrow_record_id, *ALLOCATED_PAYMENT_STATUSES)).fetchone()[0]
+    return float(paid)
+
+def find_charge(conn: sqlite3.Connection, transaction_id: str) -> Optional[Dict]:
+    """Get the ledger charge for a gateway transaction ID, with the amount refunded so far."""
+    placeholders = ','.join('?' * len(ALLOCATED_PAYMENT_STATUSES))
+    charge = conn.execute(f'''
+        SELECT p.*, ROUND(COALESCE((
+                   SELECT SUM(r.amount) FROM payments r
+                   WHERE r.refund_of = p.id AND r.status IN ({placeholders})
+               ), 0), 2) AS refunded_amount
+        FROM payments p
+        WHERE p.transaction_id = ? AND p.kind = 'charge'
+        ORDER BY p.id
+        LIMIT 1
+    ''', (*ALLOCATED_PAYMENT_STATUSES, transaction_id)).fetchone()
+    return dict(charge) if charge else None
+
+def create_payment_job(conn: sqlite3.Connection, kind: str, amount: float, patron_id: Optional[str] = None,
+                       book_id: Optional[int] = None, description: str = '',
+                       transaction_id: Optional[str] = None, payment_id: Optional[int] = None,
+                       idempotency_key: Optional[str] = None) -> int:
+    """Queue a payment or refund job on an existing connection, optionally tied to a ledger entry."""
+    now = datetime.now().isoformat()
+    cursor = conn.execute('''
+        INSERT INTO payment_jobs (kind, patron_id, book_id, amount, description, transaction_id,
+                                  payment_id, idempotency_key, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (kind, patron_id, book_id, amount, description, transaction_id, payment_id,
+          idempotency_key or f'{kind}-{uuid.uuid4().hex}', now, now))
+    return cursor.lastrowid
+
+def update_payment_status(payment_id: int, status: str, transaction_id: Optional[str] = None) -> bool:
+    """
+    Record the gateway's answer ('completed', 'failed' or 'uncertain') and
+    transaction ID on a payment that is still pending or uncertain.
+
+    A payment the reconciler already settled keeps its status. If the answer
+    contradicts it (e.g. a late charge on a payment marked failed, whose fees
+    are payable again), it is recorded as unresolved drift so the charge can
+    be refunded by hand. Returns True if the status was changed.
+    """
+    now = datetime.now().isoformat()
+    with transaction() as conn:
+        changed = conn.execute('''
+            UPDATE payments
+            SET status = ?, transaction_id = COALESCE(?, transaction_id), updated_at = ?
+            WHERE id = ? AND status IN ('pending', 'uncertain')
+        ''', (status, transaction_id, now, payment_id)).rowcount == 1
+        if not changed and status != 'uncertain':
+            payment = conn.execute('SELECT status, transaction_id FROM payments WHERE id = ?',
+                                   (payment_id,)).fetchone()
+            if payment and payment['status'] != status:
+                _record_drift(conn, payment_id, transaction_id or payment['transaction_id'],
+                              payment['status'], status, False, now)
+    return changed
+
+def get_payment(payment_id: int) -> Optional[Dict]:
+    """Get a payment with its per-loan allocations."""
+    conn = get_db_connection()
+    try:
+        payment = conn.execute('SELECT * FROM payments WHERE id = ?', (payment_id,)).fetchone()
+        if not payment:
+            return None
+        allocations = conn.execute('''
+            SELECT pa.borrow_record_id, pa.book_id, b.title, pa.amount
+            FROM payment_allocations pa
+            JOIN books b ON b.id = pa.book_id
+            WHERE pa.payment_id = ?
+            ORDER BY pa.id
+        ''', (payment_id,)).fetchall()
+    finally:
+        conn.close()
+    payment = dict(payment)
+    payment['allocations'] = [dict(row) for row in allocations]
+    return payment
+
+def get_charge_by_transaction(transaction_id: str) -> Optional[Dict]:
+    """Look up a charge by gateway transaction ID in the local ledger (indexed)."""
+    conn = get_db_connection()
+    try:
+        return find_charge(conn, transaction_id)
+    finally:
+        conn.close()
+
+def get_patron_payments(patron_id: str, limit: int = HISTORY_PAGE_SIZE) -> List[Dict]:
+    """Get a patron's charges and refunds from the ledger, newest first."""
+    conn = get_db_connection()
+    try:
+        rows = conn.execute('''
+            SELECT id, kind, amount, status, transaction_id, refund_of, description, created_at, updated_at
+            FROM payments
+            WHERE patron_id = ?
+            ORDER BY created_at DESC, id DESC
+            LIMIT ?
+        ''', (patron_id, limit)).fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in rows]
+
+def get_unreconciled_payments(updated_before: datetime, checked_before: datetime,
+                              limit: int = HISTORY_PAGE_SIZE) -> List[Dict]:
+    """
+    Get ledger entries due a check against the gateway: pending and uncertain
+    entries untouched since updated_before and not checked since
+    checked_before, then completed charges that were never checked. Entries
+    whose queued job hasn't finished are left to the job.
+    """
+    conn = get_db_connection()
+    try:
+        rows = conn.execute('''
+            SELECT * FROM (
+                SELECT id, kind, patron_id, amount, status, transaction_id, refund_of, idempotency_key
+                FROM payments
+                WHERE status IN ('pending', 'uncertain') AND updated_at < ?
+                  AND (reconciled_at IS NULL OR reconciled_at < ?)
+                  AND NOT EXISTS (
+                      SELECT 1 FROM payment_jobs j
+                      WHERE j.payment_id = payments.id AND j.status IN ('queued', 'running')
+                  )
+                ORDER BY updated_at
+                LIMIT ?
+            ) AS stale
+            UNION ALL
+            SELECT * FROM (
+                SELECT id, kind, patron_id, amount, status, transaction_id, refund_of, idempotency_key
+                FROM payments
+                WHERE reconciled_at IS NULL AND status = 'completed' AND kind = 'charge'
+                ORDER BY id
+                LIMIT ?
+            ) AS unchecked
+        ''', (updated_before.isoformat(), checked_before.isoformat(), limit, limit)).fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in rows[:limit]]
+
+def record_reconciliation(payment: Dict, gateway_status: Optional[str] = None,
+                          new_status: Optional[str] = None, transaction_id: Optional[str] = None) -> bool:
+    """
+    Record that a ledger entry was checked against the gateway.
+
+    new_status replaces the entry's status if it hasn't changed since it was
+    read and no job for it is queued or running, filling in transaction_id
+    if the entry had none. A gateway_status
+    that differs from the entry's status is recorded as drift, marked
+    resolved when new_status settled it. Returns True if the status was changed.
+    """
+    now = datetime.now().isoformat()
+    transaction_id = payment['transaction_id'] or transaction_id
+    with transaction() as conn:
+        changed = False
+        if new_status:
+            changed = conn.execute('''
+                UPDATE payments SET status = ?, transaction_id = ?, updated_at = ?, reconciled_at = ?
+                WHERE id = ? AND status = ?
+                  AND NOT EXISTS (
+                      SELECT 1 FROM payment_jobs j
+                      WHERE j.payment_id = payments.id AND j.status IN ('queued', 'running')
+                  )
+            ''', (new_status, transaction_id, now, now, payment['id'], payment['status'])).rowcount == 1
+        if not changed:
+            conn.execute('UPDATE payments SET reconciled_at = ? WHERE id = ?', (now, payment['id']))
+        if gateway_status and gateway_status != payment['status']:
+            _record_drift(conn, payment['id'], transaction_id, payment['status'], gateway_status, changed, now)
+    return changed
+
+def _record_drift(conn: sqlite3.Connection, payment_id: int, transaction_id: Optional[str],
+                  local_status: str, gateway_status: str, resolved: bool, now: str):
+    """Insert or refresh the drift row for a payment's disagreement with the gateway."""
+    conn.execute('''
+        INSERT INTO payment_drift (payment_id, transaction_id, local_status, gateway_status,
+                                   resolved, detected_at, last_seen_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (payment_id, gateway_status) DO UPDATE SET
+            last_seen_at = excluded.last_seen_at, resolved = excluded.resolved
+    ''', (payment_id, transaction_id, local_status, gateway_status, int(resolved), now, now))
+
+def get_payment_drift(resolved: Optional[bool] = False, limit: int = HISTORY_PAGE_SIZE) -> List[Dict]:
+    """Get recorded ledger/gateway disagreements, newest first (resolved=None returns both kinds)."""
+    conn = get_db_connection()
+    try:
+        if resolved is None:
+            rows = conn.execute('SELECT * FROM payment_drift ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+        else:
+            rows = conn.execute('''
+                SELECT * FROM payment_drift WHERE resolved = ? ORDER BY id DESC LIMIT ?
+            ''', (int(resolved), limit)).fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in rows]
+    
 # I have added this function because when I try to test and add a book, it fails because book already exists. without this I would have to switch all the book IDs every time
 def clear_database():
     """Delete all data from all tables (for testing)."""
     conn = get_db_connection()
-    conn.execute("DELETE FROM borrow_records")
-    conn.execute("DELETE FROM books")
-    conn.commit()
-    conn.close()
+    try:
+        # Referencing tables first, for backends that enforce foreign keys
+        conn.execute("DELETE FROM payment_drift")
+        conn.execute("DELETE FROM payment_allocations")
+        conn.execute("DELETE FROM payment_jobs")
+        conn.execute("DELETE FROM payments")
+        conn.execute("DELETE FROM borrow_records")
+        conn.execute("DELETE FROM books")
+        bump_catalog_version(conn)
+        conn.commit()
+    finally:
+        conn.close()
+        _catalog_reset()
+
@@ -0,0 +1,33 @@
+"""
+gunicorn settings: gunicorn -c gunicorn.conf.py wsgi:app
+
+Mirrors serving.py (the pure-Python equivalent) and reads the same LIBRARY_*
+environment variables.
+"""
+
+import serving
+
+_config, _options = serving.load_settings()
+
+bind = _options['bind']
+workers = _options['workers']
+threads = _options['threads']
+worker_class = 'gthread'
+graceful_timeout = _options['graceful_timeout']
+accesslog = '-' if _options['access_log'] else None
+
+# Create the app (schema, sample data) once in the master and fork it
+preload_app = True
+
+
+def pre_fork(server, worker):
+    # One primary worker runs the WAL checkpointer and the reconciler; a replacement takes over
+    worker.primary = not any(getattr(other, 'primary', False) for other in server.WORKERS.values())
+
+
+def post_worker_init(worker):
+    serving.init_worker(worker.wsgi, worker.primary, _options['warm_paths'])
+
+
+def worker_exit(server, worker):
+    serving.shutdown_worker(graceful_timeout)
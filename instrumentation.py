@@ -0,0 +1,441 @@
+"""
+Instrumentation module for Library Management System
+Per-request timing, SQL statement timing, template render timing and
+service function timing, exposed as Prometheus histograms at /metrics and
+as a Server-Timing header on every response. A request can also be
+profiled on demand (when PROFILING is enabled) by sending an X-Profile
+header or a _profile query flag.
+
+Query tracing: statements slower than SLOW_QUERY_THRESHOLD are logged, and
+with QUERY_TRACING set each request's statements are checked for repeats and
+N+1 patterns. Routes can declare a query budget with @query_budget(n), which
+is logged or raised (QUERY_BUDGET_MODE) when exceeded; tests can use
+assert_max_queries() around any block of code.
+"""
+
+import cProfile
+import io
+import logging
+import pstats
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from flask import (
+    Response, before_render_template, current_app, g, has_request_context, request, template_rendered
+)
+
+import database
+
+# Bucket upper bounds in seconds
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+PROFILE_TOP = 40  # Functions listed in a cProfile report
+PROFILE_MODES = ('cprofile', 'pyinstrument')
+SLOW_QUERY_THRESHOLD = 0.1  # Seconds; slower statements are logged (None disables the slow-query log)
+N_PLUS_ONE_THRESHOLD = 5  # Runs of one statement shape with different parameters that count as N+1
+QUERY_BUDGET_MODES = ('off', 'warn', 'raise')
+TRANSACTION_CONTROL = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE')
+
+logger = logging.getLogger('library.sql')
+
+
+class QueryBudgetExceeded(Exception):
+    """A route or block ran more statements than its declared budget."""
+
+
+class Histogram:
+    """Thread-safe Prometheus histogram with a fixed set of label names."""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = REQUEST_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str):
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self) -> Dict[Tuple[str, ...], Dict]:
+        """Count and sum per label set."""
+        with self._lock:
+            return {labels: {'count': s[-1], 'sum': s[-2]} for labels, s in self._series.items()}
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labels, list(values)) for labels, values in self._series.items())
+        for labelvalues, values in series:
+            labels = list(zip(self.labelnames, labelvalues))
+            for bound, count in zip(self.buckets, values):
+                lines.append(f'{self.name}_bucket{_labels(labels + [("le", repr(bound))])} {count}')
+            lines.append(f'{self.name}_bucket{_labels(labels + [("le", "+Inf")])} {values[-1]}')
+            lines.append(f'{self.name}_sum{_labels(labels)} {values[-2]!r}')
+            lines.append(f'{self.name}_count{_labels(labels)} {values[-1]}')
+        return lines
+
+
+def _labels(pairs: Iterable[Tuple[str, str]]) -> str:
+    pairs = list(pairs)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+REQUEST_SECONDS = Histogram('library_request_duration_seconds', 'Time spent handling a request.',
+                            ('method', 'route', 'status'))
+SQL_SECONDS = Histogram('library_sql_statement_duration_seconds', 'Time spent executing a SQL statement.',
+                        ('statement',), SQL_BUCKETS)
+CONNECTION_SECONDS = Histogram('library_db_connection_wait_seconds',
+                               'Time spent taking a connection from the pool.', (), SQL_BUCKETS)
+RENDER_SECONDS = Histogram('library_template_render_seconds', 'Time spent rendering a template.',
+                           ('template',))
+SERVICE_SECONDS = Histogram('library_service_duration_seconds', 'Time spent in a service layer function.',
+                            ('function',))
+HISTOGRAMS = (REQUEST_SECONDS, SQL_SECONDS, CONNECTION_SECONDS, RENDER_SECONDS, SERVICE_SECONDS)
+
+_enabled = False
+_slow_query_threshold = SLOW_QUERY_THRESHOLD
+_captures = threading.local()  # Active capture_queries() blocks on this thread
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace and IN (?, ?, ...) lists so one statement is one metric series."""
+    sql = re.sub(r'\s+', ' ', sql).strip()
+    return re.sub(r'\?(\s*,\s*\?)+', '?, ...', sql)
+
+
+class RequestStats:
+    """What one request spent its time on (kept on flask.g while it runs)."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.statements = []  # (sql, parameters, seconds) in the order they ran
+        self.db_time = 0.0
+        self.connection_time = 0.0
+        self.render_time = 0.0
+        self.services = []  # (function name, seconds)
+        self._render_started = None
+
+    def server_timing(self, total: float) -> str:
+        return ', '.join((
+            f'app;dur={total * 1000:.2f}',
+            f'db;dur={self.db_time * 1000:.2f};desc="{len(self.statements)} queries"',
+            f'conn;dur={self.connection_time * 1000:.2f}',
+            f'render;dur={self.render_time * 1000:.2f}',
+        ))
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    """The running request's RequestStats, or None outside an instrumented request."""
+    if not has_request_context():
+        return None
+    return g.get('_request_stats')
+
+
+class _DatabaseObserver:
+    """Receives statement and connection timings from database.py."""
+
+    def on_statement(self, sql: str, parameters, seconds: float):
+        SQL_SECONDS.observe(seconds, normalize_sql(sql))
+        stats = current_request_stats()
+        if stats is not None:
+            stats.statements.append((sql, parameters, seconds))
+            stats.db_time += seconds
+        for capture in getattr(_captures, 'active', ()):
+            capture.append((sql, parameters, seconds))
+        if _slow_query_threshold is not None and seconds >= _slow_query_threshold:
+            where = f'{request.method} {request.path}' if has_request_context() else 'background'
+            logger.warning('Slow query (%.1f ms, %s): %s', seconds * 1000, where, normalize_sql(sql))
+
+    def on_connection(self, seconds: float):
+        CONNECTION_SECONDS.observe(seconds)
+        stats = current_request_stats()
+        if stats is not None:
+            stats.connection_time += seconds
+
+
+def analyze_statements(statements: List[Tuple], n_plus_one: int = N_PLUS_ONE_THRESHOLD,
+                       slow: Optional[float] = None) -> Dict:
+    """
+    Look for wasted round trips in a list of (sql, parameters, seconds).
+
+    Returns:
+        dict: count and total time, plus 'repeated' (identical statement and
+              parameters run more than once), 'n_plus_one' (one statement shape
+              run n_plus_one or more times with different parameters) and
+              'slow' (statements taking at least `slow` seconds)
+    """
+    slow = _slow_query_threshold if slow is None else slow
+    identical = Counter()
+    shapes = Counter()
+    for sql, parameters, _ in statements:
+        text = normalize_sql(sql)
+        if text.upper().startswith(TRANSACTION_CONTROL):
+            continue
+        identical[(text, repr(parameters))] += 1
+        shapes[text] += 1
+    variants = Counter(text for text, _ in identical)  # Distinct parameter sets per shape
+    return {
+        'count': len(statements),
+        'time': sum(seconds for _, _, seconds in statements),
+        'repeated': [{'sql': text, 'parameters': params, 'count': count}
+                     for (text, params), count in identical.items() if count > 1],
+        'n_plus_one': [{'sql': text, 'count': count} for text, count in shapes.items()
+                       if count >= n_plus_one and variants[text] > 1],
+        'slow': [{'sql': normalize_sql(sql), 'seconds': seconds} for sql, _, seconds in statements
+                 if slow is not None and seconds >= slow],
+    }
+
+
+@contextmanager
+def capture_queries():
+    """Collect the (sql, parameters, seconds) of every statement this thread runs in the block."""
+    captured = []
+    installed = database._observer is None
+    if installed:
+        database.set_observer(_DatabaseObserver())
+    active = getattr(_captures, 'active', None)
+    if active is None:
+        active = _captures.active = []
+    active.append(captured)
+    try:
+        yield captured
+    finally:
+        active.remove(captured)
+        if installed:
+            database.set_observer(None)
+
+
+@contextmanager
+def assert_max_queries(limit: int):
+    """Raise QueryBudgetExceeded if the block runs more than `limit` statements."""
+    with capture_queries() as captured:
+        yield captured
+    if len(captured) > limit:
+        raise QueryBudgetExceeded(
+            f'{len(captured)} statements run, budget is {limit}:\n'
+            + '\n'.join(f'  {normalize_sql(sql)}' for sql, _, _ in captured)
+        )
+
+
+def query_budget(limit: int):
+    """
+    Declare the most statements a route may run. Put it directly under the
+    route decorator; QUERY_BUDGET_MODE decides what happens when it is exceeded.
+    """
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+def instrumented(func: Callable) -> Callable:
+    """Time a service function into library_service_duration_seconds."""
+    name = func.__name__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            SERVICE_SECONDS.observe(elapsed, name)
+            stats = current_request_stats()
+            if stats is not None:
+                stats.services.append((name, elapsed))
+    return wrapper
+
+
+def _gauges() -> List[str]:
+    # Imported here: importing routes at module level would be circular (services use instrumented)
+    from routes.http_cache import get_response_cache_stats
+
+    lines = []
+
+    def gauge(name, help_text, samples, kind='gauge'):
+        lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} {kind}'])
+        lines.extend(f'{name}{_labels(labels)} {value}' for labels, value in samples)
+
+    pool = database.get_pool_stats()
+    gauge('library_db_pool_connections', 'Pooled database connections.',
+          [([('state', 'in_use')], pool['in_use']), ([('state', 'idle')], pool['idle'])])
+    gauge('library_db_pool_timeouts_total', 'Connection requests that timed out.', [([], pool['timeouts'])], 'counter')
+    for cache_name, stats in (('book', database.get_book_cache_stats()), ('response', get_response_cache_stats())):
+        gauge(f'library_{cache_name}_cache_requests_total', f'Lookups in the {cache_name} cache.',
+              [([('result', 'hit')], stats['hits']), ([('result', 'miss')], stats['misses'])], 'counter')
+    return lines
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    lines.extend(_gauges())
+    return '\n'.join(lines) + '\n'
+
+
+def reset_metrics():
+    """Forget everything recorded so far (for tests)."""
+    for histogram in HISTOGRAMS:
+        histogram.clear()
+
+
+def _profile_mode() -> Optional[str]:
+    mode = request.headers.get('X-Profile') or request.args.get('_profile')
+    if not mode:
+        return None
+    mode = mode.lower()
+    return mode if mode in PROFILE_MODES else 'cprofile'
+
+
+def _start_profiler(mode: str):
+    if mode == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            mode = 'cprofile'
+        else:
+            profiler = Profiler()
+            profiler.start()
+            return mode, profiler
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return mode, profiler
+
+
+def _profile_report(mode: str, profiler, stats: RequestStats, total: float, response) -> Response:
+    if mode == 'pyinstrument':
+        profiler.stop()
+        profile = profiler.output_text(unicode=True)
+    else:
+        profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_TOP)
+        profile = out.getvalue()
+    lines = [
+        f'{request.method} {request.full_path.rstrip("?")} -> {response.status_code}',
+        f'total {total * 1000:.2f} ms, db {stats.db_time * 1000:.2f} ms in {len(stats.statements)} statements, '
+        f'connection wait {stats.connection_time * 1000:.2f} ms, render {stats.render_time * 1000:.2f} ms',
+        '',
+        'Service functions:',
+    ]
+    lines += [f'  {seconds * 1000:9.3f} ms  {name}' for name, seconds in stats.services] or ['  (none)']
+    lines += ['', 'SQL statements:']
+    lines += [f'  {seconds * 1000:9.3f} ms  {normalize_sql(sql)}' for sql, _, seconds in stats.statements] or ['  (none)']
+    report = analyze_statements(stats.statements)
+    for item in report['repeated']:
+        lines.append(f"  repeated {item['count']}x with {item['parameters']}: {item['sql']}")
+    for item in report['n_plus_one']:
+        lines.append(f"  N+1 ({item['count']} runs): {item['sql']}")
+    lines += ['', f'Profile ({mode}):', profile]
+    return Response('\n'.join(lines), mimetype='text/plain')
+
+
+def _before_request():
+    g._request_stats = RequestStats()
+    if current_app.config.get('PROFILING'):
+        mode = _profile_mode()
+        if mode:
+            g._profiler = _start_profiler(mode)
+
+
+def _on_render_start(sender, template, context, **extra):
+    stats = current_request_stats()
+    if stats is not None:
+        stats._render_started = time.perf_counter()
+
+
+def _on_render_end(sender, template, context, **extra):
+    stats = current_request_stats()
+    if stats is not None and stats._render_started is not None:
+        elapsed = time.perf_counter() - stats._render_started
+        stats.render_time += elapsed
+        stats._render_started = None
+        RENDER_SECONDS.observe(elapsed, template.name or 'string')
+
+
+def _check_queries(stats: RequestStats):
+    """Log repeated and N+1 statements (QUERY_TRACING) and enforce the route's query budget."""
+    where = f'{request.method} {request.path}'
+    if current_app.config.get('QUERY_TRACING'):
+        report = analyze_statements(stats.statements)
+        for item in report['repeated']:
+            logger.warning('%s ran an identical statement %d times: %s %s',
+                           where, item['count'], item['sql'], item['parameters'])
+        for item in report['n_plus_one']:
+            logger.warning('%s looks like an N+1 query (%d runs): %s', where, item['count'], item['sql'])
+
+    view = current_app.view_functions.get(request.endpoint)
+    budget = getattr(view, 'query_budget', None)
+    mode = current_app.config.get('QUERY_BUDGET_MODE', 'warn')
+    if budget is None or mode == 'off' or len(stats.statements) <= budget:
+        return
+    message = f'{where} ran {len(stats.statements)} statements, budget is {budget}'
+    if mode == 'raise':
+        raise QueryBudgetExceeded(message + ':\n' + '\n'.join(
+            f'  {normalize_sql(sql)}' for sql, _, _ in stats.statements))
+    logger.warning(message)
+
+
+def _after_request(response):
+    stats = g.pop('_request_stats', None)
+    if stats is None:
+        return response
+    total = time.perf_counter() - stats.start
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    REQUEST_SECONDS.observe(total, request.method, route, str(response.status_code))
+    _check_queries(stats)
+    profiler = g.pop('_profiler', None)
+    if profiler is not None:
+        response = _profile_report(*profiler, stats, total, response)
+    response.headers['Server-Timing'] = stats.server_timing(total)
+    return response
+
+
+def init_app(app):
+    """
+    Turn on instrumentation for an app (INSTRUMENTATION config, on by default)
+    and register /metrics. Profiling on request is only honoured when the
+    PROFILING config is set; QUERY_TRACING, SLOW_QUERY_THRESHOLD and
+    QUERY_BUDGET_MODE control query tracing.
+    """
+    global _enabled, _slow_query_threshold
+    _enabled = bool(app.config.get('INSTRUMENTATION', True))
+    _slow_query_threshold = app.config.get('SLOW_QUERY_THRESHOLD', SLOW_QUERY_THRESHOLD)
+    if app.config.get('QUERY_BUDGET_MODE', 'warn') not in QUERY_BUDGET_MODES:
+        raise ValueError(f"QUERY_BUDGET_MODE must be one of {', '.join(QUERY_BUDGET_MODES)}")
+    database.set_observer(_DatabaseObserver() if _enabled else None)
+    if not _enabled:
+        return
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    before_render_template.connect(_on_render_start, app)
+    template_rendered.connect(_on_render_end, app)
+    app.add_url_rule('/metrics', 'metrics',
+                     lambda: Response(render_metrics(), mimetype='text/plain; version=0.0.4'))
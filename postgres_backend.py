@@ -0,0 +1,377 @@
+"""
+PostgreSQL storage backend for Library Management System
+Runs the helpers in database.py against a PostgreSQL server, so several
+application nodes can share one database
+
+Requires the optional ``psycopg`` package (requirements-postgres.txt).
+Selected by database.create_backend for a postgres:// or postgresql://
+DATABASE, or with DB_BACKEND='postgresql'.
+"""
+
+import re
+import time
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+import database
+from database import StorageBackend
+
+try:
+    import psycopg
+except ImportError:
+    psycopg = None
+
+# Statements that open a transaction implicitly, as the sqlite3 module does
+_WRITE_STATEMENT = re.compile(r'\s*(INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+_BEGIN_IMMEDIATE = re.compile(r'\s*BEGIN\s+IMMEDIATE\s*;?\s*$', re.IGNORECASE)
+
+# ? and :name outside quotes become psycopg placeholders; quoted text and ::
+# casts are kept, and every % is escaped since psycopg reads it even in quotes
+_SQL_TOKEN = re.compile(r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|::|\?|:[A-Za-z_]\w*|%""")
+
+
+@lru_cache(maxsize=1024)
+def translate(sql: str) -> str:
+    """Rewrite SQLite-style ``?`` and ``:name`` parameters as psycopg's ``%s`` and ``%(name)s``."""
+    def replace(match):
+        token = match.group()
+        if token == '?':
+            return '%s'
+        if token[0] == ':' and token != '::':
+            return f'%({token[1:]})s'
+        return token.replace('%', '%%')
+    return _SQL_TOKEN.sub(replace, sql)
+
+
+class Row:
+    """A result row readable by position or column name, like sqlite3.Row."""
+
+    __slots__ = ('_columns', '_index', '_values')
+
+    def __init__(self, columns: Tuple[str, ...], index: Dict[str, int], values: tuple):
+        self._columns = columns
+        self._index = index
+        self._values = values
+
+    def keys(self) -> List[str]:
+        return list(self._columns)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._values[self._index[key]]
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __eq__(self, other):
+        if isinstance(other, Row):
+            return self._columns == other._columns and self._values == other._values
+        return NotImplemented
+
+    def __repr__(self):
+        return f'Row({dict(zip(self._columns, self._values))!r})'
+
+
+def _row_factory(cursor):
+    """psycopg row factory building Rows that share the cursor's column names."""
+    columns = tuple(column.name for column in cursor.description or ())
+    index = {}
+    for position, name in enumerate(columns):
+        index.setdefault(name, position)  # The first of duplicate names wins, as in sqlite3
+    return lambda values: Row(columns, index, values)
+
+
+class PostgresCursor:
+    """psycopg cursor with the sqlite3 cursor's lastrowid."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    @property
+    def lastrowid(self):
+        # The identity value generated by the last INSERT on this connection,
+        # so read it before running anything else
+        return self._cursor.connection.execute('SELECT lastval()').fetchone()[0]
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class PostgresConnection:
+    """
+    psycopg connection handed out by a ConnectionPool with the parts of the
+    sqlite3 interface the helpers use.
+
+    Like the sqlite3 module, statements run outside a transaction until an
+    INSERT, UPDATE or DELETE opens one implicitly, and commit()/rollback()
+    end it. BEGIN IMMEDIATE is a plain BEGIN: transaction() blocks run
+    concurrently, guarded by row locks, conditional UPDATEs and the advisory
+    locks taken by PostgresBackend.lock.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.pool = None
+        self.pinned = False
+        self.changed_books = set()  # Books written in the open transaction (see database.transaction())
+
+    @property
+    def in_transaction(self) -> bool:
+        return self.raw.info.transaction_status != psycopg.pq.TransactionStatus.IDLE
+
+    def _execute(self, sql, parameters):
+        if _BEGIN_IMMEDIATE.match(sql):
+            return PostgresCursor(self.raw.execute('BEGIN'))
+        if not self.in_transaction and _WRITE_STATEMENT.match(sql):
+            self.raw.execute('BEGIN')
+        if parameters:
+            return PostgresCursor(self.raw.execute(translate(sql), parameters))
+        return PostgresCursor(self.raw.execute(sql))
+
+    def execute(self, sql, parameters=()):
+        observer = database._observer
+        if observer is None:
+            return self._execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return self._execute(sql, parameters)
+        finally:
+            observer.on_statement(sql, parameters, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        observer = database._observer
+        start = time.perf_counter()
+        try:
+            if not self.in_transaction:
+                self.raw.execute('BEGIN')
+            cursor = self.raw.cursor()
+            cursor.executemany(translate(sql), seq_of_parameters)
+            return PostgresCursor(cursor)
+        finally:
+            if observer is not None:
+                observer.on_statement(sql, None, time.perf_counter() - start)
+
+    def commit(self):
+        if self.in_transaction:
+            self.raw.execute('COMMIT')
+
+    def rollback(self):
+        if self.in_transaction:
+            self.raw.execute('ROLLBACK')
+
+    def close(self):
+        if self.pinned:
+            # Owned by the current app context; just drop any unfinished work
+            if self.in_transaction:
+                self.rollback()
+            return
+        if self.pool is not None:
+            self.pool.release(self)
+        else:
+            self.raw.close()
+
+    def discard(self):
+        """Really close the underlying server connection."""
+        self.pool = None
+        self.pinned = False
+        self.raw.close()
+
+
+# Functions the shared queries call that PostgreSQL doesn't have: SQLite's
+# julianday() on ISO date strings, and two-argument ROUND() on floats.
+COMPAT_FUNCTIONS = [
+    '''CREATE OR REPLACE FUNCTION julianday(value TEXT) RETURNS DOUBLE PRECISION AS $$
+           SELECT EXTRACT(EPOCH FROM value::timestamp)::double precision / 86400 + 2440587.5
+       $$ LANGUAGE SQL STABLE''',
+    '''CREATE OR REPLACE FUNCTION round(value DOUBLE PRECISION, digits INTEGER) RETURNS DOUBLE PRECISION AS $$
+           SELECT round(value::numeric, digits)::double precision
+       $$ LANGUAGE SQL IMMUTABLE''',
+]
+
+# database.BASE_SCHEMA in PostgreSQL's dialect. Titles and authors sort
+# bytewise (COLLATE "C") as they do on SQLite, so pages and cursors agree.
+BASE_SCHEMA = COMPAT_FUNCTIONS + [
+    '''CREATE TABLE IF NOT EXISTS books (
+           id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+           title TEXT COLLATE "C" NOT NULL,
+           author TEXT COLLATE "C" NOT NULL,
+           isbn TEXT UNIQUE NOT NULL,
+           total_copies INTEGER NOT NULL,
+           available_copies INTEGER NOT NULL
+       )''',
+    '''CREATE TABLE IF NOT EXISTS borrow_records (
+           id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+           patron_id TEXT NOT NULL,
+           book_id INTEGER NOT NULL REFERENCES books (id),
+           borrow_date TEXT NOT NULL,
+           due_date TEXT NOT NULL,
+           return_date TEXT
+       )''',
+]
+
+# database.MIGRATIONS in PostgreSQL's dialect, version for version, so
+# SCHEMA_VERSION means the same schema on either backend.
+MIGRATIONS = [
+    (1, 'Indexes for borrow_records and books hot queries', [
+        '''CREATE INDEX IF NOT EXISTS idx_borrow_records_active_patron
+           ON borrow_records (patron_id, book_id, borrow_date) WHERE return_date IS NULL''',
+        '''CREATE INDEX IF NOT EXISTS idx_borrow_records_book_patron
+           ON borrow_records (book_id, patron_id)''',
+        '''CREATE INDEX IF NOT EXISTS idx_borrow_records_patron_borrow_date
+           ON borrow_records (patron_id, borrow_date)''',
+        '''CREATE INDEX IF NOT EXISTS idx_borrow_records_active_due
+           ON borrow_records (due_date) WHERE return_date IS NULL''',
+        '''CREATE INDEX IF NOT EXISTS idx_books_title_lower
+           ON books (lower(title))''',
+        '''CREATE INDEX IF NOT EXISTS idx_books_author_lower
+           ON books (lower(author))''',
+    ]),
+    (2, 'Full-text search over book titles and authors', [
+        # Expression indexes matching the to_tsvector() calls in search_query
+        '''CREATE INDEX IF NOT EXISTS idx_books_title_fts
+           ON books USING GIN (to_tsvector('simple', title))''',
+        '''CREATE INDEX IF NOT EXISTS idx_books_author_fts
+           ON books USING GIN (to_tsvector('simple', author))''',
+    ]),
+    (3, 'Keyset pagination index for the catalog listing', [
+        'CREATE INDEX IF NOT EXISTS idx_books_title_id ON books (title, id)',
+    ]),
+    (4, 'Durable queue of payment and refund jobs', [
+        '''CREATE TABLE IF NOT EXISTS payment_jobs (
+               id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+               kind TEXT NOT NULL,
+               patron_id TEXT,
+               book_id INTEGER,
+               amount DOUBLE PRECISION NOT NULL,
+               description TEXT,
+               status TEXT NOT NULL DEFAULT 'queued',
+               transaction_id TEXT,
+               message TEXT,
+               idempotency_key TEXT NOT NULL UNIQUE,
+               attempts INTEGER NOT NULL DEFAULT 0,
+               created_at TEXT NOT NULL,
+               updated_at TEXT NOT NULL
+           )''',
+        '''CREATE INDEX IF NOT EXISTS idx_payment_jobs_status
+           ON payment_jobs (status, id)''',
+    ]),
+    (5, 'Payments ledger with per-loan fee allocations', [
+        '''CREATE TABLE IF NOT EXISTS payments (
+               id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+               patron_id TEXT NOT NULL,
+               amount DOUBLE PRECISION NOT NULL,
+               description TEXT,
+               status TEXT NOT NULL DEFAULT 'pending',
+               transaction_id TEXT,
+               idempotency_key TEXT NOT NULL UNIQUE,
+               created_at TEXT NOT NULL,
+               updated_at TEXT NOT NULL
+           )''',
+        '''CREATE TABLE IF NOT EXISTS payment_allocations (
+               id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+               payment_id INTEGER NOT NULL REFERENCES payments (id),
+               borrow_record_id INTEGER NOT NULL REFERENCES borrow_records (id),
+               book_id INTEGER NOT NULL,
+               amount DOUBLE PRECISION NOT NULL
+           )''',
+        '''CREATE INDEX IF NOT EXISTS idx_payment_allocations_borrow_record
+           ON payment_allocations (borrow_record_id)''',
+        '''CREATE INDEX IF NOT EXISTS idx_payment_allocations_payment
+           ON payment_allocations (payment_id)''',
+    ]),
+    (6, 'Refunds in the payments ledger and indexed payment lookups', [
+        "ALTER TABLE payments ADD COLUMN IF NOT EXISTS kind TEXT NOT NULL DEFAULT 'charge'",
+        'ALTER TABLE payments ADD COLUMN IF NOT EXISTS refund_of INTEGER REFERENCES payments (id)',
+        'ALTER TABLE payment_jobs ADD COLUMN IF NOT EXISTS payment_id INTEGER REFERENCES payments (id)',
+        '''CREATE INDEX IF NOT EXISTS idx_payments_patron
+           ON payments (patron_id, created_at)''',
+        '''CREATE INDEX IF NOT EXISTS idx_payments_transaction
+           ON payments (transaction_id)''',
+        '''CREATE INDEX IF NOT EXISTS idx_payments_refund_of
+           ON payments (refund_of) WHERE refund_of IS NOT NULL''',
+    ]),
+    (7, 'Payment reconciliation against the gateway', [
+        'ALTER TABLE payments ADD COLUMN IF NOT EXISTS reconciled_at TEXT',
+        """CREATE INDEX IF NOT EXISTS idx_payments_status
+           ON payments (status, updated_at) WHERE status IN ('pending', 'uncertain')""",
+        """CREATE INDEX IF NOT EXISTS idx_payments_unreconciled
+           ON payments (id) WHERE reconciled_at IS NULL AND status = 'completed' AND kind = 'charge'""",
+        '''CREATE TABLE IF NOT EXISTS payment_drift (
+               id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+               payment_id INTEGER NOT NULL REFERENCES payments (id),
+               transaction_id TEXT,
+               local_status TEXT NOT NULL,
+               gateway_status TEXT NOT NULL,
+               resolved INTEGER NOT NULL DEFAULT 0,
+               detected_at TEXT NOT NULL,
+               last_seen_at TEXT NOT NULL,
+               UNIQUE (payment_id, gateway_status)
+           )''',
+        '''CREATE INDEX IF NOT EXISTS idx_payment_drift_resolved
+           ON payment_drift (resolved, id)''',
+    ]),
+    (8, 'Catalog version shared by every process', [
+        '''CREATE TABLE IF NOT EXISTS catalog_version (
+               id INTEGER PRIMARY KEY CHECK (id = 1),
+               version INTEGER NOT NULL,
+               modified_at DOUBLE PRECISION NOT NULL
+           )''',
+        '''INSERT INTO catalog_version (id, version, modified_at)
+           VALUES (1, 0, EXTRACT(EPOCH FROM now())::double precision)
+           ON CONFLICT (id) DO NOTHING''',
+    ]),
+    (9, 'Payment jobs by ledger entry', [
+        # The reconciler skips ledger entries whose job hasn't finished
+        '''CREATE INDEX IF NOT EXISTS idx_payment_jobs_payment
+           ON payment_jobs (payment_id, status)''',
+    ]),
+]
+
+
+class PostgresBackend(StorageBackend):
+    """
+    A PostgreSQL database, given as a libpq connection string or URL
+    (e.g. postgresql://library@db.internal/library).
+
+    Connections are pooled by database.ConnectionPool like SQLite's.
+    Full-text search uses to_tsvector/to_tsquery with the 'simple'
+    configuration over GIN expression indexes.
+    """
+
+    name = 'postgresql'
+    base_schema = BASE_SCHEMA
+    migrations = MIGRATIONS
+
+    def __init__(self):
+        if psycopg is None:
+            raise RuntimeError("PostgresBackend requires the 'psycopg' package (pip install -r requirements-postgres.txt).")
+        self.Error = psycopg.Error
+
+    def connect(self, pool) -> PostgresConnection:
+        raw = psycopg.connect(pool.database, autocommit=True, row_factory=_row_factory,
+                              connect_timeout=max(2, int(pool.timeout)))
+        conn = PostgresConnection(raw)
+        conn.pool = pool
+        return conn
+
+    def lock(self, conn: PostgresConnection, key: str):
+        # Transaction-scoped advisory lock on the key's hash, shared by every node.
+        # Run on the raw connection so query budgets match SQLite's.
+        conn.raw.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', (key,))
+
+    def search_query(self, search_type: str, words: List[str], limit: int) -> Tuple[str, tuple]:
+        # Words in order, adjacent, with the last one as a prefix: "great <-> gat:*"
+        query = ' <-> '.join(words) + ':*'
+        return f'''
+            SELECT * FROM books
+            WHERE to_tsvector('simple', {search_type}) @@ to_tsquery('simple', ?)
+            ORDER BY ts_rank(to_tsvector('simple', {search_type}), to_tsquery('simple', ?)) DESC, id
+            LIMIT ?
+        ''', (query, query, limit)
@@ -2,12 +2,28 @@
 API Routes - JSON API endpoints
 """
 
-from flask import Blueprint, jsonify, request
-from services.library_service import calculate_late_fee_for_book, search_books_in_catalog
+import io
+import json
+from datetime import date
+from flask import Blueprint, Response, jsonify, request, stream_with_context, url_for
+from database import (
+    decode_cursor, get_books_page, iter_books, get_payment_job, get_patron_payments, get_payment_drift,
+    CATALOG_PAGE_SIZE, HISTORY_PAGE_SIZE, MAX_PAGE_SIZE
+)
+from services.library_service import (
+    calculate_late_fee_for_book, search_books_in_catalog,
+    borrow_books_batch, return_books_batch, get_overdue_fee_report,
+    get_patron_status_report, settle_patron_fees, get_payment_status
+)
+from services.import_service import import_books, detect_format, IMPORT_CHUNK_SIZE, IMPORT_FORMATS
+from services.payment_queue import enqueue_late_fee_payment, enqueue_refund
+from instrumentation import query_budget
+from .http_cache import catalog_cached
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
 @api_bp.route('/late_fee/<patron_id>/<int:book_id>')
+@query_budget(1)
 def get_late_fee(patron_id, book_id):
     """
     Calculate late fee for a specific book borrowed by a patron.
@@ -17,6 +33,8 @@ def get_late_fee(patron_id, book_id):
     return jsonify(result), 501 if 'not implemented' in result.get('status', '') else 200
 
 @api_bp.route('/search')
+@query_budget(2)  # Catalog version plus the page itself
+@catalog_cached
 def search_books_api():
     """
     Search for books via API endpoint.
@@ -37,3 +55,271 @@ def search_books_api():
         'results': books,
         'count': len(books)
     })
+
+@api_bp.route('/books')
+@query_budget(1)
+def list_books_api():
+    """
+    List the catalog as JSON using keyset pagination.
+    API interface for R2: Book Catalog Display
+    
+    Query parameters: limit, cursor (from the previous page's next_cursor) and
+    stream=1 to stream every remaining book as one JSON array instead of a page.
+    """
+    limit = request.args.get('limit', CATALOG_PAGE_SIZE, type=int)
+    cursor = request.args.get('cursor') or None
+    
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    
+    if request.args.get('stream') in ('1', 'true'):
+        def generate():
+            yield '['
+            for i, book in enumerate(iter_books(cursor=cursor)):
+                yield (',' if i else '') + json.dumps(book)
+            yield ']'
+        
+        return Response(stream_with_context(generate()), mimetype='application/json')
+    
+    books, next_cursor = get_books_page(limit, cursor)
+    
+    return jsonify({
+        'books': books,
+        'count': len(books),
+        'next_cursor': next_cursor
+    })
+
+@api_bp.route('/books/bulk', methods=['POST'])
+def bulk_import_books_api():
+    """
+    Bulk import books from a CSV or JSON Lines upload.
+    Batch interface for R1: Book Catalog Management
+    
+    Accepts a multipart upload in the "file" field or the raw file as the
+    request body. The format comes from the "format" query parameter, else the
+    file name or content type.
+    """
+    upload = request.files.get('file')
+    if upload:
+        stream = upload.stream
+        fmt = request.args.get('format') or detect_format(upload.filename, upload.mimetype)
+    else:
+        stream = request.stream
+        fmt = request.args.get('format') or detect_format(None, request.content_type)
+    
+    if fmt not in IMPORT_FORMATS:
+        return jsonify({'error': f"Unsupported import format: {fmt}"}), 400
+    
+    chunk_size = request.args.get('chunk_size', IMPORT_CHUNK_SIZE, type=int)
+    lines = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    report = import_books(lines, fmt, max(1, chunk_size))
+    
+    return jsonify(report)
+
+def _parse_batch_request():
+    """Read {"patron_id": ..., "book_ids": [...]} from a JSON body. Returns (patron_id, book_ids, error)."""
+    data = request.get_json(silent=True) or {}
+    patron_id = str(data.get('patron_id', '')).strip()
+    book_ids = data.get('book_ids')
+    if not isinstance(book_ids, list) or not all(isinstance(b, int) and not isinstance(b, bool) for b in book_ids):
+        return patron_id, None, 'book_ids must be a list of integer book IDs'
+    return patron_id, book_ids, None
+
+@api_bp.route('/borrow/batch', methods=['POST'])
+def borrow_batch_api():
+    """
+    Borrow several books for one patron in one request and one transaction.
+    Batch API interface for R3: Book Borrowing
+    """
+    patron_id, book_ids, error = _parse_batch_request()
+    if error:
+        return jsonify({'error': error}), 400
+    
+    success, message, results = borrow_books_batch(patron_id, book_ids)
+    
+    return jsonify({
+        'patron_id': patron_id,
+        'success': success,
+        'message': message,
+        'results': results
+    }), 200 if success else 400
+
+@api_bp.route('/return/batch', methods=['POST'])
+def return_batch_api():
+    """
+    Return several books for one patron in one request and one transaction.
+    Batch API interface for R4: Book Return Processing
+    """
+    patron_id, book_ids, error = _parse_batch_request()
+    if error:
+        return jsonify({'error': error}), 400
+    
+    success, message, results = return_books_batch(patron_id, book_ids)
+    
+    return jsonify({
+        'patron_id': patron_id,
+        'success': success,
+        'message': message,
+        'results': results
+    }), 200 if success else 400
+
+@api_bp.route('/reports/overdue')
+@query_budget(2)
+def overdue_report_api():
+    """
+    Outstanding late fees across the whole library, per patron and per book.
+    Reporting interface for R5: Late Fee Calculation
+    
+    Query parameters: as_of (YYYY-MM-DD, defaults to today)
+    """
+    as_of = request.args.get('as_of')
+    try:
+        as_of = date.fromisoformat(as_of) if as_of else None
+    except ValueError:
+        return jsonify({'error': 'as_of must be a date in YYYY-MM-DD format'}), 400
+    
+    return jsonify(get_overdue_fee_report(as_of))
+
+@api_bp.route('/patron/<patron_id>/status')
+@query_budget(3)
+def patron_status_api(patron_id):
+    """
+    Patron status report as JSON.
+    API interface for R7: Patron Status Report
+    
+    Query parameters: history_limit, cursor (history_next_cursor from the previous page)
+    """
+    if not patron_id.isdigit() or len(patron_id) != 6:
+        return jsonify({'error': 'Invalid patron ID. Must be exactly 6 digits.'}), 400
+    
+    history_limit = request.args.get('history_limit', HISTORY_PAGE_SIZE, type=int)
+    cursor = request.args.get('cursor') or None
+    
+    try:
+        report = get_patron_status_report(patron_id, history_limit, cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    report['patron_id'] = patron_id
+    return jsonify(report)
+
+@api_bp.route('/patron/<patron_id>/pay', methods=['POST'])
+@query_budget(5)
+def settle_patron_fees_api(patron_id):
+    """
+    Pay all of a patron's outstanding late fees in one gateway charge.
+    Batch API interface for pay_late_fees
+    """
+    success, message, payment = settle_patron_fees(patron_id)
+    if payment is None:
+        return jsonify({'error': message}), 400
+    
+    payment['patron_id'] = patron_id
+    payment['success'] = success
+    payment['message'] = message
+    # 402 when the gateway declined, 502 when it couldn't be reached
+    status = 200 if success else 402 if payment['status'] == 'failed' else 502
+    return jsonify(payment), status
+
+@api_bp.route('/payments', methods=['POST'])
+def queue_payment_api():
+    """
+    Queue a late fee payment and return at once with a job to poll.
+    Asynchronous API interface for pay_late_fees
+    
+    Body: {"patron_id": "123456", "book_id": 1}
+    """
+    data = request.get_json(silent=True) or {}
+    patron_id = str(data.get('patron_id', '')).strip()
+    book_id = data.get('book_id')
+    if not isinstance(book_id, int) or isinstance(book_id, bool):
+        return jsonify({'error': 'book_id must be an integer book ID'}), 400
+    
+    success, message, job_id = enqueue_late_fee_payment(patron_id, book_id)
+    if not success:
+        return jsonify({'error': message}), 400
+    
+    return _job_accepted(job_id, message)
+
+@api_bp.route('/refunds', methods=['POST'])
+def queue_refund_api():
+    """
+    Queue a late fee refund and return at once with a job to poll.
+    Asynchronous API interface for refund_late_fee_payment
+    
+    Body: {"transaction_id": "txn_...", "amount": 5.00}
+    """
+    data = request.get_json(silent=True) or {}
+    transaction_id = str(data.get('transaction_id', '')).strip()
+    amount = data.get('amount')
+    if not isinstance(amount, (int, float)) or isinstance(amount, bool):
+        return jsonify({'error': 'amount must be a number'}), 400
+    
+    success, message, job_id = enqueue_refund(transaction_id, float(amount))
+    if not success:
+        return jsonify({'error': message}), 400
+    
+    return _job_accepted(job_id, message)
+
+def _job_accepted(job_id, message):
+    status_url = url_for('api.payment_job_api', job_id=job_id)
+    response = jsonify({'job_id': job_id, 'status': 'queued', 'message': message, 'status_url': status_url})
+    response.headers['Location'] = status_url
+    return response, 202
+
+@api_bp.route('/payments/jobs/<int:job_id>')
+def payment_job_api(job_id):
+    """Status of a queued payment or refund: queued, running, succeeded or failed."""
+    job = get_payment_job(job_id)
+    if not job:
+        return jsonify({'error': 'Payment job not found'}), 404
+    
+    return jsonify({
+        'job_id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'amount': job['amount'],
+        'transaction_id': job['transaction_id'],
+        'message': job['message'],
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at'],
+    })
+
+@api_bp.route('/transactions/<transaction_id>')
+def payment_status_api(transaction_id):
+    """Status of a late fee payment from the local payments ledger (no gateway call)."""
+    status = get_payment_status(transaction_id)
+    return jsonify(status), 404 if status['status'] == 'not_found' else 200
+
+@api_bp.route('/patron/<patron_id>/payments')
+@query_budget(1)
+def patron_payments_api(patron_id):
+    """
+    A patron's late fee charges and refunds, newest first.
+    
+    Query parameters: limit
+    """
+    if not patron_id.isdigit() or len(patron_id) != 6:
+        return jsonify({'error': 'Invalid patron ID. Must be exactly 6 digits.'}), 400
+    
+    limit = request.args.get('limit', HISTORY_PAGE_SIZE, type=int)
+    payments = get_patron_payments(patron_id, max(1, min(limit, MAX_PAGE_SIZE)))
+    return jsonify({'patron_id': patron_id, 'payments': payments, 'count': len(payments)})
+
+@api_bp.route('/payments/drift')
+def payment_drift_api():
+    """
+    Disagreements between the payments ledger and the gateway found by the reconciler.
+    
+    Query parameters: resolved ('0' (default), '1' or 'all'), limit
+    """
+    resolved = request.args.get('resolved', '0')
+    if resolved not in ('0', '1', 'all'):
+        return jsonify({'error': "resolved must be '0', '1' or 'all'."}), 400
+    
+    limit = request.args.get('limit', HISTORY_PAGE_SIZE, type=int)
+    drift = get_payment_drift(None if resolved == 'all' else resolved == '1', max(1, min(limit, MAX_PAGE_SIZE)))
+    return jsonify({'drift': drift, 'count': len(drift)})
@@ -3,8 +3,10 @@ Catalog Routes - Book catalog related endpoints
 """
 
 from flask import Blueprint, render_template, request, redirect, url_for, flash
-from database import get_all_books
+from database import get_books_page, CATALOG_PAGE_SIZE
 from services.library_service import add_book_to_catalog
+from instrumentation import query_budget
+from .http_cache import catalog_cached
 
 catalog_bp = Blueprint('catalog', __name__)
 
@@ -14,13 +16,25 @@ def index():
     return redirect(url_for('catalog.catalog'))
 
 @catalog_bp.route('/catalog')
+@query_budget(2)  # Catalog version plus the page itself
+@catalog_cached
 def catalog():
     """
-    Display all books in the catalog.
+    Display the books in the catalog, one page at a time.
     Implements R2: Book Catalog Display
     """
-    books = get_all_books()
-    return render_template('catalog.html', books=books)
+    limit = request.args.get('limit', CATALOG_PAGE_SIZE, type=int)
+    cursor = request.args.get('cursor') or None
+    
+    try:
+        books, next_cursor = get_books_page(limit, cursor)
+    except ValueError:
+        flash('Invalid page cursor, showing the first page.', 'error')
+        cursor = None
+        books, next_cursor = get_books_page(limit)
+    
+    return render_template('catalog.html', books=books, limit=limit,
+                           cursor=cursor, next_cursor=next_cursor)
 
 @catalog_bp.route('/add_book', methods=['GET', 'POST'])
 def add_book():
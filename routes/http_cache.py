@@ -0,0 +1,82 @@
+"""
+HTTP Caching - ETags, conditional GETs and a rendered-response cache for
+read-only catalog pages
+"""
+
+import math
+from functools import wraps
+from urllib.parse import urlencode
+from flask import request, session, make_response
+from cache import LRUCache, MISSING
+from database import get_catalog_version
+
+RESPONSE_CACHE_SIZE = 1024  # Rendered responses kept across all cached routes
+
+response_cache = LRUCache(max_size=RESPONSE_CACHE_SIZE)
+
+
+def _catalog_etag(version: int, modified: float) -> str:
+    # The version is shared by every worker through the database; the change
+    # time tells apart databases that happen to be at the same version
+    return f'catalog-{version}-{int(modified * 1000000):x}'
+
+
+def _response_cache_key(etag: str) -> str:
+    # Re-encoded, so a value containing '&' or '=' can't pass for other parameters
+    query = urlencode(sorted(request.args.items(multi=True)))
+    return f'{request.endpoint}?{query}#{etag}'
+
+
+def _add_validators(response, etag: str, modified: float):
+    response.set_etag(etag)
+    response.last_modified = modified
+    response.cache_control.no_cache = True  # Always revalidate; the 304 is cheap
+    return response
+
+
+def catalog_cached(view):
+    """
+    Cache a GET view that only depends on its query string and the catalog.
+
+    Responses carry an ETag and Last-Modified for the current catalog
+    version, read from the database on every request so writes made by other
+    processes are seen. A matching If-None-Match (or an If-Modified-Since at
+    or after the last change, rounded up to the whole second since HTTP dates
+    carry no fractions) gets a 304 without running the view,
+    and a 200 response is kept per (route, query, catalog version) so repeat
+    hits skip the view's queries and template rendering. Requests with pending flash
+    messages bypass the cache, since the page has to show them.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if session.get('_flashes'):
+            return view(*args, **kwargs)
+
+        version, modified = get_catalog_version()
+        etag = _catalog_etag(version, modified)
+
+        if request.if_none_match:
+            if request.if_none_match.contains(etag):
+                return _add_validators(make_response('', 304), etag, modified)
+        elif request.if_modified_since and request.if_modified_since.timestamp() >= math.ceil(modified):
+            return _add_validators(make_response('', 304), etag, modified)
+
+        key = _response_cache_key(etag)
+        cached = response_cache.get(key)
+        if cached is not MISSING:
+            body, mimetype = cached
+            return _add_validators(make_response(body, 200, {'Content-Type': mimetype}), etag, modified)
+
+        response = make_response(view(*args, **kwargs))
+        if response.status_code != 200 or response.is_streamed:
+            return response
+        # A write committed while the view ran also moved the version on, so
+        # nothing reads this entry after the data it shows is out of date
+        response_cache.set(key, (response.get_data(), response.content_type))
+        return _add_validators(response, etag, modified)
+    return wrapper
+
+
+def get_response_cache_stats():
+    """Get hit/miss/eviction counters for the rendered-response cache."""
+    return response_cache.stats()
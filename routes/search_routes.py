@@ -4,10 +4,14 @@ Search Routes - Book search functionality
 
 from flask import Blueprint, render_template, request, flash
 from services.library_service import search_books_in_catalog
+from instrumentation import query_budget
+from .http_cache import catalog_cached
 
 search_bp = Blueprint('search', __name__)
 
 @search_bp.route('/search')
+@query_budget(2)  # Catalog version plus the page itself
+@catalog_cached
 def search_books():
     """
     Search for books in the catalog.
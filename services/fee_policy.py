@@ -0,0 +1,63 @@
+"""
+Fee Policy Module - Late fee schedule
+Holds the R5 late fee rules in one place so every fee calculation agrees
+"""
+
+from datetime import date, datetime
+from typing import Dict, Optional, Union
+
+
+class LateFeePolicy:
+    """
+    Tiered late fee schedule.
+    
+    The default follows R5: $0.50/day for the first 7 days overdue,
+    $1.00/day after that, capped at $15.00 per book.
+    """
+    
+    def __init__(self, first_tier_rate: float = 0.50, first_tier_days: int = 7,
+                 later_rate: float = 1.00, max_fee: float = 15.00):
+        """
+        Args:
+            first_tier_rate: Daily fee for the first first_tier_days days overdue
+            first_tier_days: Number of days charged at first_tier_rate
+            later_rate: Daily fee for every day after the first tier
+            max_fee: Maximum fee for a single book
+        """
+        self.first_tier_rate = first_tier_rate
+        self.first_tier_days = first_tier_days
+        self.later_rate = later_rate
+        self.max_fee = max_fee
+    
+    def days_overdue(self, due_date: Union[date, datetime], today: Optional[Union[date, datetime]] = None) -> int:
+        """Whole calendar days between the due date and today (0 if not yet due)."""
+        today = today or datetime.now()
+        due_day = due_date.date() if isinstance(due_date, datetime) else due_date
+        today_day = today.date() if isinstance(today, datetime) else today
+        return max((today_day - due_day).days, 0)
+    
+    def fee_for_days(self, days_overdue: int) -> float:
+        """Fee owed for a book that is days_overdue days late."""
+        if days_overdue <= 0:
+            return 0.0
+        
+        if days_overdue <= self.first_tier_days:
+            fee = days_overdue * self.first_tier_rate
+        else:
+            fee = (self.first_tier_days * self.first_tier_rate
+                   + (days_overdue - self.first_tier_days) * self.later_rate)
+        return round(min(fee, self.max_fee), 2)
+    
+    def assess(self, due_date: Union[date, datetime], today: Optional[Union[date, datetime]] = None) -> Dict:
+        """
+        Late fee owed today for a loan due on due_date.
+        
+        Returns:
+            dict: {'fee_amount': float, 'days_overdue': int}
+        """
+        days = self.days_overdue(due_date, today)
+        return {'fee_amount': self.fee_for_days(days), 'days_overdue': days}
+
+
+# The schedule used by the library service unless another policy is passed in
+DEFAULT_FEE_POLICY = LateFeePolicy()
@@ -0,0 +1,150 @@
+"""
+Import Service Module - Bulk Catalog Import
+Streams CSV or JSON Lines catalog dumps into the books table in large batches
+"""
+
+import csv
+import json
+import time
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+from database import insert_books_bulk
+from services.library_service import validate_book_fields
+
+IMPORT_CHUNK_SIZE = 5000  # Rows written per transaction
+MAX_REPORTED_REJECTS = 1000  # Rejected rows listed in the report (all are counted)
+IMPORT_FORMATS = ('csv', 'jsonl')
+
+
+def detect_format(filename: Optional[str], content_type: Optional[str] = None) -> str:
+    """Guess the import format from a file name or content type, defaulting to CSV."""
+    name = (filename or '').lower()
+    if name.endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    if content_type and ('json' in content_type):
+        return 'jsonl'
+    return 'csv'
+
+
+def _read_rows(lines: Iterable[str], fmt: str) -> Iterator[Tuple[int, Optional[Dict], Optional[str]]]:
+    """
+    Yield (line number, row, parse error) for each record in the input.
+    CSV input must have a header row with title, author, isbn and total_copies.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row, None
+    elif fmt == 'jsonl':
+        for line_num, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield line_num, None, "Invalid JSON."
+                continue
+            if not isinstance(row, dict):
+                yield line_num, None, "Each line must be a JSON object."
+                continue
+            yield line_num, row, None
+    else:
+        raise ValueError(f"Unsupported import format: {fmt}")
+
+
+def _parse_book(row: Dict) -> Tuple[Optional[Tuple[str, str, str, int]], Optional[str]]:
+    """Turn a raw row into a (title, author, isbn, total_copies) tuple, or an error message."""
+    title = str(row.get('title') or '').strip()
+    author = str(row.get('author') or '').strip()
+    isbn = str(row.get('isbn') or '').strip()
+    total_copies = row.get('total_copies')
+    try:
+        if isinstance(total_copies, str):
+            total_copies = int(total_copies.strip())
+    except ValueError:
+        return None, "Total copies must be a positive integer."
+    if isinstance(total_copies, bool):
+        total_copies = None
+
+    error = validate_book_fields(title, author, isbn, total_copies)
+    if error:
+        return None, error
+    return (title, author, isbn, total_copies), None
+
+
+def import_books(lines: Iterable[str], fmt: str = 'csv', chunk_size: int = IMPORT_CHUNK_SIZE) -> Dict:
+    """
+    Bulk import books from a CSV or JSON Lines stream.
+
+    Rows are validated with the same rules as add_book_to_catalog, ISBNs are
+    deduplicated within the file and against the catalog, and accepted rows
+    are written with executemany in one transaction per chunk.
+
+    Args:
+        lines: Iterable of text lines (an open file, request stream, list, ...)
+        fmt: 'csv' or 'jsonl'
+        chunk_size: Number of accepted rows written per transaction
+
+    Returns:
+        dict: Import report with counts, throughput and the rejected rows
+    """
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f"Unsupported import format: {fmt}")
+
+    report = {'rows': 0, 'inserted': 0, 'rejected': 0, 'rejects': []}
+    seen_isbns = set()
+    chunk = []
+    chunk_lines = []
+
+    def reject(line_num, isbn, error):
+        report['rejected'] += 1
+        if len(report['rejects']) < MAX_REPORTED_REJECTS:
+            report['rejects'].append({'line': line_num, 'isbn': isbn, 'error': error})
+
+    def flush():
+        try:
+            inserted, duplicates = insert_books_bulk(chunk)
+        except Exception:
+            # The whole chunk was rolled back
+            for line_num, book in zip(chunk_lines, chunk):
+                reject(line_num, book[2], "Database error occurred while adding the book.")
+            chunk.clear()
+            chunk_lines.clear()
+            return
+        report['inserted'] += inserted
+        if duplicates:
+            duplicate_set = set(duplicates)
+            for line_num, book in zip(chunk_lines, chunk):
+                if book[2] in duplicate_set:
+                    reject(line_num, book[2], "A book with this ISBN already exists.")
+        chunk.clear()
+        chunk_lines.clear()
+
+    start = time.perf_counter()
+    for line_num, row, error in _read_rows(lines, fmt):
+        report['rows'] += 1
+        if error:
+            reject(line_num, None, error)
+            continue
+
+        book, error = _parse_book(row)
+        if error:
+            reject(line_num, str(row.get('isbn') or '') or None, error)
+            continue
+
+        if book[2] in seen_isbns:
+            reject(line_num, book[2], "Duplicate ISBN in import file.")
+            continue
+        seen_isbns.add(book[2])
+
+        chunk.append(book)
+        chunk_lines.append(line_num)
+        if len(chunk) >= chunk_size:
+            flush()
+
+    if chunk:
+        flush()
+
+    elapsed = time.perf_counter() - start
+    report['elapsed_seconds'] = round(elapsed, 3)
+    report['rows_per_sec'] = round(report['rows'] / elapsed, 1) if elapsed > 0 else 0.0
+    return report
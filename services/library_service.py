@@ -3,15 +3,27 @@ Library Service Module - Business Logic Functions
 Contains all the core business logic for the Library Management System
 """
 
-from datetime import datetime, timedelta
+import uuid
+from datetime import date, datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 from database import (
     get_book_by_id, get_book_by_isbn, get_patron_borrow_count,
     insert_book, insert_borrow_record, update_book_availability,
-    update_borrow_record_return_date, get_all_books, get_patron_borrowed_books
+    update_borrow_record_return_date, get_all_books, get_patron_borrowed_books,
+    transaction, lock_for_write, fetch_book, count_active_loans, find_active_loan,
+    claim_book_copy, release_book_copy, create_borrow_record, close_borrow_record,
+    search_books, get_active_loan, get_overdue_fee_totals,
+    get_patron_active_loans, get_patron_late_fee_total, get_patron_history, HISTORY_PAGE_SIZE,
+    fetch_outstanding_fees, create_payment, update_payment_status, fetch_paid_amount,
+    find_charge, create_payment_job, get_charge_by_transaction
 )
-from services.payment_service import PaymentGateway
+from instrumentation import instrumented
+from services.fee_policy import LateFeePolicy, DEFAULT_FEE_POLICY
+from services.payment_service import PaymentGateway, CircuitOpenError, get_default_gateway
 
+MAX_BATCH_SIZE = 20  # Most books a single batch borrow/return request may contain
+
+@instrumented
 def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -> Tuple[bool, str]:
     """
     Add a new book to the catalog.
@@ -27,23 +39,9 @@ def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -
         tuple: (success: bool, message: str)
     """
     # Input validation
-    if not title or not title.strip():
-        return False, "Title is required."
-    
-    if len(title.strip()) > 200:
-        return False, "Title must be less than 200 characters."
-    
-    if not author or not author.strip():
-        return False, "Author is required."
-    
-    if len(author.strip()) > 100:
-        return False, "Author must be less than 100 characters."
-    
-    if len(isbn) != 13:
-        return False, "ISBN must be exactly 13 digits."
-    
-    if not isinstance(total_copies, int) or total_copies <= 0:
-        return False, "Total copies must be a positive integer."
+    error = validate_book_fields(title, author, isbn, total_copies)
+    if error:
+        return False, error
     
     # Check for duplicate ISBN
     existing = get_book_by_isbn(isbn)
@@ -57,6 +55,35 @@ def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -
     else:
         return False, "Database error occurred while adding the book."
 
+def validate_book_fields(title: str, author: str, isbn: str, total_copies: int) -> Optional[str]:
+    """
+    Check a book's fields against the R1 catalog rules.
+    Shared by add_book_to_catalog and the bulk importer.
+    
+    Returns:
+        str: The first validation error message, or None if the book is valid
+    """
+    if not title or not title.strip():
+        return "Title is required."
+    
+    if len(title.strip()) > 200:
+        return "Title must be less than 200 characters."
+    
+    if not author or not author.strip():
+        return "Author is required."
+    
+    if len(author.strip()) > 100:
+        return "Author must be less than 100 characters."
+    
+    if len(isbn) != 13:
+        return "ISBN must be exactly 13 digits."
+    
+    if not isinstance(total_copies, int) or total_copies <= 0:
+        return "Total copies must be a positive integer."
+    
+    return None
+
+@instrumented
 def borrow_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     """
     Allow a patron to borrow a book.
@@ -73,8 +100,78 @@ def borrow_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
         return False, "Invalid patron ID. Must be exactly 6 digits."
     
+    borrow_date = datetime.now()
+    
+    # All checks and writes happen in one transaction so two patrons can't
+    # both take the last copy and a failure can't leave the tables out of sync
+    try:
+        with transaction() as conn:
+            lock_for_write(conn, f'patron:{patron_id}')  # Until the loan count below is acted on
+            return _borrow_in_transaction(conn, patron_id, book_id, count_active_loans(conn, patron_id), borrow_date)
+    except Exception:
+        return False, "Database error occurred while creating borrow record."
+
+@instrumented
+def borrow_books_batch(patron_id: str, book_ids: List[int]) -> Tuple[bool, str, List[Dict]]:
+    """
+    Borrow several books for one patron in a single transaction (e.g. a self-checkout kiosk).
+    Batch version of R3: the patron is validated and their loans counted once,
+    and every book is checked with the same rules as borrow_book_by_patron.
+    
+    Args:
+        patron_id: 6-digit library card ID
+        book_ids: IDs of the books to borrow, in scan order
+        
+    Returns:
+        tuple: (success: bool, message: str, results: list of
+                {'book_id', 'success', 'message'} in the same order as book_ids)
+    """
+    # Validate patron ID
+    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+        return False, "Invalid patron ID. Must be exactly 6 digits.", []
+    
+    if not book_ids:
+        return False, "No books to borrow.", []
+    
+    if len(book_ids) > MAX_BATCH_SIZE:
+        return False, f"A batch can contain at most {MAX_BATCH_SIZE} books.", []
+    
+    borrow_date = datetime.now()
+    results = []
+    
+    try:
+        with transaction() as conn:
+            _lock_batch(conn, patron_id, book_ids)
+            active_loans = count_active_loans(conn, patron_id)
+            seen = set()
+            for book_id in book_ids:
+                if book_id in seen:
+                    success, message = False, "Duplicate book in this batch."
+                else:
+                    seen.add(book_id)
+                    success, message = _borrow_in_transaction(conn, patron_id, book_id, active_loans, borrow_date)
+                if success:
+                    active_loans += 1
+                results.append({'book_id': book_id, 'success': success, 'message': message})
+    except Exception:
+        return False, "Database error occurred while creating borrow records.", []
+    
+    borrowed = sum(1 for r in results if r['success'])
+    return True, f"Borrowed {borrowed} of {len(book_ids)} books.", results
+
+def _lock_batch(conn, patron_id: str, book_ids: List[int]):
+    """Lock the patron, then the books in ID order, so batches scanned in different orders can't deadlock."""
+    lock_for_write(conn, f'patron:{patron_id}')
+    for book_id in sorted(set(book_ids)):
+        lock_for_write(conn, f'book:{book_id}')
+
+def _borrow_in_transaction(conn, patron_id: str, book_id: int, active_loans: int,
+                           borrow_date: datetime) -> Tuple[bool, str]:
+    """Borrow one book on a connection inside transaction(), given the patron's current loan count."""
+    due_date = borrow_date + timedelta(days=14)
+    
     # Check if book exists and is available
-    book = get_book_by_id(book_id)
+    book = fetch_book(conn, book_id)
     if not book:
         return False, "Book not found."
     
@@ -82,26 +179,18 @@ def borrow_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
         return False, "This book is currently not available."
     
     # Check patron's current borrowed books count
-    current_borrowed = get_patron_borrow_count(patron_id)
-    
-    if current_borrowed >= 5:
+    if active_loans >= 5:
         return False, "You have reached the maximum borrowing limit of 5 books."
     
-    # Create borrow record
-    borrow_date = datetime.now()
-    due_date = borrow_date + timedelta(days=14)
-    
-    # Insert borrow record and update availability
-    borrow_success = insert_borrow_record(patron_id, book_id, borrow_date, due_date)
-    if not borrow_success:
-        return False, "Database error occurred while creating borrow record."
+    # Take a copy only if one is still on the shelf, then record the loan
+    if not claim_book_copy(conn, book_id):
+        return False, "This book is currently not available."
     
-    availability_success = update_book_availability(book_id, -1)
-    if not availability_success:
-        return False, "Database error occurred while updating book availability."
+    create_borrow_record(conn, patron_id, book_id, borrow_date, due_date)
     
     return True, f'Successfully borrowed "{book["title"]}". Due date: {due_date.strftime("%Y-%m-%d")}.'
 
+@instrumented
 def return_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     """
     Process book return by a patron.
@@ -112,113 +201,177 @@ def return_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
         return False, "This is an invalid patron ID. Must be exactly 6 digits."
     
+    return_date = datetime.now()
+    
+    # Close the loan and put the copy back in a single transaction
+    try:
+        with transaction() as conn:
+            return _return_in_transaction(conn, patron_id, book_id, return_date)
+    except Exception:
+        return False, "Database error occured while updating return date."
+
+@instrumented
+def return_books_batch(patron_id: str, book_ids: List[int]) -> Tuple[bool, str, List[Dict]]:
+    """
+    Return several books for one patron in a single transaction.
+    Batch version of R4 with the same per-book checks and late fee messages.
+    
+    Args:
+        patron_id: 6-digit library card ID
+        book_ids: IDs of the books being returned
+        
+    Returns:
+        tuple: (success: bool, message: str, results: list of
+                {'book_id', 'success', 'message'} in the same order as book_ids)
+    """
+    # Validate patron ID
+    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+        return False, "This is an invalid patron ID. Must be exactly 6 digits.", []
+    
+    if not book_ids:
+        return False, "No books to return.", []
+    
+    if len(book_ids) > MAX_BATCH_SIZE:
+        return False, f"A batch can contain at most {MAX_BATCH_SIZE} books.", []
+    
+    return_date = datetime.now()
+    results = []
+    
+    try:
+        with transaction() as conn:
+            _lock_batch(conn, patron_id, book_ids)
+            for book_id in book_ids:
+                success, message = _return_in_transaction(conn, patron_id, book_id, return_date)
+                results.append({'book_id': book_id, 'success': success, 'message': message})
+    except Exception:
+        return False, "Database error occured while updating return dates.", []
+    
+    returned = sum(1 for r in results if r['success'])
+    return True, f"Returned {returned} of {len(book_ids)} books.", results
+
+def _return_in_transaction(conn, patron_id: str, book_id: int, return_date: datetime) -> Tuple[bool, str]:
+    """Return one book on a connection inside transaction()."""
     # Check if book exists
-    book = get_book_by_id(book_id)
+    book = fetch_book(conn, book_id)
     if not book:
         return False, "This is an invalid book."
     
     # Check if the patron has borrowed this book and not yet returned it
-    borrowed_books = get_patron_borrowed_books(patron_id)
-    has_borrowed = any(b['book_id'] == book_id for b in borrowed_books)
-    if not has_borrowed:
+    loan = find_active_loan(conn, patron_id, book_id)
+    if not loan:
         return False, "Not currently borrowed by this patron."
     
-    # Use the late fee calculation function
-    late_fee_info = calculate_late_fee_for_book(patron_id, book_id)
-    late_fee_msg = ""
-    if late_fee_info['days_overdue'] > 0 and late_fee_info['fee_amount'] > 0:
-        late_fee_msg = f" late fee: ${late_fee_info['fee_amount']:.2f} for {late_fee_info['days_overdue']} days overdue."
-    
     # Update the borrow record with the return date
-    return_date = datetime.now()
-    update_success = update_borrow_record_return_date(patron_id, book_id, return_date)
-    if not update_success:
+    if not close_borrow_record(conn, loan['id'], return_date):
         return False, "Database error occured while updating return date."
     
     # Increase the available copies of the book
-    availability_success = update_book_availability(book_id, 1)
-    if not availability_success:
-        return False, "Database error occured while updating book availability."
+    release_book_copy(conn, book_id)
+    
+    late_fee_info = calculate_late_fee_for_book(patron_id, book_id, loan=loan)
+    late_fee_msg = ""
+    if late_fee_info['days_overdue'] > 0 and late_fee_info['fee_amount'] > 0:
+        late_fee_msg = f" late fee: ${late_fee_info['fee_amount']:.2f} for {late_fee_info['days_overdue']} days overdue."
 
     return True, f'Book "{book["title"]}" successfully returned.{late_fee_msg}'
 
-def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
+@instrumented
+def calculate_late_fee_for_book(patron_id: str, book_id: int, loan: Optional[Dict] = None,
+                                policy: LateFeePolicy = DEFAULT_FEE_POLICY) -> Dict:
     """
     Calculate late fees for a specific book.
+    Implements R5: Late Fee Calculation
     
-    TODO: Implement R5 as per requirements 
-    
-    
-    return { // return the calculated values
-        'fee_amount': 0.00,
-        'days_overdue': 0,
-        'status': 'Late fee calculation not implemented'
-    }
+    Args:
+        patron_id: 6-digit library card ID
+        book_id: ID of the borrowed book
+        loan: The patron's active borrow record for this book, if the caller
+              has already fetched it (skips the database lookup)
+        policy: Fee schedule to apply (defaults to the R5 schedule)
+        
+    Returns:
+        dict: {'fee_amount': float, 'days_overdue': int}
     """
     # Validate patron ID
     if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
         return {'fee_amount': 0.0, 'days_overdue': 0}
     
-    # Check if book exists
-    book = get_book_by_id(book_id)
-    if not book:
-        return {'fee_amount': 0.0, 'days_overdue': 0}
-    
-    # Find the active borrow record for this patron and book
-    borrowed_books = get_patron_borrowed_books(patron_id)
-    borrow_record = None
-    for b in borrowed_books:
-        if b['book_id'] == book_id:
-            borrow_record = b
-            break
+    # Find the active borrow record for this patron and book (one indexed query,
+    # which also covers the book not existing)
+    if loan is None:
+        loan = get_active_loan(patron_id, book_id)
 
-    if not borrow_record or 'due_date' not in borrow_record:
+    if not loan or 'due_date' not in loan:
         return {'fee_amount': 0.0, 'days_overdue': 0}
 
-    due_date = borrow_record['due_date']
-
-    today = datetime.now()
-    days_overdue = (today.date() - due_date.date()).days
-
-    if days_overdue <= 0:
-        return {'fee_amount': 0.0, 'days_overdue': 0}
-
-    if days_overdue <= 7:
-        fee = days_overdue * 0.5
-    else:
-        fee = 7 * 0.5 + (days_overdue - 7) * 1.0
-    fee = min(fee, 15.0)
-
-    return {'fee_amount': round(fee, 2), 'days_overdue': days_overdue}
+    return policy.assess(loan['due_date'])
 
+@instrumented
 def search_books_in_catalog(search_term: str, search_type: str) -> List[Dict]:
     """
     Search for books in the catalog.
+    Implements R6: Book Search Functionality
     
-    TODO: Implement R6 as per requirements
+    Title and author searches go through the full-text index: case-insensitive,
+    words matched in order with the last one as a prefix, ranked by relevance.
+    Any other search type is an exact ISBN lookup on the unique index.
     """
     search_term = search_term.strip()
 
-    books = get_all_books()
-    results = []
+    if search_type in ("title", "author"):
+        return search_books(search_term, search_type)
 
-    if search_type == "title":
-        # Case-insensitive, partial match
-        results = [b for b in books if search_term.lower() in b['title'].lower()]
-    elif search_type == "author":
-        # Case-insensitive, partial match
-        results = [b for b in books if search_term.lower() in b['author'].lower()]
-    else:
-        # Exact match only
-        results = [b for b in books if b['isbn'] == search_term]
+    # Exact match only
+    book = get_book_by_isbn(search_term)
+    return [book] if book else []
 
-    return results
+@instrumented
+def get_overdue_fee_report(as_of: Optional[date] = None, policy: LateFeePolicy = DEFAULT_FEE_POLICY) -> Dict:
+    """
+    Library-wide outstanding late fees, e.g. for nightly billing.
+    Applies the R5 schedule to every active overdue loan in one pass over the database.
+    
+    Args:
+        as_of: Date to compute fees as of (defaults to today)
+        policy: Fee schedule to apply
+        
+    Returns:
+        dict: Totals plus per-patron and per-book breakdowns
+    """
+    as_of = as_of or date.today()
+    totals = get_overdue_fee_totals(as_of, policy)
+    patrons = totals['patrons']
+    
+    return {
+        'as_of': as_of.isoformat(),
+        'total_fees': round(sum(p['fee_total'] for p in patrons), 2),
+        'overdue_loans': sum(p['overdue_loans'] for p in patrons),
+        'patrons': patrons,
+        'books': totals['books']
+    }
 
-def get_patron_status_report(patron_id: str) -> Dict:
+@instrumented
+def get_patron_status_report(patron_id: str, history_limit: int = HISTORY_PAGE_SIZE,
+                             history_cursor: Optional[str] = None) -> Dict:
     """
     Get status report for a patron.
+    Implements R7: Patron Status Report
+    
+    The borrow count and late fee total are SQL aggregates over the patron's
+    active loans (fees use the same tiered schedule as R5), and the history is
+    returned one page at a time, newest first.
     
-    TODO: Implement R7 as per requirements
+    Args:
+        patron_id: 6-digit library card ID
+        history_limit: Maximum number of history records to return
+        history_cursor: history_next_cursor from a previous report, for the next page
+        
+    Returns:
+        dict: currently_borrowed, num_currently_borrowed, total_late_fees,
+              history and history_next_cursor
+        
+    Raises:
+        ValueError: If history_cursor is malformed
     """
     # Validate patron ID
     if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
@@ -226,78 +379,144 @@ def get_patron_status_report(patron_id: str) -> Dict:
             'currently_borrowed': [],
             'total_late_fees': 0.0,
             'num_currently_borrowed': 0,
-            'history': []
+            'history': [],
+            'history_next_cursor': None
         }
     
-    # Get all borrow records for this patron
-    all_borrows = []
-    conn = None
-    try:
-        from database import get_db_connection
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT br.*, b.title, b.author, b.isbn
-            FROM borrow_records br
-            JOIN books b ON br.book_id = b.id
-            WHERE br.patron_id = ?
-            ORDER BY br.borrow_date DESC
-        """, (patron_id,))
-        all_borrows = [dict(row) for row in cur.fetchall()]
-    finally:
-        if conn:
-            conn.close()
-
-    currently_borrowed = []
-    total_late_fees = 0.0
-    history = []
-
     now = datetime.now()
-
-    for record in all_borrows:
-        due_date = record['due_date']
-        due_date_dt = datetime.fromisoformat(due_date)
-
-        return_date = record['return_date']
-        if return_date:
-            return_date_dt = datetime.fromisoformat(return_date)
-        else:
-            return_date_dt = None
-
-        book_info = {
-            'title': record['title'],
-            'author': record['author'],
-            'isbn': record['isbn'],
-            'borrow_date': record['borrow_date'],
-            'due_date': record['due_date'],
-            'return_date': record['return_date']
-        }
-
-        # If not yet returned
-        if not return_date_dt:
-            is_overdue = now > due_date_dt
-            book_info['is_overdue'] = is_overdue
-            currently_borrowed.append(book_info)
-            # Calculate late fee for overdue books
-            if is_overdue:
-                days_overdue = (now.date() - due_date_dt.date()).days
-                total_late_fees += round(days_overdue * 0.5, 2)
-        # Add to history regardless
-        history.append(book_info)
+    currently_borrowed = get_patron_active_loans(patron_id, now)
+    total_late_fees = get_patron_late_fee_total(patron_id, now.date(), DEFAULT_FEE_POLICY)
+    history, history_next_cursor = get_patron_history(patron_id, history_limit, history_cursor)
 
     return {
         'currently_borrowed': currently_borrowed,
-        'total_late_fees': round(total_late_fees, 2),
+        'total_late_fees': total_late_fees,
         'num_currently_borrowed': len(currently_borrowed),
-        'history': history
+        'history': history,
+        'history_next_cursor': history_next_cursor
     }
 
+def prepare_late_fee_payment(patron_id: str, book_id: int) -> Tuple[Optional[str], float, str, Optional[Dict]]:
+    """
+    Validate a late fee payment before it is sent to the gateway.
+    
+    Returns:
+        tuple: (error message or None, fee amount, payment description, active loan or None)
+    """
+    # Validate patron ID
+    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+        return "Invalid patron ID. Must be exactly 6 digits.", 0.0, "", None
+    
+    # Calculate late fee first, fetching the loan once and reusing it below
+    loan = get_active_loan(patron_id, book_id)
+    fee_info = calculate_late_fee_for_book(patron_id, book_id, loan=loan)
+    
+    # Check if there's a fee to pay
+    if not fee_info or 'fee_amount' not in fee_info:
+        return "Unable to calculate late fees.", 0.0, "", None
+    
+    fee_amount = fee_info.get('fee_amount', 0.0)
+    
+    if fee_amount <= 0:
+        return "No late fees to pay for this book.", 0.0, "", None
+    
+    # Get book details for payment description (the loan already carries the title)
+    book = loan or get_book_by_id(book_id)
+    if not book:
+        return "Book not found.", 0.0, "", None
+    
+    return None, fee_amount, f"Late fees for '{book['title']}'", loan
+
+
+def reserve_late_fee_payment(patron_id: str, book_id: int, idempotency_key: str,
+                             queue: bool = False) -> Tuple[Optional[str], Optional[Dict]]:
+    """
+    Validate a late fee payment and record it as pending in the payments ledger.
+    
+    The loan's outstanding fee (accrued fee minus earlier payments) is checked
+    inside the write transaction, so two payments for the same loan can't both
+    be recorded. With queue=True the job for the payment workers is created
+    in the same transaction.
+    
+    Returns:
+        tuple: (error message or None, {'payment_id', 'job_id', 'amount', 'description'})
+    """
+    error, fee_amount, description, loan = prepare_late_fee_payment(patron_id, book_id)
+    if error:
+        return error, None
+    
+    with transaction() as conn:
+        lock_for_write(conn, f'patron:{patron_id}')  # Until the amount paid below is acted on
+        amount = fee_amount
+        allocations = []
+        if loan:
+            amount = round(fee_amount - fetch_paid_amount(conn, loan['id']), 2)
+            if amount <= 0:
+                return "No late fees to pay for this book.", None
+            allocations = [(loan['id'], loan['book_id'], amount)]
+        payment_id = create_payment(conn, patron_id, amount, description, idempotency_key, allocations)
+        job_id = None
+        if queue:
+            job_id = create_payment_job(conn, 'payment', amount, patron_id, book_id, description,
+                                        payment_id=payment_id, idempotency_key=idempotency_key)
+    
+    return None, {'payment_id': payment_id, 'job_id': job_id, 'amount': amount, 'description': description}
+
+
+def charge_late_fees(payment_gateway: PaymentGateway, patron_id: str, amount: float,
+                     description: str, idempotency_key: Optional[str] = None) -> Tuple[str, str, Optional[str]]:
+    """
+    Send a validated late fee payment to the gateway.
+    Used by pay_late_fees, settle_patron_fees and the payment queue workers,
+    which pass the ledger entry's idempotency key so the charge can be looked
+    up later and a retried job can't charge twice.
+    
+    Returns:
+        tuple: (ledger status: 'completed', 'failed' or 'uncertain', message: str,
+                transaction_id: Optional[str])
+    """
+    options = {'idempotency_key': idempotency_key} if idempotency_key else {}
+    # THIS IS WHAT YOU SHOULD MOCK IN THEIR TESTS!
+    try:
+        success, transaction_id, message = payment_gateway.process_payment(
+            patron_id=patron_id,
+            amount=amount,
+            description=description,
+            **options
+        )
+    except CircuitOpenError as e:
+        # Refused locally, so nothing was charged
+        return 'failed', f"Payment processing error: {str(e)}", None
+    except Exception as e:
+        # Handle payment gateway errors; the charge may or may not have happened
+        return 'uncertain', f"Payment processing error: {str(e)}", None
+    
+    if success:
+        return 'completed', f"Payment successful! {message}", transaction_id
+    else:
+        return 'failed', f"Payment failed: {message}", None
+
+
+def _record_outcome(payment_id: Optional[int], status: str, transaction_id: Optional[str] = None):
+    """Update a ledger entry after the gateway call. A failure leaves it pending for reconciliation."""
+    if payment_id is None:
+        return
+    try:
+        update_payment_status(payment_id, status, transaction_id)
+    except Exception:
+        pass
+
+
+@instrumented
 def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway = None) -> Tuple[bool, str, Optional[str]]:
     """
     Process payment for late fees using external payment gateway.
     
     NEW FEATURE FOR ASSIGNMENT 3: Demonstrates need for mocking/stubbing
     This function depends on an external payment service that should be mocked in tests.
+    It blocks until the gateway answers; see services.payment_queue for the
+    non-blocking version used by the API. The payment is recorded in the
+    payments ledger before the charge and updated with the result.
     
     Args:
         patron_id: 6-digit library card ID
@@ -313,50 +532,182 @@ def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway
         mock_gateway.process_payment.return_value = (True, "txn_123", "Success")
         success, msg, txn = pay_late_fees("123456", 1, mock_gateway)
     """
-    # Validate patron ID
+    idempotency_key = f"pay-{uuid.uuid4().hex}"
+    try:
+        error, reserved = reserve_late_fee_payment(patron_id, book_id, idempotency_key)
+    except Exception:
+        return False, "Database error occurred while recording the payment.", None
+    if error:
+        return False, error, None
+    
+    # Use provided gateway or the shared one (pooled connections, one circuit breaker)
+    if payment_gateway is None:
+        payment_gateway = get_default_gateway()
+    
+    # Process payment through external gateway
+    status, message, transaction_id = charge_late_fees(
+        payment_gateway, patron_id, reserved['amount'], reserved['description'], idempotency_key
+    )
+    _record_outcome(reserved['payment_id'], status, transaction_id)
+    return status == 'completed', message, transaction_id
+
+
+@instrumented
+def settle_patron_fees(patron_id: str, payment_gateway: PaymentGateway = None,
+                       today: Optional[date] = None,
+                       policy: LateFeePolicy = DEFAULT_FEE_POLICY) -> Tuple[bool, str, Optional[Dict]]:
+    """
+    Pay every outstanding late fee of a patron with a single gateway charge.
+    
+    The outstanding fees are computed in one query and recorded as a pending
+    payment with one allocation per loan, inside the same write transaction,
+    so a concurrent settlement can't charge the same fees again. The total is
+    then charged once and the payment marked completed or failed. If the
+    gateway can't be reached the payment is left 'uncertain' for
+    reconciliation, since the charge may have gone through.
+    
+    Args:
+        patron_id: 6-digit library card ID
+        payment_gateway: Payment gateway instance (injectable for testing)
+        today: Date to compute fees as of (defaults to today)
+        policy: Fee schedule to apply
+        
+    Returns:
+        tuple: (success: bool, message: str, payment: Optional[dict]) where payment
+               has payment_id, status, transaction_id, total and per-book allocations
+    """
     if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
         return False, "Invalid patron ID. Must be exactly 6 digits.", None
     
-    # Calculate late fee first
-    fee_info = calculate_late_fee_for_book(patron_id, book_id)
+    today = today or date.today()
+    idempotency_key = f"settle-{uuid.uuid4().hex}"
+    try:
+        with transaction() as conn:
+            lock_for_write(conn, f'patron:{patron_id}')
+            loans = fetch_outstanding_fees(conn, patron_id, today, policy)
+            if loans:
+                total = round(sum(loan['outstanding_amount'] for loan in loans), 2)
+                description = f"Late fees for {len(loans)} overdue book(s)"
+                payment_id = create_payment(
+                    conn, patron_id, total, description, idempotency_key,
+                    [(loan['borrow_record_id'], loan['book_id'], loan['outstanding_amount']) for loan in loans]
+                )
+    except Exception:
+        return False, "Database error occurred while recording the payment.", None
+    
+    if not loans:
+        return False, "No late fees to pay.", None
+    
+    payment = {
+        'payment_id': payment_id,
+        'status': 'pending',
+        'transaction_id': None,
+        'total': total,
+        'allocations': [
+            {'book_id': loan['book_id'], 'title': loan['title'],
+             'days_overdue': loan['days_overdue'], 'amount': loan['outstanding_amount']}
+            for loan in loans
+        ]
+    }
     
-    # Check if there's a fee to pay
-    if not fee_info or 'fee_amount' not in fee_info:
-        return False, "Unable to calculate late fees.", None
+    if payment_gateway is None:
+        payment_gateway = get_default_gateway()
+    
+    status, message, transaction_id = charge_late_fees(
+        payment_gateway, patron_id, total, description, idempotency_key
+    )
+    _record_outcome(payment_id, status, transaction_id)
+    payment['status'] = status
+    payment['transaction_id'] = transaction_id
+    return status == 'completed', message, payment
+
+
+def validate_refund(transaction_id: str, amount: float, charge: Optional[Dict] = None) -> Optional[str]:
+    """
+    Check a refund request before it is sent to the gateway. Returns an error message or None.
     
-    fee_amount = fee_info.get('fee_amount', 0.0)
+    When the charge is in the payments ledger the refund is checked against
+    what was actually paid and already refunded; otherwise the per-book
+    maximum late fee applies.
+    """
+    if not transaction_id or not transaction_id.startswith("txn_"):
+        return "Invalid transaction ID."
     
-    if fee_amount <= 0:
-        return False, "No late fees to pay for this book.", None
+    if amount <= 0:
+        return "Refund amount must be greater than 0."
     
-    # Get book details for payment description
-    book = get_book_by_id(book_id)
-    if not book:
-        return False, "Book not found.", None
+    if charge is None:
+        if amount > 15.00:  # Maximum late fee per book
+            return "Refund amount exceeds maximum late fee."
+        return None
     
-    # Use provided gateway or create new one
-    if payment_gateway is None:
-        payment_gateway = PaymentGateway()
+    if charge['status'] != 'completed':
+        return "Only completed payments can be refunded."
     
-    # Process payment through external gateway
-    # THIS IS WHAT YOU SHOULD MOCK IN THEIR TESTS!
+    if amount > round(charge['amount'] - charge['refunded_amount'], 2):
+        return "Refund amount exceeds the amount paid."
+    
+    return None
+
+
+def reserve_refund(transaction_id: str, amount: float, idempotency_key: str,
+                   queue: bool = False) -> Tuple[Optional[str], Optional[Dict]]:
+    """
+    Validate a refund against the local ledger and record it as pending.
+    
+    The charge lookup and the refund entry share one write transaction, so
+    concurrent refunds can't exceed the amount paid. Charges the ledger has
+    no record of get no refund entry. With queue=True the job for the
+    payment workers is created in the same transaction.
+    
+    Returns:
+        tuple: (error message or None, {'payment_id', 'job_id'})
+    """
+    with transaction() as conn:
+        lock_for_write(conn, f'charge:{transaction_id}')  # Until the amount refunded below is acted on
+        charge = find_charge(conn, transaction_id) if transaction_id else None
+        error = validate_refund(transaction_id, amount, charge)
+        if error:
+            return error, None
+        refund_id = None
+        if charge:
+            refund_id = create_payment(conn, charge['patron_id'], amount, f"Refund of {transaction_id}",
+                                       idempotency_key, kind='refund', refund_of=charge['id'],
+                                       transaction_id=transaction_id)
+        job_id = None
+        if queue:
+            job_id = create_payment_job(conn, 'refund', amount, transaction_id=transaction_id,
+                                        payment_id=refund_id, idempotency_key=idempotency_key)
+    
+    return None, {'payment_id': refund_id, 'job_id': job_id}
+
+
+def issue_refund(payment_gateway: PaymentGateway, transaction_id: str, amount: float,
+                 idempotency_key: Optional[str] = None) -> Tuple[str, str]:
+    """
+    Send a validated refund to the gateway.
+    Used by refund_late_fee_payment and by the payment queue workers.
+    
+    Returns:
+        tuple: (ledger status: 'completed', 'failed' or 'uncertain', message: str)
+    """
+    # THIS IS WHAT YOU SHOULD MOCK IN YOUR TESTS!
+    options = {'idempotency_key': idempotency_key} if idempotency_key else {}
     try:
-        success, transaction_id, message = payment_gateway.process_payment(
-            patron_id=patron_id,
-            amount=fee_amount,
-            description=f"Late fees for '{book['title']}'"
-        )
+        success, message = payment_gateway.refund_payment(transaction_id, amount, **options)
         
         if success:
-            return True, f"Payment successful! {message}", transaction_id
+            return 'completed', message
         else:
-            return False, f"Payment failed: {message}", None
+            return 'failed', f"Refund failed: {message}"
             
+    except CircuitOpenError as e:
+        return 'failed', f"Refund processing error: {str(e)}"
     except Exception as e:
-        # Handle payment gateway errors
-        return False, f"Payment processing error: {str(e)}", None
+        return 'uncertain', f"Refund processing error: {str(e)}"
 
 
+@instrumented
 def refund_late_fee_payment(transaction_id: str, amount: float, payment_gateway: PaymentGateway = None) -> Tuple[bool, str]:
     """
     Refund a late fee payment (e.g., if book was returned on time but fees were charged in error).
@@ -371,29 +722,44 @@ def refund_late_fee_payment(transaction_id: str, amount: float, payment_gateway:
     Returns:
         tuple: (success: bool, message: str)
     """
-    # Validate inputs
-    if not transaction_id or not transaction_id.startswith("txn_"):
-        return False, "Invalid transaction ID."
-    
-    if amount <= 0:
-        return False, "Refund amount must be greater than 0."
-    
-    if amount > 15.00:  # Maximum late fee per book
-        return False, "Refund amount exceeds maximum late fee."
+    # Validate inputs against the ledger and record the refund
+    try:
+        error, reserved = reserve_refund(transaction_id, amount, f"refund-{uuid.uuid4().hex}")
+    except Exception:
+        return False, "Database error occurred while recording the refund."
+    if error:
+        return False, error
     
-    # Use provided gateway or create new one
+    # Use provided gateway or the shared one (pooled connections, one circuit breaker)
     if payment_gateway is None:
-        payment_gateway = PaymentGateway()
+        payment_gateway = get_default_gateway()
     
     # Process refund through external gateway
-    # THIS IS WHAT YOU SHOULD MOCK IN YOUR TESTS!
-    try:
-        success, message = payment_gateway.refund_payment(transaction_id, amount)
-        
-        if success:
-            return True, message
-        else:
-            return False, f"Refund failed: {message}"
-            
-    except Exception as e:
-        return False, f"Refund processing error: {str(e)}"
\ No newline at end of file
+    status, message = issue_refund(payment_gateway, transaction_id, amount)
+    _record_outcome(reserved['payment_id'], status)
+    return status == 'completed', message
+
+
+@instrumented
+def get_payment_status(transaction_id: str) -> Dict:
+    """
+    Status of a late fee payment from the local payments ledger.
+    The gateway is only asked during reconciliation.
+    
+    Returns:
+        dict: transaction_id, status, amount, refunded_amount, patron_id and timestamps,
+              or {'status': 'not_found', ...} if the ledger has no such charge
+    """
+    charge = get_charge_by_transaction(transaction_id) if transaction_id else None
+    if not charge:
+        return {"status": "not_found", "message": "Transaction not found"}
+    
+    return {
+        'transaction_id': charge['transaction_id'],
+        'status': charge['status'],
+        'amount': charge['amount'],
+        'refunded_amount': charge['refunded_amount'],
+        'patron_id': charge['patron_id'],
+        'created_at': charge['created_at'],
+        'updated_at': charge['updated_at']
+    }
@@ -0,0 +1,200 @@
+"""
+Payment Queue Module - Asynchronous Late Fee Payments
+Payments and refunds are stored as jobs in the payment_jobs table and sent to
+the gateway by a pool of worker threads, so web requests return immediately
+"""
+
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Tuple
+from database import (
+    get_payment_job, claim_payment_job, finish_payment_job, requeue_running_payment_jobs,
+    update_payment_status
+)
+from services.library_service import (
+    reserve_late_fee_payment, charge_late_fees, reserve_refund, issue_refund
+)
+from services.payment_service import PaymentGateway, get_default_gateway
+
+PAYMENT_WORKERS = 4  # Payments in flight at once (one gateway call per worker)
+PAYMENT_POLL_INTERVAL = 1.0  # Seconds an idle worker waits before checking the table again
+PAYMENT_JOB_LEASE = 300.0  # Seconds after which a job still marked running is retried
+PAYMENT_REQUEUE_INTERVAL = 30.0  # Seconds between a pool's checks for jobs whose lease ran out
+
+_workers = None
+
+
+def enqueue_late_fee_payment(patron_id: str, book_id: int) -> Tuple[bool, str, Optional[int]]:
+    """
+    Validate a late fee payment, record it as pending in the payments ledger
+    and queue it for the payment workers.
+
+    Returns:
+        tuple: (queued: bool, message: str, job_id: Optional[int])
+    """
+    try:
+        error, reserved = reserve_late_fee_payment(patron_id, book_id, f"payment-{uuid.uuid4().hex}", queue=True)
+    except Exception:
+        return False, "Database error occurred while queuing the payment.", None
+    if error:
+        return False, error, None
+
+    _notify_workers()
+    return True, f"Payment of ${reserved['amount']:.2f} queued.", reserved['job_id']
+
+
+def enqueue_refund(transaction_id: str, amount: float) -> Tuple[bool, str, Optional[int]]:
+    """
+    Validate a refund against the payments ledger, record it as pending and
+    queue it for the payment workers.
+
+    Returns:
+        tuple: (queued: bool, message: str, job_id: Optional[int])
+    """
+    try:
+        error, reserved = reserve_refund(transaction_id, amount, f"refund-{uuid.uuid4().hex}", queue=True)
+    except Exception:
+        return False, "Database error occurred while queuing the refund.", None
+    if error:
+        return False, error, None
+
+    _notify_workers()
+    return True, f"Refund of ${amount:.2f} queued.", reserved['job_id']
+
+
+def run_payment_job(job: Dict, payment_gateway: PaymentGateway) -> bool:
+    """
+    Send one claimed job to the gateway and record the outcome on the job and
+    its ledger entry. Returns True on success.
+    """
+    if job['kind'] == 'payment':
+        status, message, transaction_id = charge_late_fees(
+            payment_gateway, job['patron_id'], job['amount'], job['description'], job['idempotency_key']
+        )
+    else:
+        status, message = issue_refund(payment_gateway, job['transaction_id'], job['amount'],
+                                       job['idempotency_key'])
+        transaction_id = None
+    if job['payment_id'] is not None:
+        update_payment_status(job['payment_id'], status, transaction_id)
+    success = status == 'completed'
+    finish_payment_job(job['id'], 'succeeded' if success else 'failed', message, transaction_id)
+    return success
+
+
+def wait_for_payment_job(job_id: int, timeout: float = 10.0, interval: float = 0.05) -> Optional[Dict]:
+    """Poll a job until it has succeeded or failed (or the timeout passes) and return it."""
+    deadline = time.monotonic() + timeout
+    while True:
+        job = get_payment_job(job_id)
+        if job is None or job['status'] in ('succeeded', 'failed') or time.monotonic() >= deadline:
+            return job
+        time.sleep(interval)
+
+
+class PaymentWorkerPool:
+    """
+    Worker threads that drain the payment_jobs table.
+
+    Concurrency is bounded by the number of workers. Jobs are claimed with a
+    single UPDATE, so several pools (e.g. one per server process) can share
+    the same table without processing a job twice. A job still running after
+    its lease (its worker raised, or its process died) is put back on the
+    queue by whichever pool checks next.
+    """
+
+    def __init__(self, workers: int = PAYMENT_WORKERS,
+                 gateway_factory: Callable[[], PaymentGateway] = get_default_gateway,
+                 poll_interval: float = PAYMENT_POLL_INTERVAL, lease: float = PAYMENT_JOB_LEASE):
+        self.workers = workers
+        self.gateway_factory = gateway_factory
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.requeue_interval = min(PAYMENT_REQUEUE_INTERVAL, lease)
+        self.stats = {'succeeded': 0, 'failed': 0, 'errors': 0, 'requeued': 0}
+        self._threads = []
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._stopping = False
+        self._next_requeue = 0.0
+
+    def start(self):
+        """Requeue jobs abandoned by a previous run and start the worker threads."""
+        self._requeue_expired()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'payment-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def notify(self):
+        """Wake an idle worker because a job was queued."""
+        with self._wake:
+            self._wake.notify()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop the workers once their current jobs are finished."""
+        with self._wake:
+            self._stopping = True
+            self._wake.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def _requeue_expired(self):
+        """Put jobs whose lease ran out back on the queue, at most once per requeue_interval."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next_requeue:
+                return
+            self._next_requeue = now + self.requeue_interval
+        self._count('requeued', requeue_running_payment_jobs(datetime.now() - timedelta(seconds=self.lease)))
+
+    def _run(self):
+        gateway = self.gateway_factory()
+        while not self._stopping:
+            try:
+                self._requeue_expired()
+                job = claim_payment_job()
+            except Exception:
+                self._count('errors')
+                job = None
+            if job is None:
+                with self._wake:
+                    if not self._stopping:
+                        self._wake.wait(self.poll_interval)
+                continue
+            try:
+                self._count('succeeded' if run_payment_job(job, gateway) else 'failed')
+            except Exception:
+                # Leave the job running; it is retried once its lease runs out
+                self._count('errors')
+
+
+def start_payment_workers(workers: int = PAYMENT_WORKERS,
+                          gateway_factory: Callable[[], PaymentGateway] = get_default_gateway,
+                          poll_interval: float = PAYMENT_POLL_INTERVAL) -> PaymentWorkerPool:
+    """Start the process-wide payment workers, replacing any that are already running."""
+    global _workers
+    stop_payment_workers()
+    _workers = PaymentWorkerPool(workers, gateway_factory, poll_interval)
+    _workers.start()
+    return _workers
+
+
+def stop_payment_workers(timeout: Optional[float] = None):
+    """Stop the process-wide payment workers if they are running."""
+    global _workers
+    if _workers is not None:
+        _workers.stop(timeout)
+        _workers = None
+
+
+def _notify_workers():
+    if _workers is not None:
+        _workers.notify()
@@ -4,12 +4,103 @@ This module simulates integration with an external payment processing API.
 
 For Assignment 3: You will learn to mock this service in their tests
 since we cannot make actual payment API calls during testing.
+
+When a gateway URL is configured, the gateway talks to it over HTTP through
+one shared keep-alive session, with timeouts, idempotency keys, jittered
+exponential retries and a circuit breaker. `requests` is only imported once
+a real gateway is used, so the simulated gateway (and the catalog pages that
+import this module through library_service) don't pay for loading it.
 """
 
-import requests
-from typing import Dict, Tuple
+import random
+import threading
+import uuid
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+from urllib.parse import quote
 import time
 
+if TYPE_CHECKING:
+    import requests
+
+DEFAULT_BASE_URL = "https://api.payment-gateway.example.com"
+GATEWAY_TIMEOUT = (3.05, 10.0)  # (connect, read) seconds for each HTTP attempt
+GATEWAY_MAX_RETRIES = 3  # Extra attempts after a timeout, connection error, 429 or 5xx
+GATEWAY_BACKOFF = 0.2  # Base delay in seconds, doubled for each retry
+GATEWAY_MAX_BACKOFF = 5.0  # Upper bound on one retry delay
+GATEWAY_POOL_SIZE = 10  # Keep-alive connections per gateway host
+BREAKER_FAILURE_THRESHOLD = 5  # Consecutive failed attempts that open the circuit
+BREAKER_RESET_TIMEOUT = 30.0  # Seconds the circuit stays open before a trial call
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+_session = None
+_session_lock = threading.Lock()
+_default_gateway = None
+
+
+class PaymentGatewayError(Exception):
+    """The gateway could not be reached or kept failing; the payment may be retried later."""
+
+
+class CircuitOpenError(PaymentGatewayError):
+    """Calls are being refused because the gateway has been failing."""
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing gateway for a while instead of piling up timeouts.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    calls fail fast. Once ``reset_timeout`` has passed one trial call is let
+    through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Return True if a call may be made now."""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+
+def get_shared_session() -> 'requests.Session':
+    """Get the process-wide HTTP session, so every gateway call reuses pooled keep-alive connections."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=GATEWAY_POOL_SIZE, pool_maxsize=GATEWAY_POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
 
 class PaymentGateway:
     """
@@ -20,19 +111,97 @@ class PaymentGateway:
     - Making actual API calls
     - Depending on external service availability
     - Incurring costs or rate limits
+
+    Without a base_url the gateway runs in simulated mode. With one, it
+    makes real HTTP calls through the shared session.
     """
     
-    def __init__(self, api_key: str = "test_key_12345"):
+    def __init__(self, api_key: str = "test_key_12345", base_url: Optional[str] = None,
+                 session: Optional['requests.Session'] = None, timeout=GATEWAY_TIMEOUT,
+                 max_retries: int = GATEWAY_MAX_RETRIES, backoff: float = GATEWAY_BACKOFF,
+                 max_backoff: float = GATEWAY_MAX_BACKOFF, breaker: Optional[CircuitBreaker] = None):
         """
         Initialize payment gateway with API credentials.
         
         Args:
             api_key: API key for authentication (default is test key)
+            base_url: Gateway URL; None simulates the gateway locally
+            session: HTTP session to use (default: the shared pooled session)
+            timeout: Seconds, or a (connect, read) tuple, for each HTTP attempt
+            max_retries: Retries after a timeout, connection error, 429 or 5xx
+            backoff: Base delay for the jittered exponential backoff
+            max_backoff: Largest delay between two attempts
+            breaker: Circuit breaker (default: a new one for this gateway)
         """
         self.api_key = api_key
-        self.base_url = "https://api.payment-gateway.example.com"
+        self.simulated = base_url is None
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip('/')
+        self.session = session
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker or CircuitBreaker()
     
-    def process_payment(self, patron_id: str, amount: float, description: str = "") -> Tuple[bool, str, str]:
+    def _request(self, method: str, path: str, json: Optional[Dict] = None,
+                 idempotency_key: Optional[str] = None, timeout=None) -> 'requests.Response':
+        """
+        Send one API call, retrying transient failures.
+
+        Timeouts, connection errors, 429 and 5xx responses are retried with
+        full-jitter exponential backoff (honouring Retry-After), reusing the
+        same idempotency key so the gateway never applies a charge twice.
+        Other responses are returned to the caller.
+
+        Raises:
+            CircuitOpenError: The circuit breaker refused the call before anything was sent
+            PaymentGatewayError: Every attempt failed, or the circuit opened after an
+                attempt was sent (which the gateway may have applied)
+        """
+        import requests
+        session = self.session or get_shared_session()
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        if idempotency_key:
+            headers["Idempotency-Key"] = idempotency_key
+
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                if attempt:
+                    raise PaymentGatewayError(
+                        f"Payment gateway circuit opened after {attempt} attempt(s) ({error})")
+                raise CircuitOpenError("Payment gateway unavailable (circuit open)")
+            retry_after = 0.0
+            try:
+                response = session.request(method, f"{self.base_url}{path}", json=json,
+                                           headers=headers, timeout=timeout or self.timeout)
+            except (requests.Timeout, requests.ConnectionError) as e:
+                error = f"{type(e).__name__}: {e}"
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    self.breaker.record_success()
+                    return response
+                error = f"HTTP {response.status_code}"
+                try:
+                    retry_after = float(response.headers.get("Retry-After", 0))
+                except ValueError:
+                    retry_after = 0.0
+            self.breaker.record_failure()
+            if attempt < self.max_retries:
+                cap = min(self.max_backoff, self.backoff * (2 ** attempt))
+                time.sleep(max(retry_after, random.uniform(0, cap)))
+        raise PaymentGatewayError(f"Payment gateway request failed after {self.max_retries + 1} attempts ({error})")
+
+    @staticmethod
+    def _error_message(response: 'requests.Response') -> str:
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        return body.get("message") or body.get("error") or f"HTTP {response.status_code}"
+
+    def process_payment(self, patron_id: str, amount: float, description: str = "",
+                        idempotency_key: Optional[str] = None, timeout=None) -> Tuple[bool, str, str]:
         """
         Process a payment through the external gateway.
         
@@ -43,6 +212,8 @@ class PaymentGateway:
             patron_id: 6-digit patron/customer ID
             amount: Payment amount in dollars
             description: Payment description
+            idempotency_key: Key that makes retries of this charge safe (generated if omitted)
+            timeout: Per-call override of the HTTP timeout
             
         Returns:
             tuple: (success: bool, transaction_id: str, message: str)
@@ -51,21 +222,21 @@ class PaymentGateway:
             gateway = PaymentGateway()
             success, txn_id, msg = gateway.process_payment("123456", 10.50, "Late fees")
         """
+        if not self.simulated:
+            response = self._request("POST", "/charges", json={
+                "customer_id": patron_id,
+                "amount": amount,
+                "currency": "usd",
+                "description": description
+            }, idempotency_key=idempotency_key or f"charge-{uuid.uuid4().hex}", timeout=timeout)
+            if response.ok:
+                body = response.json()
+                return True, body["id"], body.get("message") or f"Payment of ${amount:.2f} processed successfully"
+            return False, "", self._error_message(response)
+
         # Simulate API call delay
         time.sleep(0.5)
         
-        # In a real implementation, this would make an HTTP request:
-        # response = requests.post(
-        #     f"{self.base_url}/charges",
-        #     headers={"Authorization": f"Bearer {self.api_key}"},
-        #     json={
-        #         "customer_id": patron_id,
-        #         "amount": amount,
-        #         "currency": "usd",
-        #         "description": description
-        #     }
-        # )
-        
         # For this template, we simulate different scenarios based on amount
         # This allows testing without a real API
         
@@ -82,7 +253,8 @@ class PaymentGateway:
         transaction_id = f"txn_{patron_id}_{int(time.time())}"
         return True, transaction_id, f"Payment of ${amount:.2f} processed successfully"
     
-    def refund_payment(self, transaction_id: str, amount: float) -> Tuple[bool, str]:
+    def refund_payment(self, transaction_id: str, amount: float,
+                       idempotency_key: Optional[str] = None, timeout=None) -> Tuple[bool, str]:
         """
         Refund a previous payment.
         
@@ -92,10 +264,22 @@ class PaymentGateway:
         Args:
             transaction_id: Original transaction ID to refund
             amount: Amount to refund
+            idempotency_key: Key that makes retries of this refund safe (generated if omitted)
+            timeout: Per-call override of the HTTP timeout
             
         Returns:
             tuple: (success: bool, message: str)
         """
+        if not self.simulated:
+            response = self._request("POST", "/refunds", json={
+                "transaction_id": transaction_id,
+                "amount": amount
+            }, idempotency_key=idempotency_key or f"refund-{uuid.uuid4().hex}", timeout=timeout)
+            if response.ok:
+                refund_id = response.json()["id"]
+                return True, f"Refund of ${amount:.2f} processed successfully. Refund ID: {refund_id}"
+            return False, self._error_message(response)
+
         time.sleep(0.5)
         
         if not transaction_id or not transaction_id.startswith("txn_"):
@@ -107,7 +291,7 @@ class PaymentGateway:
         refund_id = f"refund_{transaction_id}_{int(time.time())}"
         return True, f"Refund of ${amount:.2f} processed successfully. Refund ID: {refund_id}"
     
-    def verify_payment_status(self, transaction_id: str) -> Dict:
+    def verify_payment_status(self, transaction_id: str, timeout=None) -> Dict:
         """
         Check the status of a payment transaction.
         
@@ -116,10 +300,19 @@ class PaymentGateway:
         
         Args:
             transaction_id: Transaction ID to check
+            timeout: Per-call override of the HTTP timeout
             
         Returns:
             dict: Payment status information
         """
+        if not self.simulated:
+            response = self._request("GET", f"/charges/{transaction_id}", timeout=timeout)
+            if response.status_code == 404:
+                return {"status": "not_found", "message": "Transaction not found"}
+            if not response.ok:
+                return {"status": "error", "message": self._error_message(response)}
+            return response.json()
+
         time.sleep(0.3)
         
         if not transaction_id or not transaction_id.startswith("txn_"):
@@ -131,4 +324,48 @@ class PaymentGateway:
             "status": "completed",
             "amount": 10.50,
             "timestamp": time.time()
-        }
\ No newline at end of file
+        }
+
+    def find_payment(self, idempotency_key: str, timeout=None) -> Dict:
+        """
+        Look up a charge by the idempotency key it was sent with.
+
+        Used when the charge's outcome (and so its transaction ID) was never
+        received, e.g. after a timeout.
+
+        Args:
+            idempotency_key: Key the charge was sent with
+            timeout: Per-call override of the HTTP timeout
+
+        Returns:
+            dict: Payment status information, with the transaction ID if the charge exists
+        """
+        if not self.simulated:
+            response = self._request("GET", f"/charges?idempotency_key={quote(idempotency_key, safe='')}",
+                                     timeout=timeout)
+            if response.status_code == 404:
+                return {"status": "not_found", "message": "Transaction not found"}
+            if not response.ok:
+                return {"status": "error", "message": self._error_message(response)}
+            return response.json()
+
+        time.sleep(0.3)
+
+        # The simulated gateway keeps no record of the charges it was sent, so it
+        # can't say whether one went through; the reconciler leaves the entry as is
+        return {"status": "unknown", "message": "Charge lookup not available"}
+
+
+def configure_payment_gateway(base_url: Optional[str] = None, api_key: str = "test_key_12345",
+                              **options) -> PaymentGateway:
+    """Set up the shared gateway used when callers don't pass their own (base_url=None simulates)."""
+    global _default_gateway
+    _default_gateway = PaymentGateway(api_key, base_url, **options)
+    return _default_gateway
+
+
+def get_default_gateway() -> PaymentGateway:
+    """Get the shared gateway, so its session and circuit breaker are reused across payments."""
+    if _default_gateway is None:
+        return configure_payment_gateway()
+    return _default_gateway
@@ -0,0 +1,190 @@
+"""
+Reconciliation Module - Payment Status Checks Against the Gateway
+A background thread periodically asks the gateway about ledger entries whose
+outcome is unknown (pending or uncertain) and about completed charges that
+were never checked, settles what it can and records any drift. Gateway calls
+are spread over a small thread pool and rate-limited, and nothing here runs
+on the request path.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+from database import get_unreconciled_payments, record_reconciliation
+from services.payment_service import PaymentGateway, get_default_gateway
+
+RECONCILE_INTERVAL = 300.0  # Seconds between reconciliation runs (0 disables the reconciler)
+RECONCILE_BATCH_SIZE = 100  # Ledger entries checked per run
+RECONCILE_CONCURRENCY = 4  # Status checks in flight at once
+RECONCILE_RATE = 5.0  # Status checks per second, at most
+RECONCILE_GRACE = 300.0  # Seconds a pending entry is left alone (its payment may still be in flight)
+RECONCILE_RECHECK = 3600.0  # Seconds before an unsettled entry is checked again
+RECONCILE_TIMEOUT = 5.0  # Seconds allowed for each status check
+
+# Gateway statuses that settle a ledger entry; anything else is inconclusive
+GATEWAY_STATUSES = {
+    'completed': 'completed',
+    'succeeded': 'completed',
+    'failed': 'failed',
+    'declined': 'failed',
+    'not_found': 'failed',
+}
+
+_reconciler = None
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` calls per second with bursts of up to `burst`."""
+
+    def __init__(self, rate: float = RECONCILE_RATE, burst: Optional[int] = None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a call is allowed."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def check_payment(payment: Dict, payment_gateway: PaymentGateway, timeout: float = RECONCILE_TIMEOUT) -> str:
+    """
+    Check one ledger entry against the gateway and record the result.
+
+    Charges are looked up by transaction ID, or by the idempotency key they
+    were sent with when the transaction ID was never received (a timed-out
+    charge), in which case the ID the gateway reports is stored. Refunds
+    without a transaction ID are recorded as 'unverifiable' drift so they
+    can be reviewed by hand.
+
+    Returns:
+        str: 'settled', 'matched', 'drift', 'unverifiable' or 'inconclusive'
+    """
+    if payment['kind'] != 'charge' or not (payment['transaction_id'] or payment.get('idempotency_key')):
+        record_reconciliation(payment, 'unverifiable')
+        return 'unverifiable'
+
+    if payment['transaction_id']:
+        result = payment_gateway.verify_payment_status(payment['transaction_id'], timeout=timeout)
+    else:
+        result = payment_gateway.find_payment(payment['idempotency_key'], timeout=timeout)
+    transaction_id = result.get('transaction_id') or result.get('id')
+    gateway_status = result.get('status')
+    status = GATEWAY_STATUSES.get(gateway_status)
+    if status is None:
+        # e.g. still processing on the gateway's side, or an error response
+        return 'inconclusive'
+    if status == payment['status']:
+        record_reconciliation(payment)
+        return 'matched'
+    if payment['status'] in ('pending', 'uncertain'):
+        if record_reconciliation(payment, gateway_status, status, transaction_id):
+            return 'settled'
+        return 'inconclusive'
+    # The gateway disagrees with a settled entry; leave it for a person to fix
+    record_reconciliation(payment, gateway_status)
+    return 'drift'
+
+
+def reconcile_payments(payment_gateway: PaymentGateway = None, limit: int = RECONCILE_BATCH_SIZE,
+                       concurrency: int = RECONCILE_CONCURRENCY,
+                       rate_limiter: Optional[RateLimiter] = None,
+                       grace: float = RECONCILE_GRACE, recheck: float = RECONCILE_RECHECK,
+                       timeout: float = RECONCILE_TIMEOUT) -> Dict:
+    """
+    Check one batch of ledger entries against the gateway.
+
+    Returns:
+        dict: How many entries were checked and how many ended in each outcome
+              of check_payment, plus 'errors' for checks that raised
+    """
+    if payment_gateway is None:
+        payment_gateway = get_default_gateway()
+    if rate_limiter is None:
+        rate_limiter = RateLimiter()
+    now = datetime.now()
+    payments = get_unreconciled_payments(now - timedelta(seconds=grace), now - timedelta(seconds=recheck), limit)
+
+    def check(payment):
+        rate_limiter.acquire()
+        try:
+            return check_payment(payment, payment_gateway, timeout)
+        except Exception:
+            # Gateway down or circuit open; the entry is picked up again next run
+            return 'errors'
+
+    summary = {'checked': len(payments), 'settled': 0, 'matched': 0, 'drift': 0,
+               'unverifiable': 0, 'inconclusive': 0, 'errors': 0}
+    if payments:
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(payments))),
+                                thread_name_prefix='reconcile') as executor:
+            for outcome in executor.map(check, payments):
+                summary[outcome] += 1
+    return summary
+
+
+class Reconciler:
+    """Background thread that runs reconcile_payments every `interval` seconds."""
+
+    def __init__(self, interval: float = RECONCILE_INTERVAL,
+                 gateway_factory: Callable[[], PaymentGateway] = get_default_gateway,
+                 **options):
+        self.interval = interval
+        self.gateway_factory = gateway_factory
+        self.options = options
+        self.rate_limiter = RateLimiter(options.pop('rate', RECONCILE_RATE))
+        self.last_run = None  # Summary of the most recent run
+        self.runs = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='payment-reconciler', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop the thread, letting a run in progress finish."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.last_run = reconcile_payments(self.gateway_factory(), rate_limiter=self.rate_limiter,
+                                                   **self.options)
+            except Exception:
+                self.last_run = {'checked': 0, 'errors': 1}
+            self.runs += 1
+
+
+def start_reconciler(interval: float = RECONCILE_INTERVAL,
+                     gateway_factory: Callable[[], PaymentGateway] = get_default_gateway,
+                     **options) -> Reconciler:
+    """Start the process-wide reconciler, replacing one that is already running."""
+    global _reconciler
+    stop_reconciler()
+    _reconciler = Reconciler(interval, gateway_factory, **options)
+    _reconciler.start()
+    return _reconciler
+
+
+def stop_reconciler(timeout: Optional[float] = None):
+    """Stop the process-wide reconciler if it is running."""
+    global _reconciler
+    if _reconciler is not None:
+        _reconciler.stop(timeout)
+        _reconciler = None
@@ -0,0 +1,371 @@
+"""
+Serving module for Library Management System
+Production entry point around create_app(). `python app.py` and `flask run`
+use Werkzeug's single-process development server; this serves the app from
+several forked worker processes, each handling requests on a bounded pool of
+threads:
+
+    python serving.py --workers 4 --threads 8 --bind 0.0.0.0:5000
+
+Where gunicorn is installed, `gunicorn -c gunicorn.conf.py wsgi:app` runs the
+same app with the same per-worker hooks (init_worker / shutdown_worker).
+
+The app is created once in the master process, so init_database and
+add_sample_data run once, with its background threads off and no database
+connections left open. After the fork each worker opens its own connection
+pool, warms it and the caches with a few requests, and starts its background
+threads. SIGTERM or SIGINT to the master is passed on to the workers as
+SIGTERM; they stop accepting connections, finish the requests in flight and
+exit, and are killed if that takes longer than the graceful timeout.
+
+Every setting can also be given as a LIBRARY_* environment variable (see
+APP_SETTINGS and SERVER_SETTINGS); command line options take precedence.
+"""
+
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Mapping, Optional, Tuple
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+import database
+import instrumentation
+from app import create_app, start_background_tasks, stop_background_tasks
+from services import payment_queue, reconciliation
+
+WORKERS = 1  # Worker processes; more are opt-in (each keeps its own in-process caches)
+THREADS = 8  # Request threads per worker
+BIND = '0.0.0.0:5000'
+GRACEFUL_TIMEOUT = 30.0  # Seconds workers get to finish in-flight requests on shutdown
+WARM_PATHS = ('/catalog',)  # Requested by each worker before it accepts connections
+BACKLOG = 2048  # Pending connections the listening socket queues
+RESPAWN_DELAY = 1.0  # Seconds before replacing a worker that died
+
+logger = logging.getLogger('library.server')
+
+
+def _flag(value: str) -> bool:
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _paths(value: str) -> Tuple[str, ...]:
+    return tuple(path.strip() for path in value.split(',') if path.strip())
+
+
+# Environment variable -> (create_app setting, type)
+APP_SETTINGS = {
+    'LIBRARY_DATABASE': ('DATABASE', str),
+    'LIBRARY_DB_BACKEND': ('DB_BACKEND', str),
+    'LIBRARY_DB_POOL_SIZE': ('DB_POOL_SIZE', int),
+    'LIBRARY_DB_POOL_TIMEOUT': ('DB_POOL_TIMEOUT', float),
+    'LIBRARY_DB_CHECKPOINT_INTERVAL': ('DB_CHECKPOINT_INTERVAL', float),
+    'LIBRARY_BOOK_CACHE_URL': ('BOOK_CACHE_URL', str),
+    'LIBRARY_BOOK_CACHE_SIZE': ('BOOK_CACHE_SIZE', int),
+    'LIBRARY_BOOK_CACHE_TTL': ('BOOK_CACHE_TTL', float),
+    'LIBRARY_PAYMENT_WORKERS': ('PAYMENT_WORKERS', int),
+    'LIBRARY_PAYMENT_GATEWAY_URL': ('PAYMENT_GATEWAY_URL', str),
+    'LIBRARY_PAYMENT_API_KEY': ('PAYMENT_API_KEY', str),
+    'LIBRARY_RECONCILE_INTERVAL': ('RECONCILE_INTERVAL', float),
+    'LIBRARY_INSTRUMENTATION': ('INSTRUMENTATION', _flag),
+    'LIBRARY_PROFILING': ('PROFILING', _flag),
+    'LIBRARY_SLOW_QUERY_THRESHOLD': ('SLOW_QUERY_THRESHOLD', float),
+    'LIBRARY_QUERY_BUDGET_MODE': ('QUERY_BUDGET_MODE', str),
+}
+
+# Environment variable -> (server option, type, default)
+SERVER_SETTINGS = {
+    'LIBRARY_WORKERS': ('workers', int, WORKERS),
+    'LIBRARY_THREADS': ('threads', int, THREADS),
+    'LIBRARY_BIND': ('bind', str, BIND),
+    'LIBRARY_GRACEFUL_TIMEOUT': ('graceful_timeout', float, GRACEFUL_TIMEOUT),
+    'LIBRARY_WARM_PATHS': ('warm_paths', _paths, WARM_PATHS),
+    'LIBRARY_ACCESS_LOG': ('access_log', _flag, False),
+}
+
+
+def load_settings(environ: Optional[Mapping[str, str]] = None) -> Tuple[Dict, Dict]:
+    """
+    Read LIBRARY_* environment variables.
+
+    Returns:
+        tuple: (app_config: dict of create_app settings that were set, options: dict of server options)
+    """
+    environ = os.environ if environ is None else environ
+    config = {}
+    for name, (key, parse) in APP_SETTINGS.items():
+        if environ.get(name):
+            config[key] = parse(environ[name])
+    options = {}
+    for name, (key, parse, default) in SERVER_SETTINGS.items():
+        options[key] = parse(environ[name]) if environ.get(name) else default
+    return config, options
+
+
+def parse_bind(bind: str) -> Tuple[str, int]:
+    """Split host:port (the host defaults to all interfaces)."""
+    host, _, port = bind.rpartition(':')
+    try:
+        return host.strip('[]') or '0.0.0.0', int(port)
+    except ValueError:
+        raise ValueError(f"Bind address must be host:port, got {bind!r}")
+
+
+def create_server_app(config: Optional[Dict] = None, threads: int = THREADS):
+    """
+    Create the app in the master process before forking workers.
+
+    Sets up the schema and sample data once, starts no background threads and
+    closes the master's connections so none are shared with the workers. The
+    pool is sized so every request thread, payment worker and reconciler
+    check can hold a connection at once, since they all borrow from it.
+    """
+    config = dict(config or {})
+    background = config.get('PAYMENT_WORKERS', payment_queue.PAYMENT_WORKERS)
+    if config.get('RECONCILE_INTERVAL', reconciliation.RECONCILE_INTERVAL):
+        background += reconciliation.RECONCILE_CONCURRENCY
+    config.setdefault('DB_POOL_SIZE', max(database.POOL_SIZE, threads + background))
+    config['BACKGROUND_TASKS'] = False
+    app = create_app(config)
+    database.get_pool().close_all()
+    return app
+
+
+def init_worker(app, primary: bool = True, warm_paths: Iterable[str] = WARM_PATHS):
+    """
+    Prepare a freshly forked worker: a connection pool of its own, opened
+    ahead of time, caches filled by a few warm-up requests, and the background
+    threads (singletons only in the primary worker, see start_background_tasks).
+    """
+    pool = database.reset_pool_after_fork()
+    pool.warm(app.config.get('DB_POOL_WARM_SIZE') or pool.max_size)
+    client = app.test_client()
+    for path in warm_paths:
+        response = client.get(path)
+        if response.status_code >= 500:
+            logger.warning('Warm-up request %s returned %s', path, response.status_code)
+    instrumentation.reset_metrics()  # Keep warm-up out of /metrics
+    start_background_tasks(app, primary)
+
+
+def shutdown_worker(timeout: Optional[float] = GRACEFUL_TIMEOUT):
+    """Stop the worker's background threads and close its connections."""
+    stop_background_tasks(timeout)
+    database.get_pool().close_all()
+
+
+class RequestHandler(WSGIRequestHandler):
+    """Werkzeug request handler that only writes an access log when asked to."""
+
+    access_log = False
+
+    def log_request(self, code='-', size='-'):
+        if self.access_log:
+            super().log_request(code, size)
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    Werkzeug server that handles connections on a fixed pool of threads.
+
+    The accept loop waits while every thread is busy, leaving new connections
+    on the shared listening socket for the other workers to pick up.
+    """
+
+    def __init__(self, host: str, port: int, app, threads: int = THREADS, fd: Optional[int] = None,
+                 handler=RequestHandler):
+        self._executor = None
+        super().__init__(host, port, app, handler=handler, fd=fd)
+        self.threads = threads
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix='request')
+        self._slots = threading.BoundedSemaphore(threads)
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        try:
+            self._executor.submit(self._handle, request, client_address)
+        except RuntimeError:
+            self._slots.release()
+            self.shutdown_request(request)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        """Finish the requests in flight, then close the socket."""
+        if self._executor is not None:  # Also called by BaseWSGIServer.__init__ when given an fd
+            self._executor.shutdown(wait=True)
+        super().server_close()
+
+
+def run_worker(app, sock: socket.socket, primary: bool, options: Dict):
+    """Serve requests from the inherited listening socket until SIGTERM."""
+    server = None
+    stopping = threading.Event()
+
+    def stop(signum, frame):
+        stopping.set()
+        if server is not None:
+            # shutdown() waits for serve_forever(), which this (main) thread is running
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C reaches the master, which sends SIGTERM
+
+    init_worker(app, primary, options['warm_paths'])
+    handler = type('WorkerRequestHandler', (RequestHandler,), {'access_log': options['access_log']})
+    host, port = sock.getsockname()[:2]
+    server = PooledWSGIServer(host, port, app, options['threads'], fd=sock.fileno(), handler=handler)
+    logger.info('Worker ready%s', ' (primary)' if primary else '')
+    try:
+        if not stopping.is_set():
+            server.serve_forever()
+    finally:
+        server.server_close()
+        shutdown_worker(options['graceful_timeout'])
+    logger.info('Worker stopped')
+
+
+class PreforkServer:
+    """
+    Master process: binds the listening socket, forks the workers, replaces
+    any that die and shuts them down gracefully on SIGTERM or SIGINT.
+
+    Worker 0 is the primary worker; a replacement for it is primary too.
+    """
+
+    def __init__(self, app, workers: int = WORKERS, threads: int = THREADS, bind: str = BIND,
+                 graceful_timeout: float = GRACEFUL_TIMEOUT, warm_paths: Iterable[str] = WARM_PATHS,
+                 access_log: bool = False):
+        if workers < 1 or threads < 1:
+            raise ValueError("workers and threads must be at least 1")
+        self.app = app
+        self.workers = workers
+        self.options = {'threads': threads, 'graceful_timeout': graceful_timeout,
+                        'warm_paths': tuple(warm_paths), 'access_log': access_log}
+        self.address = parse_bind(bind)
+        self.socket = None
+        self._children = {}  # pid -> worker index
+        self._stopping = False
+
+    def bind(self) -> Tuple[str, int]:
+        """Open the listening socket shared by every worker."""
+        self.socket = socket.create_server(self.address, backlog=BACKLOG)
+        self.socket.set_inheritable(True)
+        return self.socket.getsockname()[:2]
+
+    def run(self) -> int:
+        if self.socket is None:
+            self.bind()
+        host, port = self.socket.getsockname()[:2]
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        logger.info('Listening on http://%s:%s with %d workers x %d threads',
+                    host, port, self.workers, self.options['threads'])
+        for index in range(self.workers):
+            self._spawn(index)
+        try:
+            while not self._stopping:
+                for index in self._reap():
+                    if not self._stopping:
+                        time.sleep(RESPAWN_DELAY)
+                        self._spawn(index)
+                time.sleep(0.2)
+        finally:
+            self._shutdown()
+        return 0
+
+    def _request_stop(self, signum, frame):
+        self._stopping = True
+
+    def _spawn(self, index: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.app, self.socket, index == 0, self.options)
+            except BaseException:
+                logger.exception('Worker %d failed', index)
+                code = 1
+            finally:
+                logging.shutdown()
+                os._exit(code)
+        self._children[pid] = index
+        logger.info('Started worker %d (pid %d)', index, pid)
+
+    def _reap(self):
+        """Collect exited workers and return their indexes."""
+        exited = []
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            index = self._children.pop(pid, None)
+            if index is not None:
+                if not self._stopping:
+                    logger.warning('Worker %d (pid %d) exited with status %d', index, pid,
+                                   os.waitstatus_to_exitcode(status))
+                exited.append(index)
+        return exited
+
+    def _shutdown(self):
+        logger.info('Shutting down %d workers', len(self._children))
+        for pid in self._children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.options['graceful_timeout']
+        while self._children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.05)
+        for pid in list(self._children):
+            logger.warning('Killing worker pid %d after the graceful timeout', pid)
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        self._children.clear()
+        self.socket.close()
+
+
+def main(argv=None) -> int:
+    config, options = load_settings()
+    parser = argparse.ArgumentParser(description='Serve the Library Management System with several worker processes.')
+    parser.add_argument('--workers', type=int, default=options['workers'], help='Worker processes (LIBRARY_WORKERS)')
+    parser.add_argument('--threads', type=int, default=options['threads'], help='Request threads per worker (LIBRARY_THREADS)')
+    parser.add_argument('--bind', default=options['bind'], help='host:port to listen on (LIBRARY_BIND)')
+    parser.add_argument('--graceful-timeout', type=float, default=options['graceful_timeout'],
+                        help='Seconds to finish in-flight requests on shutdown (LIBRARY_GRACEFUL_TIMEOUT)')
+    parser.add_argument('--database', default=config.get('DATABASE'), help='SQLite database file or postgresql:// URL (LIBRARY_DATABASE)')
+    parser.add_argument('--access-log', action='store_true', default=options['access_log'],
+                        help='Log every request (LIBRARY_ACCESS_LOG)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(process)d] %(levelname)s %(name)s: %(message)s')
+    if args.database:
+        config['DATABASE'] = args.database
+    app = create_server_app(config, args.threads)
+    server = PreforkServer(app, args.workers, args.threads, args.bind, args.graceful_timeout,
+                           options['warm_paths'], args.access_log)
+    return server.run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
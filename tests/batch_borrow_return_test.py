@@ -0,0 +1,84 @@
+import sqlite3
+import pytest
+from services.library_service import (
+    borrow_books_batch, return_books_batch, borrow_book_by_patron
+)
+from database import insert_book, get_book_by_isbn, get_patron_borrow_count
+
+def add_books(count, copies=1):
+    ids = []
+    for i in range(count):
+        isbn = f"{3000000000000 + i}"
+        insert_book(f"Batch Book {i}", "Batch Author", isbn, copies, copies)
+        ids.append(get_book_by_isbn(isbn)['id'])
+    return ids
+
+def test_borrow_batch_valid():
+    """Test borrowing several books at once."""
+    ids = add_books(3)
+    success, message, results = borrow_books_batch("123456", ids)
+    assert success is True
+    assert "Borrowed 3 of 3" in message
+    assert [r['book_id'] for r in results] == ids
+    assert all(r['success'] for r in results)
+    assert get_patron_borrow_count("123456") == 3
+
+def test_borrow_batch_respects_limit():
+    """Test the 5-book limit applies across the batch and existing loans."""
+    ids = add_books(6)
+    borrow_book_by_patron("123456", ids[0])
+    success, message, results = borrow_books_batch("123456", ids[1:])
+    assert [r['success'] for r in results] == [True, True, True, True, False]
+    assert "maximum borrowing limit" in results[-1]['message']
+    assert get_patron_borrow_count("123456") == 5
+
+def test_borrow_batch_partial_results():
+    """Test unavailable, missing and duplicate books fail individually."""
+    ids = add_books(2)
+    borrow_book_by_patron("654321", ids[1])
+    success, message, results = borrow_books_batch("123456", [ids[0], ids[1], 99999, ids[0]])
+    assert success is True
+    assert [r['success'] for r in results] == [True, False, False, False]
+    assert "not available" in results[1]['message']
+    assert "Book not found" in results[2]['message']
+    assert "Duplicate" in results[3]['message']
+
+def test_borrow_batch_invalid_patron():
+    """Test a bad patron ID rejects the whole batch."""
+    success, message, results = borrow_books_batch("12", [1, 2])
+    assert success is False
+    assert results == []
+    assert "Invalid patron ID" in message
+
+def test_borrow_batch_rolls_back_on_error(monkeypatch):
+    """Test a database error undoes every borrow in the batch."""
+    ids = add_books(2)
+    calls = []
+    def create_then_fail(conn, patron_id, book_id, borrow_date, due_date):
+        calls.append(book_id)
+        if len(calls) == 2:
+            raise sqlite3.OperationalError("disk I/O error")
+    monkeypatch.setattr("services.library_service.create_borrow_record", create_then_fail)
+    success, message, results = borrow_books_batch("123456", ids)
+    assert success is False
+    assert get_book_by_isbn("3000000000000")['available_copies'] == 1
+
+def test_return_batch():
+    """Test returning several books at once."""
+    ids = add_books(2)
+    borrow_books_batch("123456", ids)
+    success, message, results = return_books_batch("123456", ids + [99999])
+    assert success is True
+    assert [r['success'] for r in results] == [True, True, False]
+    assert get_patron_borrow_count("123456") == 0
+    assert get_book_by_isbn("3000000000001")['available_copies'] == 1
+
+def test_batch_api_endpoints(client):
+    """Test the batch borrow and return endpoints."""
+    ids = add_books(2)
+    response = client.post('/api/borrow/batch', json={'patron_id': '123456', 'book_ids': ids})
+    assert response.status_code == 200
+    assert len(response.get_json()['results']) == 2
+    response = client.post('/api/return/batch', json={'patron_id': '123456', 'book_ids': ids})
+    assert all(r['success'] for r in response.get_json()['results'])
+    assert client.post('/api/borrow/batch', json={'patron_id': '123456', 'book_ids': 'x'}).status_code == 400
@@ -0,0 +1,134 @@
+import time
+import fnmatch
+import pytest
+import database
+from cache import LRUCache, RedisCache, MISSING, create_cache
+from database import (
+    get_book_by_id, get_book_by_isbn, insert_book, update_book_availability,
+    clear_database, get_book_cache_stats, configure_book_cache
+)
+from services.library_service import borrow_book_by_patron, return_book_by_patron
+
+class FakeRedis:
+    """Minimal dict-backed stand-in for a Redis client."""
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, px=None):
+        self.data[key] = value
+
+    def delete(self, *keys):
+        return sum(1 for key in keys if self.data.pop(key, None) is not None)
+
+    def scan_iter(self, match):
+        return [key for key in list(self.data) if fnmatch.fnmatch(key, match)]
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    configure_book_cache()
+    yield
+    configure_book_cache()
+
+def add_book(isbn="1234567890123", copies=2):
+    insert_book("Cached Book", "Cache Author", isbn, copies, copies)
+    return get_book_by_isbn(isbn)['id']
+
+def test_lru_evicts_least_recently_used():
+    """Test that a full cache evicts the entry used longest ago."""
+    cache = LRUCache(max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is MISSING
+    assert cache.get('a') == 1
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['size'] == 2
+
+def test_lru_entries_expire():
+    """Test that entries older than the TTL are treated as misses."""
+    cache = LRUCache(ttl=0.01)
+    cache.set('a', 1)
+    time.sleep(0.02)
+    assert cache.get('a') is MISSING
+    assert cache.stats()['expirations'] == 1
+
+def test_book_lookup_reads_through_cache():
+    """Test that repeated lookups are served from the cache."""
+    book_id = add_book()
+    get_book_by_id(book_id)
+    get_book_by_id(book_id)
+    get_book_by_isbn("1234567890123")
+    stats = get_book_cache_stats()
+    assert stats['hits'] >= 2
+    assert stats['size'] == 2
+
+def test_cached_book_is_a_copy():
+    """Test that callers cannot modify the cached entry."""
+    book_id = add_book()
+    book = get_book_by_id(book_id)
+    book['available_copies'] = 99
+    assert get_book_by_id(book_id)['available_copies'] == 2
+
+def test_missing_book_is_not_cached():
+    """Test that a miss is not cached, so a book added afterwards is found."""
+    assert get_book_by_isbn("1234567890123") is None
+    add_book()
+    assert get_book_by_isbn("1234567890123") is not None
+
+def test_availability_update_invalidates_book():
+    """Test that update_book_availability drops the cached copy count."""
+    book_id = add_book()
+    get_book_by_id(book_id)
+    update_book_availability(book_id, -1)
+    assert get_book_by_id(book_id)['available_copies'] == 1
+    assert get_book_by_isbn("1234567890123")['available_copies'] == 1
+
+def test_borrow_and_return_invalidate_book():
+    """Test that transactional borrow and return refresh the cached book."""
+    book_id = add_book()
+    get_book_by_id(book_id)
+    success, _ = borrow_book_by_patron("123456", book_id)
+    assert success
+    assert get_book_by_id(book_id)['available_copies'] == 1
+    success, _ = return_book_by_patron("123456", book_id)
+    assert success
+    assert get_book_by_id(book_id)['available_copies'] == 2
+
+def test_clear_database_empties_cache():
+    """Test that clearing the database also clears the cache."""
+    book_id = add_book()
+    get_book_by_id(book_id)
+    clear_database()
+    assert get_book_by_id(book_id) is None
+    assert get_book_cache_stats()['size'] == 0
+
+def test_redis_backend_round_trip():
+    """Test the Redis-compatible backend stores JSON values under its prefix."""
+    client = FakeRedis()
+    cache = RedisCache(client=client, ttl=30, prefix='test:')
+    cache.set('book:id:1', {'id': 1, 'title': 'T'})
+    assert 'test:book:id:1' in client.data
+    assert cache.get('book:id:1') == {'id': 1, 'title': 'T'}
+    cache.delete('book:id:1')
+    assert cache.get('book:id:1') is MISSING
+    cache.set('a', 1)
+    cache.clear()
+    assert client.data == {}
+    assert cache.stats()['hits'] == 1
+
+def test_redis_backend_used_for_book_lookups(monkeypatch):
+    """Test that the book lookups work unchanged on a shared backend."""
+    monkeypatch.setattr(database, 'book_cache', RedisCache(client=FakeRedis()))
+    book_id = add_book()
+    assert get_book_by_id(book_id)['id'] == book_id
+    update_book_availability(book_id, -1)
+    assert get_book_by_id(book_id)['available_copies'] == 1
+
+def test_create_cache_defaults_to_lru():
+    """Test that no URL gives an in-process cache."""
+    assert isinstance(create_cache(), LRUCache)
@@ -1,11 +1,14 @@
 import pytest
+import sqlite3
+import threading
 from datetime import datetime, timedelta
 from services.library_service import (
     borrow_book_by_patron
 )
 from database import (
     insert_book,
-    get_book_by_isbn
+    get_book_by_isbn,
+    get_patron_borrow_count
 )
 
 def test_borrow_book_valid_input():
@@ -78,20 +81,43 @@ def test_borrow_book_max_borrowed_box():
     assert "You have reached the maximum borrowing limit of 5 books." in message
 
 
-def test_borrow_book_db_error(monkeypatch):
-    """Test borrowing a book with a database error"""
+def test_borrow_book_db_error_rolls_back(monkeypatch):
+    """Test that a database error while recording the loan leaves the book's copies untouched"""
     insert_book("Test Book", "Test Author", "1234567890997", 1, 1)
     book = get_book_by_isbn("1234567890997")
-    monkeypatch.setattr("services.library_service.update_book_availability", lambda book_id, change: False)
+    def fail(*args):
+        raise sqlite3.OperationalError("disk I/O error")
+    monkeypatch.setattr("services.library_service.create_borrow_record", fail)
     success, message = borrow_book_by_patron("123456", book['id'])
     assert success is False
-    assert "Database error occurred while updating book availability." in message
+    assert "Database error occurred while creating borrow record." in message
+    assert get_book_by_isbn("1234567890997")['available_copies'] == 1
+    assert get_patron_borrow_count("123456") == 0
 
-def test_borrow_book_db_error_on_borrow_record(monkeypatch):
-    """Test borrowing a book with another database error"""
+def test_borrow_book_db_error_on_lock(monkeypatch):
+    """Test borrowing a book when the transaction can't be started"""
     insert_book("Test Book", "Test Author", "1234567890996", 1, 1)
     book = get_book_by_isbn("1234567890996")
-    monkeypatch.setattr("services.library_service.insert_borrow_record", lambda patron_id, book_id, borrow_date, due_date: False)
+    def locked():
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr("services.library_service.transaction", locked)
     success, message = borrow_book_by_patron("123456", book['id'])
     assert success is False
-    assert "Database error occurred while creating borrow record." in message
\ No newline at end of file
+    assert "Database error occurred while creating borrow record." in message
+
+def test_borrow_last_copy_concurrently():
+    """Test that only one of several simultaneous borrows gets the last copy"""
+    insert_book("Test Book", "Test Author", "1234567890995", 1, 1)
+    book = get_book_by_isbn("1234567890995")
+    barrier = threading.Barrier(4)
+    results = []
+    def borrow(patron_id):
+        barrier.wait()
+        results.append(borrow_book_by_patron(patron_id, book['id'])[0])
+    threads = [threading.Thread(target=borrow, args=(f"12345{i}",)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results.count(True) == 1
+    assert get_book_by_isbn("1234567890995")['available_copies'] == 0
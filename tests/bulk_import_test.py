@@ -0,0 +1,76 @@
+import io
+import json
+from services.import_service import import_books
+from database import insert_book, get_book_by_isbn, get_all_books
+
+CSV_HEADER = "title,author,isbn,total_copies\n"
+
+def test_import_csv_rows():
+    """Test valid CSV rows are inserted with all copies available."""
+    lines = io.StringIO(CSV_HEADER + "Book A,Author A,1000000000001,2\nBook B,Author B,1000000000002,1\n")
+    report = import_books(lines, 'csv')
+    assert report['inserted'] == 2
+    assert report['rejected'] == 0
+    assert get_book_by_isbn("1000000000001")['available_copies'] == 2
+
+def test_import_rejects_invalid_rows():
+    """Test rows failing the catalog rules are rejected with their line number."""
+    lines = io.StringIO(CSV_HEADER + ",Author,1000000000003,1\nBook,Author,123,1\nBook,Author,1000000000004,zero\n")
+    report = import_books(lines, 'csv')
+    assert report['inserted'] == 0
+    assert [r['line'] for r in report['rejects']] == [2, 3, 4]
+    assert report['rejects'][0]['error'] == "Title is required."
+    assert report['rejects'][1]['error'] == "ISBN must be exactly 13 digits."
+    assert report['rejects'][2]['error'] == "Total copies must be a positive integer."
+
+def test_import_deduplicates_isbns():
+    """Test duplicate ISBNs within the file and against the catalog are rejected."""
+    insert_book("Existing", "Author", "1000000000005", 1, 1)
+    lines = [
+        json.dumps({'title': 'New', 'author': 'A', 'isbn': '1000000000006', 'total_copies': 1}),
+        json.dumps({'title': 'Again', 'author': 'A', 'isbn': '1000000000006', 'total_copies': 1}),
+        json.dumps({'title': 'Clash', 'author': 'A', 'isbn': '1000000000005', 'total_copies': 1}),
+    ]
+    report = import_books(lines, 'jsonl', chunk_size=1)
+    assert report['inserted'] == 1
+    errors = {r['line']: r['error'] for r in report['rejects']}
+    assert errors == {2: "Duplicate ISBN in import file.", 3: "A book with this ISBN already exists."}
+    assert get_book_by_isbn("1000000000005")['title'] == "Existing"
+
+def test_import_reports_throughput():
+    """Test a large import is chunked and reports its rate."""
+    rows = "".join(f"Book {i},Author,{2000000000000 + i},1\n" for i in range(250))
+    report = import_books(io.StringIO(CSV_HEADER + rows), 'csv', chunk_size=100)
+    assert report['rows'] == 250
+    assert report['inserted'] == 250
+    assert report['rows_per_sec'] > 0
+    assert len(get_all_books()) == 250
+
+def test_import_invalid_json_line():
+    """Test a malformed JSON line is rejected without stopping the import."""
+    lines = ['{not json', json.dumps({'title': 'Ok', 'author': 'A', 'isbn': '1000000000007', 'total_copies': 3})]
+    report = import_books(lines, 'jsonl')
+    assert report['inserted'] == 1
+    assert report['rejects'][0]['error'] == "Invalid JSON."
+
+def test_bulk_api_upload(client):
+    """Test the bulk endpoint imports an uploaded CSV file."""
+    data = {'file': (io.BytesIO((CSV_HEADER + "Book A,Author A,1000000000008,1\n").encode()), 'books.csv')}
+    response = client.post('/api/books/bulk', data=data, content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.get_json()['inserted'] == 1
+
+def test_bulk_api_raw_jsonl(client):
+    """Test the bulk endpoint imports a raw JSON Lines body."""
+    body = json.dumps({'title': 'Raw', 'author': 'A', 'isbn': '1000000000009', 'total_copies': 1}) + "\n"
+    response = client.post('/api/books/bulk', data=body, content_type='application/x-ndjson')
+    assert response.get_json()['inserted'] == 1
+
+def test_import_books_cli(app, tmp_path):
+    """Test the import-books CLI command."""
+    path = tmp_path / "books.csv"
+    path.write_text(CSV_HEADER + "Book A,Author A,1000000000010,1\nBad,,1000000000011,1\n")
+    result = app.test_cli_runner().invoke(args=['import-books', str(path)])
+    assert result.exit_code == 0
+    assert "1 inserted, 1 rejected" in result.output
+    assert get_book_by_isbn("1000000000010") is not None
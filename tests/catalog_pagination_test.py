@@ -0,0 +1,68 @@
+import json
+import pytest
+from database import (
+    insert_book, get_books_page, iter_books, decode_cursor, encode_cursor
+)
+
+def add_books(count):
+    for i in range(count):
+        insert_book(f"Book {i % 3}", "Page Author", f"{9000000000000 + i}", 1, 1)
+
+def test_pages_cover_catalog_once():
+    """Test walking every page returns each book exactly once in title order."""
+    add_books(7)
+    seen = []
+    books, cursor = get_books_page(3)
+    seen += books
+    while cursor:
+        books, cursor = get_books_page(3, cursor)
+        seen += books
+    assert len(seen) == 7
+    assert len({b['id'] for b in seen}) == 7
+    assert [(b['title'], b['id']) for b in seen] == sorted((b['title'], b['id']) for b in seen)
+
+def test_last_page_has_no_cursor():
+    """Test a page that reaches the end of the catalog returns no cursor."""
+    add_books(2)
+    books, cursor = get_books_page(2)
+    assert len(books) == 2
+    assert cursor is None
+
+def test_invalid_cursor():
+    """Test a tampered cursor is rejected."""
+    with pytest.raises(ValueError):
+        get_books_page(10, "not-a-cursor")
+    assert decode_cursor(encode_cursor("Title", 5)) == ("Title", 5)
+
+def test_iter_books_streams_all_books():
+    """Test iter_books yields every book across several batches."""
+    add_books(5)
+    assert len(list(iter_books(batch_size=2))) == 5
+
+def test_api_books_pagination(client):
+    """Test the JSON listing pages through the catalog with next_cursor."""
+    add_books(3)
+    first = client.get('/api/books?limit=2').get_json()
+    assert first['count'] == 2
+    second = client.get(f"/api/books?limit=2&cursor={first['next_cursor']}").get_json()
+    assert second['count'] == 1
+    assert second['next_cursor'] is None
+
+def test_api_books_stream(client):
+    """Test the streaming listing returns the whole catalog as a JSON array."""
+    add_books(4)
+    response = client.get('/api/books?stream=1')
+    assert response.is_streamed
+    assert len(json.loads(response.get_data(as_text=True))) == 4
+
+def test_api_books_bad_cursor(client):
+    """Test the JSON listing reports an invalid cursor."""
+    assert client.get('/api/books?cursor=bogus').status_code == 400
+    assert client.get('/api/books?cursor=bogus&stream=1').status_code == 400
+
+def test_catalog_page_links(client):
+    """Test the catalog page links to the next page when there are more books."""
+    add_books(3)
+    html = client.get('/catalog?limit=2').get_data(as_text=True)
+    assert 'Next Page' in html
+    assert html.count('Page Author') == 2
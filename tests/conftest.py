@@ -1,12 +1,46 @@
 import sys
 import os
 import pytest
+from unittest.mock import Mock
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from database import init_database, clear_database
+from app import create_app
+from database import init_database, clear_database, DATABASE
+from routes import http_cache
+from services.payment_service import PaymentGateway
 
 @pytest.fixture(autouse=True)
 def run_before_each_test():
     init_database()
-    clear_database() # Clears DB before running tests so that tests work without having to switch all the book IDs every time
\ No newline at end of file
+    clear_database() # Clears DB before running tests so that tests work without having to switch all the book IDs every time
+
+@pytest.fixture
+def make_app():
+    """Create the app on the test database, without its sample data or background threads."""
+    def make(**config):
+        app = create_app({'DATABASE': DATABASE, 'BACKGROUND_TASKS': False, **config})
+        clear_database()  # create_app adds sample data
+        http_cache.response_cache.clear()
+        return app
+    return make
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def make_gateway():
+    """Build mock payment gateways; charges succeed unless success=False and lookups answer status."""
+    def make(success=True, txn="txn_123456_1", status="completed"):
+        gateway = Mock(spec=PaymentGateway)
+        gateway.process_payment.return_value = (success, txn if success else "", "Processed" if success else "Declined")
+        gateway.refund_payment.return_value = (True, "Refunded")
+        gateway.verify_payment_status.return_value = {"status": status}
+        gateway.find_payment.return_value = {"status": status}
+        return gateway
+    return make
@@ -0,0 +1,70 @@
+import sqlite3
+import threading
+import pytest
+from database import (
+    ConnectionPool, get_db_connection, get_pool, get_pool_stats,
+    insert_book, get_book_by_isbn
+)
+
+def test_connections_are_reused():
+    """Test that closing a pooled connection hands it back for reuse."""
+    conn = get_db_connection()
+    conn.close()
+    again = get_db_connection()
+    again.close()
+    assert again is conn
+
+def test_pool_never_exceeds_max_size(tmp_path):
+    """Test that the pool opens no more than max_size connections."""
+    pool = ConnectionPool(str(tmp_path / "pool.db"), max_size=2, timeout=0.1)
+    first = pool.acquire()
+    second = pool.acquire()
+    with pytest.raises(sqlite3.OperationalError):
+        pool.acquire()
+    stats = pool.stats()
+    assert stats['size'] == 2
+    assert stats['in_use'] == 2
+    assert stats['timeouts'] == 1
+    first.close()
+    second.close()
+    pool.close_all()
+
+def test_waiting_thread_gets_released_connection(tmp_path):
+    """Test that a thread blocked on a full pool receives the next released connection."""
+    pool = ConnectionPool(str(tmp_path / "pool.db"), max_size=1, timeout=2)
+    held = pool.acquire()
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.acquire()))
+    waiter.start()
+    held.close()
+    waiter.join()
+    assert got == [held]
+    assert pool.stats()['wait_time_max'] > 0
+    pool.close_all()
+
+def test_release_rolls_back_uncommitted_work():
+    """Test that uncommitted changes are discarded when a connection goes back to the pool."""
+    conn = get_db_connection()
+    conn.execute("INSERT INTO books (title, author, isbn, total_copies, available_copies) "
+                 "VALUES ('Ghost', 'Nobody', '9999999999990', 1, 1)")
+    conn.close()
+    assert get_book_by_isbn("9999999999990") is None
+
+def test_pool_stats_report_metrics():
+    """Test that pool statistics include size and wait-time metrics."""
+    insert_book("Stats Book", "Stats Author", "1234567890555", 1, 1)
+    stats = get_pool_stats()
+    for key in ('size', 'idle', 'in_use', 'max_size', 'acquired', 'wait_time_avg', 'wait_time_max'):
+        assert key in stats
+    assert stats['acquired'] > 0
+
+def test_app_context_reuses_one_connection(app):
+    """Test that one connection is used for a whole app context and released afterwards."""
+    with app.app_context():
+        first = get_db_connection()
+        first.close()
+        second = get_db_connection()
+        assert second is first
+        assert second.pinned
+    assert not first.pinned
+    assert get_pool().stats()['in_use'] == 0
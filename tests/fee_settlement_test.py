@@ -0,0 +1,106 @@
+import pytest
+from datetime import date, datetime, timedelta
+from database import (
+    insert_book, insert_borrow_record, get_book_by_isbn, get_payment
+)
+from services.library_service import settle_patron_fees, get_patron_status_report
+
+TODAY = date(2024, 6, 30)
+
+def add_overdue_loans(patron_id="123456", days=(3, 10, 40)):
+    """Add one overdue loan per entry in days; fees are 1.50, 6.50 and 15.00 for the defaults."""
+    for i, days_overdue in enumerate(days):
+        isbn = f"{1234567890100 + i}"
+        insert_book(f"Overdue Book {i}", "Fee Author", isbn, 1, 1)
+        book_id = get_book_by_isbn(isbn)['id']
+        due = datetime.combine(TODAY, datetime.min.time()) - timedelta(days=days_overdue)
+        insert_borrow_record(patron_id, book_id, due - timedelta(days=14), due)
+
+def test_settlement_charges_total_once(make_gateway):
+    """Test every outstanding fee is charged in a single gateway call."""
+    add_overdue_loans()
+    gateway = make_gateway()
+    success, message, payment = settle_patron_fees("123456", gateway, today=TODAY)
+    assert success
+    assert payment['total'] == 23.00
+    assert payment['status'] == 'completed'
+    assert sorted(a['amount'] for a in payment['allocations']) == [1.50, 6.50, 15.00]
+    gateway.process_payment.assert_called_once()
+    assert gateway.process_payment.call_args.kwargs['amount'] == 23.00
+    assert gateway.process_payment.call_args.kwargs['idempotency_key'].startswith('settle-')
+
+def test_settlement_records_allocations(make_gateway):
+    """Test the payment and its per-book allocations are stored in the ledger."""
+    add_overdue_loans()
+    _, _, payment = settle_patron_fees("123456", make_gateway(), today=TODAY)
+    stored = get_payment(payment['payment_id'])
+    assert stored['status'] == 'completed'
+    assert stored['transaction_id'] == "txn_123456_1"
+    assert stored['amount'] == 23.00
+    assert len(stored['allocations']) == 3
+    assert round(sum(a['amount'] for a in stored['allocations']), 2) == 23.00
+
+def test_settled_fees_are_not_charged_again(make_gateway):
+    """Test a second settlement finds nothing left to pay."""
+    add_overdue_loans()
+    settle_patron_fees("123456", make_gateway(), today=TODAY)
+    gateway = make_gateway()
+    success, message, payment = settle_patron_fees("123456", gateway, today=TODAY)
+    assert not success
+    assert message == "No late fees to pay."
+    gateway.process_payment.assert_not_called()
+
+def test_fees_accrued_after_settlement_are_outstanding(make_gateway):
+    """Test only the fees accrued since the last payment are charged next time."""
+    add_overdue_loans(days=(3,))
+    settle_patron_fees("123456", make_gateway(), today=TODAY)
+    success, _, payment = settle_patron_fees("123456", make_gateway(), today=TODAY + timedelta(days=2))
+    assert success
+    assert payment['total'] == 1.00
+
+def test_declined_settlement_releases_fees(make_gateway):
+    """Test a declined charge is marked failed and the fees remain payable."""
+    add_overdue_loans()
+    success, message, payment = settle_patron_fees("123456", make_gateway(success=False), today=TODAY)
+    assert not success
+    assert "Payment failed" in message
+    assert get_payment(payment['payment_id'])['status'] == 'failed'
+    success, _, payment = settle_patron_fees("123456", make_gateway(), today=TODAY)
+    assert success
+    assert payment['total'] == 23.00
+
+def test_gateway_error_leaves_payment_uncertain(make_gateway):
+    """Test a charge that may or may not have happened keeps its allocation for reconciliation."""
+    add_overdue_loans()
+    gateway = make_gateway()
+    gateway.process_payment.side_effect = Exception("Network error")
+    success, message, payment = settle_patron_fees("123456", gateway, today=TODAY)
+    assert not success
+    assert "processing error" in message
+    assert get_payment(payment['payment_id'])['status'] == 'uncertain'
+    assert settle_patron_fees("123456", make_gateway(), today=TODAY)[1] == "No late fees to pay."
+
+def test_settlement_invalid_patron(make_gateway):
+    """Test patron IDs are validated before anything is computed."""
+    gateway = make_gateway()
+    assert settle_patron_fees("12", gateway) == (False, "Invalid patron ID. Must be exactly 6 digits.", None)
+    gateway.process_payment.assert_not_called()
+
+def test_status_report_excludes_paid_fees(make_gateway):
+    """Test the patron's late fee total drops to zero after settling."""
+    add_overdue_loans(days=(3,))
+    settle_patron_fees("123456", make_gateway())
+    assert get_patron_status_report("123456")['total_late_fees'] == 0.0
+
+def test_pay_endpoint(client, mocker, make_gateway):
+    """Test POST /api/patron/<id>/pay settles with one charge."""
+    add_overdue_loans(days=(3, 10))
+    gateway = make_gateway()
+    mocker.patch('services.library_service.get_default_gateway', return_value=gateway)
+    response = client.post('/api/patron/123456/pay')
+    data = response.get_json()
+    assert response.status_code == 200
+    assert data['status'] == 'completed'
+    assert len(data['allocations']) == 2
+    gateway.process_payment.assert_called_once()
+    assert client.post('/api/patron/123456/pay').status_code == 400
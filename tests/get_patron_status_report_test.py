@@ -95,4 +95,46 @@ def test_patron_status_patron_too_long():
     assert result['currently_borrowed'] == []
     assert result['total_late_fees'] == 0.0
     assert result['num_currently_borrowed'] == 0
-    assert result['history'] == []
\ No newline at end of file
+    assert result['history'] == []
+
+def test_patron_status_tiered_late_fees():
+    """Test the late fee total uses the tiered R5 schedule, not a flat rate."""
+    insert_book("Test Book", "Test Author", "1234567890131", 1, 1)
+    book = get_book_by_isbn("1234567890131")
+    due_date = datetime.today() - timedelta(days=10)
+    insert_borrow_record("123460", book['id'], due_date - timedelta(days=14), due_date)
+    result = get_patron_status_report("123460")
+    assert result['total_late_fees'] == 6.5
+
+def test_patron_status_history_is_paged():
+    """Test the history is capped and can be walked with the cursor."""
+    for i in range(5):
+        isbn = f"12345678902{i:02d}"
+        insert_book("Test Book", "Test Author", isbn, 1, 1)
+        book = get_book_by_isbn(isbn)
+        borrow_date = datetime.today() - timedelta(days=20 - i)
+        insert_borrow_record("123461", book['id'], borrow_date, borrow_date + timedelta(days=14))
+    first = get_patron_status_report("123461", history_limit=3)
+    assert len(first['history']) == 3
+    assert first['num_currently_borrowed'] == 5
+    second = get_patron_status_report("123461", history_limit=3, history_cursor=first['history_next_cursor'])
+    assert len(second['history']) == 2
+    assert second['history_next_cursor'] is None
+    dates = [h['borrow_date'] for h in first['history'] + second['history']]
+    assert dates == sorted(dates, reverse=True)
+
+def test_patron_status_invalid_cursor():
+    """Test a malformed history cursor is rejected."""
+    with pytest.raises(ValueError):
+        get_patron_status_report("123456", history_cursor="bogus")
+
+def test_patron_status_api(client):
+    """Test the JSON patron status endpoint."""
+    insert_book("Api Book", "Test Author", "1234567890140", 1, 1)
+    borrow_book_by_patron("123462", get_book_by_isbn("1234567890140")['id'])
+    body = client.get('/api/patron/123462/status').get_json()
+    assert body['patron_id'] == "123462"
+    assert body['num_currently_borrowed'] == 1
+    assert body['currently_borrowed'][0]['title'] == "Api Book"
+    assert client.get('/api/patron/12/status').status_code == 400
+    assert client.get('/api/patron/123462/status?cursor=bogus').status_code == 400
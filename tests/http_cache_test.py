@@ -0,0 +1,124 @@
+import math
+import sqlite3
+import time
+import pytest
+from database import (
+    insert_book, get_book_by_isbn, update_book_availability, clear_database,
+    get_catalog_version, CATALOG_VERSION_BUMP, DATABASE
+)
+from routes import http_cache
+from services.library_service import borrow_book_by_patron
+
+@pytest.fixture
+def client(client):
+    insert_book("Cached Gatsby", "F. Scott Fitzgerald", "1234567890123", 2, 2)
+    return client
+
+def test_catalog_sends_validators(client):
+    """Test catalog pages carry an ETag and Last-Modified."""
+    response = client.get('/catalog')
+    assert response.status_code == 200
+    assert response.headers['ETag']
+    assert response.headers['Last-Modified']
+    assert 'no-cache' in response.headers['Cache-Control']
+
+def test_matching_etag_gets_not_modified(client):
+    """Test a revalidation with the current ETag gets an empty 304."""
+    etag = client.get('/catalog').headers['ETag']
+    response = client.get('/catalog', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+
+def test_write_changes_etag(client):
+    """Test every kind of catalog write bumps the version and the ETag."""
+    etag = client.get('/catalog').headers['ETag']
+    book_id = get_book_by_isbn("1234567890123")['id']
+
+    version = get_catalog_version()[0]
+    update_book_availability(book_id, -1)
+    assert get_catalog_version()[0] > version
+
+    response = client.get('/catalog', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+    version = get_catalog_version()[0]
+    borrow_book_by_patron("123456", book_id)
+    assert get_catalog_version()[0] > version
+
+    version = get_catalog_version()[0]
+    clear_database()
+    assert get_catalog_version()[0] > version
+
+def test_repeat_hit_served_from_cache(client, mocker):
+    """Test a repeated query is served without calling the search service again."""
+    first = client.get('/api/search?q=gatsby&type=title')
+    search = mocker.patch('routes.api_routes.search_books_in_catalog')
+    second = client.get('/api/search?q=gatsby&type=title')
+    search.assert_not_called()
+    assert second.get_json() == first.get_json()
+    assert http_cache.get_response_cache_stats()['hits'] == 1
+
+def test_cached_response_reflects_writes(client):
+    """Test a write makes the next request re-render with fresh data."""
+    first = client.get('/api/search?q=gatsby&type=title').get_json()
+    assert first['results'][0]['available_copies'] == 2
+    update_book_availability(first['results'][0]['id'], -1)
+    second = client.get('/api/search?q=gatsby&type=title').get_json()
+    assert second['results'][0]['available_copies'] == 1
+
+def test_query_string_is_part_of_key(client):
+    """Test different queries are cached separately."""
+    insert_book("Cached Mockingbird", "Harper Lee", "1234567890124", 1, 1)
+    gatsby = client.get('/search?q=gatsby&type=title')
+    mockingbird = client.get('/search?q=mockingbird&type=title')
+    assert b'Cached Gatsby' in gatsby.data
+    assert b'Cached Gatsby' not in mockingbird.data
+    assert b'Cached Mockingbird' in mockingbird.data
+
+def test_query_values_are_escaped_in_key(client):
+    """Test a value containing '&' and '=' doesn't share a cache entry with the parameters it spells out."""
+    insert_book("Query Book", "Smith", "1234567890125", 1, 1)
+    by_author = client.get('/api/search?q=smith&type=author').get_json()
+    assert [book['title'] for book in by_author['results']] == ["Query Book"]
+    smuggled = client.get('/api/search?q=smith%26type%3Dauthor').get_json()
+    assert smuggled != by_author
+
+def test_if_modified_since_sees_write_in_same_second(client):
+    """Test a write later in the second the page was fetched in isn't hidden by a 304."""
+    last_modified = client.get('/catalog').headers['Last-Modified']
+    _, modified = get_catalog_version()
+    other = sqlite3.connect(DATABASE)
+    with other:
+        other.execute(CATALOG_VERSION_BUMP, (math.floor(modified) + 0.999,))
+    other.close()
+    assert client.get('/catalog', headers={'If-Modified-Since': last_modified}).status_code == 200
+
+def test_errors_are_not_cached(client):
+    """Test error responses get no validators and are not stored."""
+    response = client.get('/api/search?q=')
+    assert response.status_code == 400
+    assert 'ETag' not in response.headers
+    assert http_cache.get_response_cache_stats()['size'] == 0
+
+def test_pending_flash_bypasses_cache(client):
+    """Test a page with a pending flash message is rendered, not replayed."""
+    etag = client.get('/catalog').headers['ETag']
+    with client.session_transaction() as session:
+        session['_flashes'] = [('success', 'Flash for this visit')]
+    response = client.get('/catalog', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'Flash for this visit' in response.data
+
+def test_write_from_another_process_is_seen(client):
+    """Test a write committed by another process (a worker or `flask import-books`) invalidates cached pages."""
+    etag = client.get('/catalog').headers['ETag']
+    assert client.get('/api/search?q=gatsby&type=title').get_json()['results'][0]['available_copies'] == 2
+    other = sqlite3.connect(DATABASE)
+    with other:
+        other.execute("UPDATE books SET available_copies = 0 WHERE isbn = '1234567890123'")
+        other.execute(CATALOG_VERSION_BUMP, (time.time(),))
+    other.close()
+    assert client.get('/api/search?q=gatsby&type=title').get_json()['results'][0]['available_copies'] == 0
+    assert client.get('/catalog', headers={'If-None-Match': etag}).status_code == 200
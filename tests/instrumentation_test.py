@@ -0,0 +1,100 @@
+import pytest
+from datetime import datetime, timedelta
+from database import insert_book, insert_borrow_record, get_book_by_isbn
+import instrumentation
+from instrumentation import Histogram, normalize_sql
+
+@pytest.fixture
+def make_client(make_app):
+    def make(**config):
+        app = make_app(**config)
+        instrumentation.reset_metrics()
+        insert_book("Timed Book", "Timed Author", "1234567890123", 2, 2)
+        return app.test_client()
+    return make
+
+@pytest.fixture
+def client(make_client):
+    return make_client()
+
+def test_server_timing_header(client):
+    """Test every response breaks its time down into app, db, connection and render."""
+    response = client.get('/catalog')
+    timing = response.headers['Server-Timing']
+    for part in ('app;dur=', 'db;dur=', 'conn;dur=', 'render;dur='):
+        assert part in timing
+    assert 'queries"' in timing
+
+def test_metrics_exposes_request_histogram(client):
+    """Test /metrics has a per-route request histogram in Prometheus format."""
+    client.get('/catalog')
+    client.get('/api/late_fee/123456/1')
+    body = client.get('/metrics').get_data(as_text=True)
+    assert '# TYPE library_request_duration_seconds histogram' in body
+    assert 'library_request_duration_seconds_count{method="GET",route="/catalog",status="200"} 1' in body
+    assert 'route="/api/late_fee/<patron_id>/<int:book_id>"' in body
+    assert 'le="+Inf"' in body
+
+def test_metrics_time_sql_services_and_templates(client):
+    """Test statements, service functions and template renders each get a histogram."""
+    book_id = get_book_by_isbn("1234567890123")['id']
+    client.post('/borrow', data={'patron_id': '123456', 'book_id': book_id})
+    client.post('/return', data={'patron_id': '123456', 'book_id': book_id})
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'library_service_duration_seconds_count{function="borrow_book_by_patron"} 1' in body
+    assert 'library_service_duration_seconds_count{function="return_book_by_patron"} 1' in body
+    assert 'library_sql_statement_duration_seconds_count{statement="BEGIN IMMEDIATE"}' in body
+    assert 'library_template_render_seconds_count{template="return_book.html"} 1' in body
+    assert 'library_db_pool_connections{state="idle"}' in body
+    assert 'library_book_cache_requests_total{result="hit"}' in body
+
+def test_request_counts_its_statements(client):
+    """Test the statements recorded for a request are the ones it ran."""
+    book_id = get_book_by_isbn("1234567890123")['id']
+    due = datetime.now() - timedelta(days=3)
+    insert_borrow_record("123456", book_id, due - timedelta(days=14), due)
+    response = client.get(f'/api/late_fee/123456/{book_id}')
+    assert response.get_json()['days_overdue'] == 3
+    assert 'desc="1 queries"' in response.headers['Server-Timing']
+
+def test_profiling_is_off_by_default(client):
+    """Test the profile flag is ignored unless PROFILING is configured."""
+    response = client.get('/catalog?_profile=1')
+    assert response.mimetype == 'text/html'
+
+def test_profile_report_on_request(make_client):
+    """Test X-Profile returns a cProfile report with the request's SQL statements."""
+    client = make_client(PROFILING=True)
+    response = client.get('/catalog', headers={'X-Profile': '1'})
+    body = response.get_data(as_text=True)
+    assert response.mimetype == 'text/plain'
+    assert body.startswith('GET /catalog -> 200')
+    assert 'SQL statements:' in body
+    assert 'SELECT' in body
+    assert 'Profile (cprofile):' in body
+    assert 'cumulative' in body
+
+def test_instrumentation_can_be_disabled(make_client):
+    """Test INSTRUMENTATION=False adds no header and no /metrics route."""
+    client = make_client(INSTRUMENTATION=False)
+    try:
+        assert 'Server-Timing' not in client.get('/catalog').headers
+        assert client.get('/metrics').status_code == 404
+    finally:
+        make_client()
+
+def test_normalize_sql():
+    """Test statements differing only in whitespace or IN-list length share a series."""
+    assert normalize_sql('SELECT *\n   FROM books WHERE id IN (?, ?, ?)') == 'SELECT * FROM books WHERE id IN (?, ...)'
+    assert normalize_sql('SELECT * FROM books WHERE id IN (?,?)') == 'SELECT * FROM books WHERE id IN (?, ...)'
+
+def test_histogram_buckets_are_cumulative():
+    """Test observations count towards every bucket at or above them."""
+    histogram = Histogram('test_seconds', 'Test.', ('route',), buckets=(0.1, 1.0))
+    histogram.observe(0.05, '/a')
+    histogram.observe(0.5, '/a')
+    lines = histogram.render()
+    assert 'test_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{route="/a",le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{route="/a",le="+Inf"} 2' in lines
+    assert 'test_seconds_count{route="/a"} 2' in lines
@@ -0,0 +1,71 @@
+from datetime import date, datetime, timedelta
+from unittest.mock import ANY
+from services.fee_policy import LateFeePolicy, DEFAULT_FEE_POLICY
+from services.library_service import calculate_late_fee_for_book, pay_late_fees
+from database import insert_book, get_book_by_isbn, insert_borrow_record, get_active_loan
+
+def test_policy_first_tier():
+    """Test the first 7 days are charged at $0.50/day."""
+    assert DEFAULT_FEE_POLICY.fee_for_days(1) == 0.5
+    assert DEFAULT_FEE_POLICY.fee_for_days(7) == 3.5
+
+def test_policy_second_tier():
+    """Test days after the first week are charged at $1.00/day."""
+    assert DEFAULT_FEE_POLICY.fee_for_days(8) == 4.5
+    assert DEFAULT_FEE_POLICY.fee_for_days(10) == 6.5
+
+def test_policy_cap():
+    """Test the fee never exceeds $15.00 per book."""
+    assert DEFAULT_FEE_POLICY.fee_for_days(19) == 15.0
+    assert DEFAULT_FEE_POLICY.fee_for_days(365) == 15.0
+
+def test_policy_not_overdue():
+    """Test a book due today or later costs nothing."""
+    today = date(2024, 3, 10)
+    assert DEFAULT_FEE_POLICY.assess(date(2024, 3, 10), today) == {'fee_amount': 0.0, 'days_overdue': 0}
+    assert DEFAULT_FEE_POLICY.assess(date(2024, 3, 20), today) == {'fee_amount': 0.0, 'days_overdue': 0}
+
+def test_policy_counts_calendar_days():
+    """Test overdue days are counted by date, not elapsed hours."""
+    due = datetime(2024, 3, 1, 23, 59)
+    assert DEFAULT_FEE_POLICY.days_overdue(due, datetime(2024, 3, 2, 0, 1)) == 1
+
+def test_custom_policy():
+    """Test a custom schedule can be passed to the calculation."""
+    policy = LateFeePolicy(first_tier_rate=1.0, first_tier_days=2, later_rate=2.0, max_fee=5.0)
+    assert policy.fee_for_days(3) == 4.0
+    assert policy.fee_for_days(10) == 5.0
+
+def test_calculate_uses_prefetched_loan(monkeypatch):
+    """Test a loan passed in by the caller is not fetched again."""
+    def no_query(*args):
+        raise AssertionError("loan should not be re-fetched")
+    monkeypatch.setattr("services.library_service.get_active_loan", no_query)
+    loan = {'due_date': datetime.now() - timedelta(days=3)}
+    assert calculate_late_fee_for_book("123456", 1, loan=loan) == {'fee_amount': 1.5, 'days_overdue': 3}
+
+def test_get_active_loan_includes_book():
+    """Test the active loan lookup returns the book title with the record."""
+    insert_book("Loan Book", "Loan Author", "1234567890444", 1, 1)
+    book = get_book_by_isbn("1234567890444")
+    due_date = datetime.today() - timedelta(days=2)
+    insert_borrow_record("123456", book['id'], due_date - timedelta(days=14), due_date)
+    loan = get_active_loan("123456", book['id'])
+    assert loan['title'] == "Loan Book"
+    assert loan['due_date'].date() == due_date.date()
+    assert get_active_loan("654321", book['id']) is None
+
+def test_pay_late_fees_fetches_book_once(mocker):
+    """Test paying fees reuses the loan record instead of looking the book up again."""
+    insert_book("Paid Book", "Loan Author", "1234567890445", 1, 1)
+    book = get_book_by_isbn("1234567890445")
+    due_date = datetime.today() - timedelta(days=4)
+    insert_borrow_record("123456", book['id'], due_date - timedelta(days=14), due_date)
+    lookup = mocker.patch('services.library_service.get_book_by_id')
+    gateway = mocker.Mock()
+    gateway.process_payment.return_value = (True, "txn_1", "ok")
+    success, message, txn = pay_late_fees("123456", book['id'], payment_gateway=gateway)
+    assert success is True
+    lookup.assert_not_called()
+    gateway.process_payment.assert_called_once_with(patron_id="123456", amount=2.0, description="Late fees for 'Paid Book'",
+                                                    idempotency_key=ANY)
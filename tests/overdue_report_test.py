@@ -0,0 +1,65 @@
+from datetime import date, datetime, timedelta
+from services.fee_policy import DEFAULT_FEE_POLICY, LateFeePolicy
+from services.library_service import get_overdue_fee_report, borrow_book_by_patron
+from database import insert_book, get_book_by_isbn, insert_borrow_record
+
+AS_OF = date(2024, 6, 30)
+
+def add_loan(patron_id, isbn, days_overdue):
+    book = get_book_by_isbn(isbn)
+    if not book:
+        insert_book(f"Book {isbn}", "Report Author", isbn, 10, 10)
+        book = get_book_by_isbn(isbn)
+    due_date = datetime.combine(AS_OF, datetime.min.time()) - timedelta(days=days_overdue) + timedelta(hours=15)
+    insert_borrow_record(patron_id, book['id'], due_date - timedelta(days=14), due_date)
+    return book['id']
+
+def test_report_matches_policy_for_every_tier():
+    """Test the SQL fee computation agrees with the Python policy at tier boundaries."""
+    days = [0, 1, 6, 7, 8, 12, 19, 20, 400]
+    for i, d in enumerate(days):
+        add_loan(f"1000{i:02d}", "4000000000001", d)
+    report = get_overdue_fee_report(AS_OF)
+    fees = {p['patron_id']: p['fee_total'] for p in report['patrons']}
+    for i, d in enumerate(days):
+        expected = DEFAULT_FEE_POLICY.fee_for_days(d)
+        assert fees.get(f"1000{i:02d}", 0.0) == expected
+
+def test_report_totals_per_patron_and_book():
+    """Test fees are summed per patron and per book."""
+    book_a = add_loan("123456", "4000000000002", 3)
+    add_loan("123456", "4000000000003", 10)
+    add_loan("654321", "4000000000002", 30)
+    report = get_overdue_fee_report(AS_OF)
+    patrons = {p['patron_id']: p for p in report['patrons']}
+    assert patrons["123456"]['fee_total'] == 1.5 + 6.5
+    assert patrons["123456"]['overdue_loans'] == 2
+    assert patrons["654321"]['fee_total'] == 15.0
+    books = {b['book_id']: b for b in report['books']}
+    assert books[book_a]['fee_total'] == 16.5
+    assert report['total_fees'] == 23.0
+    assert report['overdue_loans'] == 3
+    assert report['patrons'][0]['patron_id'] == "654321"
+
+def test_report_ignores_returned_and_current_loans():
+    """Test returned books and books not yet due are left out."""
+    insert_book("Current", "Report Author", "4000000000004", 1, 1)
+    borrow_book_by_patron("123456", get_book_by_isbn("4000000000004")['id'])
+    report = get_overdue_fee_report()
+    assert report['patrons'] == []
+    assert report['total_fees'] == 0
+
+def test_report_custom_policy():
+    """Test the report applies the policy it is given."""
+    add_loan("123456", "4000000000005", 4)
+    policy = LateFeePolicy(first_tier_rate=2.0, first_tier_days=2, later_rate=3.0, max_fee=100.0)
+    report = get_overdue_fee_report(AS_OF, policy)
+    assert report['total_fees'] == policy.fee_for_days(4) == 10.0
+
+def test_overdue_report_endpoint(client):
+    """Test the overdue report API."""
+    add_loan("123456", "4000000000006", 5)
+    body = client.get('/api/reports/overdue?as_of=2024-06-30').get_json()
+    assert body['as_of'] == "2024-06-30"
+    assert body['total_fees'] == 2.5
+    assert client.get('/api/reports/overdue?as_of=yesterday').status_code == 400
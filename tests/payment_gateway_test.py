@@ -0,0 +1,208 @@
+import json
+import threading
+import time
+import pytest
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from services.payment_service import (
+    PaymentGateway, CircuitBreaker, PaymentGatewayError, CircuitOpenError,
+    configure_payment_gateway, get_default_gateway
+)
+from services.library_service import pay_late_fees, charge_late_fees
+
+class StubGateway(ThreadingHTTPServer):
+    """Local HTTP stand-in for the payment gateway with configurable latency and 5xx bursts."""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.latency = 0.0
+        self.fail_next = 0  # Number of upcoming requests answered with 503
+        self.requests = []  # (method, path, idempotency key)
+        self.connections = set()
+        self.charges = {}  # idempotency key -> transaction ID
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def handle_error(self, request, client_address):
+        pass  # A client that timed out has hung up before the reply
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else {}
+        key = self.headers.get('Idempotency-Key')
+        with server.lock:
+            server.requests.append((self.command, self.path, key))
+            server.connections.add(self.client_address)
+            fail = server.fail_next > 0
+            if fail:
+                server.fail_next -= 1
+        if server.latency:
+            time.sleep(server.latency)
+        if fail:
+            return self._send(503, {'error': 'Service unavailable'})
+        if self.path == '/charges':
+            if body['amount'] > 1000:
+                return self._send(402, {'message': 'Payment declined: amount exceeds limit'})
+            with server.lock:
+                txn = server.charges.setdefault(key, f"txn_{body['customer_id']}_{len(server.charges) + 1}")
+            return self._send(200, {'id': txn, 'message': 'Charged'})
+        if self.path == '/refunds':
+            return self._send(200, {'id': f"refund_{body['transaction_id']}"})
+        if self.path.startswith('/charges?idempotency_key='):
+            txn = server.charges.get(self.path.split('=', 1)[1])
+            if txn is None:
+                return self._send(404, {'message': 'Transaction not found'})
+            return self._send(200, {'transaction_id': txn, 'status': 'completed'})
+        if self.path.startswith('/charges/'):
+            txn = self.path.rsplit('/', 1)[1]
+            if txn not in server.charges.values():
+                return self._send(404, {'message': 'Transaction not found'})
+            return self._send(200, {'transaction_id': txn, 'status': 'completed'})
+        self._send(404, {'message': 'Not found'})
+
+    do_GET = _handle
+    do_POST = _handle
+
+@pytest.fixture
+def stub():
+    server = StubGateway()
+    thread = threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def gateway(stub):
+    return PaymentGateway(base_url=stub.url, session=requests.Session(), timeout=1,
+                          backoff=0.01, max_backoff=0.02)
+
+def test_charge_over_http(gateway, stub):
+    """Test a charge is posted to the gateway with an idempotency key."""
+    success, txn, message = gateway.process_payment("123456", 4.50, "Late fees")
+    assert success
+    assert txn == "txn_123456_1"
+    method, path, key = stub.requests[0]
+    assert (method, path) == ('POST', '/charges')
+    assert key
+
+def test_connections_are_kept_alive(gateway, stub):
+    """Test repeated calls reuse one pooled connection instead of reconnecting."""
+    for _ in range(5):
+        gateway.process_payment("123456", 1.00)
+    assert len(stub.connections) == 1
+
+def test_5xx_burst_is_retried_with_same_key(gateway, stub):
+    """Test transient 503s are retried and every attempt carries the same idempotency key."""
+    stub.fail_next = 2
+    success, txn, _ = gateway.process_payment("123456", 4.50, idempotency_key="charge-abc")
+    assert success
+    assert [r[2] for r in stub.requests] == ["charge-abc"] * 3
+    assert len(stub.charges) == 1
+
+def test_retry_does_not_charge_twice(gateway, stub):
+    """Test replaying a charge with the same key returns the original transaction."""
+    first = gateway.process_payment("123456", 4.50, idempotency_key="charge-abc")
+    second = gateway.process_payment("123456", 4.50, idempotency_key="charge-abc")
+    assert first[1] == second[1]
+
+def test_decline_is_not_retried(gateway, stub):
+    """Test a 4xx decline is returned at once without retrying."""
+    success, txn, message = gateway.process_payment("123456", 2000.00)
+    assert not success
+    assert "declined" in message
+    assert len(stub.requests) == 1
+
+def test_timeouts_exhaust_retries(stub):
+    """Test a gateway slower than the timeout fails after max_retries + 1 attempts."""
+    stub.latency = 0.3
+    gateway = PaymentGateway(base_url=stub.url, session=requests.Session(), timeout=0.05,
+                             max_retries=2, backoff=0.01)
+    with pytest.raises(PaymentGatewayError):
+        gateway.process_payment("123456", 1.00)
+    assert len(stub.requests) == 3
+
+def test_circuit_opens_and_fails_fast(stub):
+    """Test repeated failures open the circuit and later calls don't reach the gateway."""
+    stub.fail_next = 100
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    gateway = PaymentGateway(base_url=stub.url, session=requests.Session(), max_retries=5,
+                             backoff=0.001, breaker=breaker)
+    with pytest.raises(PaymentGatewayError) as error:
+        gateway.process_payment("123456", 1.00)
+    assert not isinstance(error.value, CircuitOpenError)  # Attempts were sent, so it may have been charged
+    assert len(stub.requests) == 3
+    with pytest.raises(CircuitOpenError):
+        gateway.refund_payment("txn_123456_1", 1.00)
+    assert len(stub.requests) == 3
+
+def test_circuit_opening_after_a_sent_attempt_is_uncertain(stub):
+    """Test a charge whose timed-out attempt tripped the breaker is left uncertain, not failed."""
+    stub.latency = 0.3
+    gateway = PaymentGateway(base_url=stub.url, session=requests.Session(), timeout=0.05, backoff=0.001,
+                             breaker=CircuitBreaker(failure_threshold=1, reset_timeout=60))
+    status, message, txn = charge_late_fees(gateway, "123456", 1.00, "Late fees", "pay-1")
+    assert (status, txn) == ('uncertain', None)
+    assert len(stub.requests) == 1
+    assert charge_late_fees(gateway, "123456", 1.00, "Late fees", "pay-2")[0] == 'failed'
+    assert len(stub.requests) == 1
+
+def test_circuit_half_open_trial_closes_it(stub):
+    """Test a successful trial call after the reset timeout closes the circuit."""
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    gateway = PaymentGateway(base_url=stub.url, session=requests.Session(), max_retries=0, breaker=breaker)
+    stub.fail_next = 1
+    with pytest.raises(PaymentGatewayError):
+        gateway.process_payment("123456", 1.00)
+    assert breaker.state == 'open'
+    time.sleep(0.02)
+    assert gateway.process_payment("123456", 1.00)[0]
+    assert breaker.state == 'closed'
+
+def test_refund_and_status_over_http(gateway):
+    """Test refunds and status checks use the gateway's endpoints."""
+    _, txn, _ = gateway.process_payment("123456", 4.50)
+    success, message = gateway.refund_payment(txn, 4.50)
+    assert success
+    assert f"refund_{txn}" in message
+    assert gateway.verify_payment_status(txn)['status'] == 'completed'
+    assert gateway.verify_payment_status("txn_unknown")['status'] == 'not_found'
+
+def test_charge_found_by_idempotency_key(gateway):
+    """Test a charge can be looked up by the key it was sent with."""
+    _, txn, _ = gateway.process_payment("123456", 4.50, idempotency_key="pay-1")
+    assert gateway.find_payment("pay-1") == {'transaction_id': txn, 'status': 'completed'}
+    assert gateway.find_payment("pay-2")['status'] == 'not_found'
+
+def test_pay_late_fees_uses_shared_gateway(stub, mocker):
+    """Test pay_late_fees without a gateway uses the configured shared gateway."""
+    mocker.patch('services.library_service.get_book_by_id', return_value={'id': 1, 'title': 'Book A'})
+    mocker.patch('services.library_service.calculate_late_fee_for_book', return_value={'days_overdue': 3, 'fee_amount': 4.50})
+    configure_payment_gateway(stub.url)
+    try:
+        assert get_default_gateway() is get_default_gateway()
+        success, message, txn = pay_late_fees("123456", 1)
+    finally:
+        configure_payment_gateway()
+    assert success
+    assert txn == "txn_123456_1"
+    assert get_default_gateway().simulated
@@ -0,0 +1,167 @@
+import threading
+import pytest
+from datetime import datetime, timedelta
+from database import (
+    insert_book, insert_borrow_record, get_book_by_isbn, get_payment_job,
+    claim_payment_job, requeue_running_payment_jobs
+)
+from services.payment_queue import (
+    enqueue_late_fee_payment, enqueue_refund, run_payment_job, wait_for_payment_job,
+    PaymentWorkerPool, start_payment_workers, stop_payment_workers
+)
+
+@pytest.fixture(autouse=True)
+def no_global_workers():
+    stop_payment_workers()
+    yield
+    stop_payment_workers()
+
+def add_overdue_loan(patron_id="123456", days_overdue=3):
+    insert_book("Queued Book", "Queue Author", "1234567890123", 1, 1)
+    book_id = get_book_by_isbn("1234567890123")['id']
+    due = datetime.now() - timedelta(days=days_overdue)
+    insert_borrow_record(patron_id, book_id, due - timedelta(days=14), due)
+    return book_id
+
+def test_enqueue_payment_creates_queued_job():
+    """Test a valid payment is stored as a queued job without calling the gateway."""
+    book_id = add_overdue_loan()
+    success, message, job_id = enqueue_late_fee_payment("123456", book_id)
+    assert success
+    job = get_payment_job(job_id)
+    assert job['status'] == 'queued'
+    assert job['kind'] == 'payment'
+    assert job['amount'] == 1.50
+    assert "Queued Book" in job['description']
+
+def test_enqueue_payment_validates_first():
+    """Test invalid payments are rejected up front and never queued."""
+    assert enqueue_late_fee_payment("abc", 1) == (False, "Invalid patron ID. Must be exactly 6 digits.", None)
+    insert_book("Queued Book", "Queue Author", "1234567890123", 1, 1)
+    book_id = get_book_by_isbn("1234567890123")['id']
+    success, message, job_id = enqueue_late_fee_payment("123456", book_id)
+    assert not success
+    assert job_id is None
+
+def test_enqueue_refund_validates_first():
+    """Test refunds use the same checks as refund_late_fee_payment."""
+    assert enqueue_refund("bad", 5.00)[0] is False
+    assert enqueue_refund("txn_123456", 16.00)[0] is False
+    success, _, job_id = enqueue_refund("txn_123456", 5.00)
+    assert success
+    assert get_payment_job(job_id)['kind'] == 'refund'
+
+def test_run_payment_job_records_result(make_gateway):
+    """Test a worker run stores the gateway's transaction ID and message."""
+    book_id = add_overdue_loan()
+    _, _, job_id = enqueue_late_fee_payment("123456", book_id)
+    gateway = make_gateway()
+    assert run_payment_job(claim_payment_job(), gateway)
+    job = get_payment_job(job_id)
+    assert job['status'] == 'succeeded'
+    assert job['transaction_id'] == "txn_123456_1"
+    assert job['attempts'] == 1
+    gateway.process_payment.assert_called_once_with(
+        patron_id="123456", amount=1.50, description="Late fees for 'Queued Book'",
+        idempotency_key=job['idempotency_key']
+    )
+
+def test_run_payment_job_records_failure(make_gateway):
+    """Test a declined payment is stored as failed."""
+    book_id = add_overdue_loan()
+    _, _, job_id = enqueue_late_fee_payment("123456", book_id)
+    assert not run_payment_job(claim_payment_job(), make_gateway(success=False))
+    job = get_payment_job(job_id)
+    assert job['status'] == 'failed'
+    assert "Payment failed" in job['message']
+
+def test_each_job_claimed_once():
+    """Test concurrent claims never hand the same job to two workers."""
+    ids = [enqueue_refund("txn_123456", 1.00)[2] for _ in range(10)]
+    claimed = []
+    def claim():
+        while True:
+            job = claim_payment_job()
+            if job is None:
+                return
+            claimed.append(job['id'])
+    threads = [threading.Thread(target=claim) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(claimed) == ids
+
+def test_worker_pool_processes_jobs_concurrently():
+    """Test the worker pool drains the queue with several gateway calls in flight."""
+    in_flight = []
+    peak = []
+    lock = threading.Lock()
+    release = threading.Event()
+    class SlowGateway:
+        def refund_payment(self, transaction_id, amount, idempotency_key=None):
+            with lock:
+                in_flight.append(1)
+                peak.append(len(in_flight))
+            release.wait(1)
+            with lock:
+                in_flight.pop()
+            return True, "Refunded"
+    ids = [enqueue_refund("txn_123456", 1.00)[2] for _ in range(6)]
+    pool = PaymentWorkerPool(workers=3, gateway_factory=SlowGateway, poll_interval=0.01)
+    pool.start()
+    try:
+        for _ in range(100):
+            if len(peak) >= 3:
+                break
+            threading.Event().wait(0.01)
+        release.set()
+        jobs = [wait_for_payment_job(job_id, timeout=5) for job_id in ids]
+    finally:
+        pool.stop(timeout=5)
+    assert all(job['status'] == 'succeeded' for job in jobs)
+    assert max(peak) == 3
+    assert pool.stats['succeeded'] == 6
+
+def test_abandoned_jobs_are_requeued():
+    """Test jobs left running past their lease go back on the queue."""
+    job_id = enqueue_refund("txn_123456", 1.00)[2]
+    claim_payment_job()
+    assert requeue_running_payment_jobs(datetime.now() - timedelta(minutes=5)) == 0
+    assert requeue_running_payment_jobs(datetime.now() + timedelta(seconds=1)) == 1
+    assert get_payment_job(job_id)['status'] == 'queued'
+
+def test_worker_pool_retries_jobs_after_their_lease(make_gateway):
+    """Test a job left running by a failed worker is requeued and retried by the running pool."""
+    job_id = enqueue_refund("txn_123456", 1.00)[2]
+    claim_payment_job()  # Claimed by a worker that raised before finishing it
+    pool = PaymentWorkerPool(workers=1, gateway_factory=make_gateway, poll_interval=0.01, lease=0.2)
+    pool.start()
+    try:
+        job = wait_for_payment_job(job_id, timeout=5)
+    finally:
+        pool.stop(timeout=5)
+    assert job['status'] == 'succeeded'
+    assert job['attempts'] == 2
+    assert pool.stats['requeued'] == 1
+
+def test_payment_api_returns_job_to_poll(client, make_gateway):
+    """Test the API answers 202 right away and the job completes in the background."""
+    book_id = add_overdue_loan()
+    start_payment_workers(2, gateway_factory=make_gateway, poll_interval=0.01)
+
+    response = client.post('/api/payments', json={'patron_id': '123456', 'book_id': book_id})
+    assert response.status_code == 202
+    status_url = response.get_json()['status_url']
+    assert response.headers['Location'].endswith(status_url)
+
+    wait_for_payment_job(response.get_json()['job_id'], timeout=5)
+    job = client.get(status_url).get_json()
+    assert job['status'] == 'succeeded'
+    assert job['transaction_id'] == "txn_123456_1"
+
+def test_payment_api_rejects_bad_requests(client):
+    """Test validation errors are returned immediately."""
+    assert client.post('/api/payments', json={'patron_id': '123456', 'book_id': 'x'}).status_code == 400
+    assert client.post('/api/refunds', json={'transaction_id': 'bad', 'amount': 1}).status_code == 400
+    assert client.get('/api/payments/jobs/999999').status_code == 404
@@ -0,0 +1,154 @@
+import pytest
+from datetime import date, datetime, timedelta
+from database import (
+    insert_book, insert_borrow_record, get_book_by_isbn, get_payment, get_patron_payments,
+    get_charge_by_transaction, claim_payment_job, record_reconciliation, get_payment_drift,
+    transaction, create_payment, update_payment_status
+)
+from services.library_service import (
+    pay_late_fees, refund_late_fee_payment, settle_patron_fees, get_payment_status
+)
+from services.payment_queue import enqueue_late_fee_payment, run_payment_job
+from services.reconciliation import RateLimiter, reconcile_payments
+
+def add_overdue_loan(days_overdue=3, isbn="1234567890123"):
+    insert_book("Ledger Book", "Ledger Author", isbn, 1, 1)
+    book_id = get_book_by_isbn(isbn)['id']
+    due = datetime.now() - timedelta(days=days_overdue)
+    insert_borrow_record("123456", book_id, due - timedelta(days=14), due)
+    return book_id
+
+def test_pay_late_fees_writes_ledger(make_gateway):
+    """Test a single-book payment is recorded with its allocation and transaction ID."""
+    book_id = add_overdue_loan()
+    success, _, txn = pay_late_fees("123456", book_id, make_gateway())
+    assert success
+    charge = get_charge_by_transaction(txn)
+    assert charge['status'] == 'completed'
+    assert charge['kind'] == 'charge'
+    assert charge['amount'] == 1.50
+    assert get_payment(charge['id'])['allocations'][0]['book_id'] == book_id
+
+def test_pay_late_fees_charges_with_ledger_key(make_gateway):
+    """Test the gateway gets the idempotency key of the reserved ledger entry."""
+    book_id = add_overdue_loan()
+    gateway = make_gateway()
+    _, _, txn = pay_late_fees("123456", book_id, gateway)
+    key = gateway.process_payment.call_args.kwargs['idempotency_key']
+    assert key.startswith('pay-')
+    assert get_charge_by_transaction(txn)['idempotency_key'] == key
+
+def test_paid_book_is_not_charged_twice(make_gateway):
+    """Test pay_late_fees checks the ledger for what the loan still owes."""
+    book_id = add_overdue_loan()
+    pay_late_fees("123456", book_id, make_gateway())
+    gateway = make_gateway()
+    success, message, _ = pay_late_fees("123456", book_id, gateway)
+    assert not success
+    assert "No late fees" in message
+    gateway.process_payment.assert_not_called()
+
+def test_settlement_skips_books_paid_individually(make_gateway):
+    """Test settlement and single-book payments share one ledger."""
+    first = add_overdue_loan(isbn="1234567890123")
+    add_overdue_loan(days_overdue=10, isbn="1234567890124")
+    pay_late_fees("123456", first, make_gateway(txn="txn_123456_1"))
+    success, _, payment = settle_patron_fees("123456", make_gateway(txn="txn_123456_2"))
+    assert success
+    assert payment['total'] == 6.50
+
+def test_status_check_is_local(make_gateway):
+    """Test payment status comes from the ledger without calling the gateway."""
+    book_id = add_overdue_loan()
+    gateway = make_gateway()
+    _, _, txn = pay_late_fees("123456", book_id, gateway)
+    status = get_payment_status(txn)
+    assert status['status'] == 'completed'
+    assert status['amount'] == 1.50
+    assert status['refunded_amount'] == 0
+    gateway.verify_payment_status.assert_not_called()
+    assert get_payment_status("txn_unknown")['status'] == 'not_found'
+
+def test_refund_validated_against_amount_paid(make_gateway):
+    """Test refunds of a ledger charge can't exceed what was paid, in total."""
+    book_id = add_overdue_loan()
+    _, _, txn = pay_late_fees("123456", book_id, make_gateway())
+    gateway = make_gateway()
+    assert refund_late_fee_payment(txn, 2.00, gateway) == (False, "Refund amount exceeds the amount paid.")
+    assert refund_late_fee_payment(txn, 1.00, gateway)[0]
+    assert refund_late_fee_payment(txn, 1.00, gateway) == (False, "Refund amount exceeds the amount paid.")
+    assert refund_late_fee_payment(txn, 0.50, gateway)[0]
+    assert gateway.refund_payment.call_count == 2
+    assert get_payment_status(txn)['refunded_amount'] == 1.50
+
+def test_refund_recorded_in_ledger(make_gateway):
+    """Test a refund is stored as its own ledger entry linked to the charge."""
+    book_id = add_overdue_loan()
+    _, _, txn = pay_late_fees("123456", book_id, make_gateway())
+    refund_late_fee_payment(txn, 1.00, make_gateway())
+    entries = get_patron_payments("123456")
+    assert [e['kind'] for e in entries] == ['refund', 'charge']
+    assert entries[0]['refund_of'] == entries[1]['id']
+    assert entries[0]['status'] == 'completed'
+
+def test_failed_refund_does_not_count(make_gateway):
+    """Test a declined refund leaves the full amount refundable."""
+    book_id = add_overdue_loan()
+    _, _, txn = pay_late_fees("123456", book_id, make_gateway())
+    gateway = make_gateway()
+    gateway.refund_payment.return_value = (False, "Declined")
+    assert not refund_late_fee_payment(txn, 1.50, gateway)[0]
+    assert refund_late_fee_payment(txn, 1.50, make_gateway())[0]
+
+def test_settlement_refund_may_exceed_single_book_maximum(make_gateway):
+    """Test a multi-book settlement can be refunded up to its own total."""
+    add_overdue_loan(days_overdue=40, isbn="1234567890123")
+    add_overdue_loan(days_overdue=40, isbn="1234567890124")
+    _, _, payment = settle_patron_fees("123456", make_gateway())
+    assert payment['total'] == 30.00
+    assert refund_late_fee_payment("txn_123456_1", 20.00, make_gateway())[0]
+
+def test_queued_payment_updates_ledger(make_gateway):
+    """Test a queued payment is pending in the ledger until a worker completes it."""
+    book_id = add_overdue_loan()
+    queued, _, job_id = enqueue_late_fee_payment("123456", book_id)
+    assert queued
+    assert get_patron_payments("123456")[0]['status'] == 'pending'
+    assert enqueue_late_fee_payment("123456", book_id)[1] == "No late fees to pay for this book."
+    run_payment_job(claim_payment_job(), make_gateway())
+    assert get_charge_by_transaction("txn_123456_1")['status'] == 'completed'
+
+def test_late_answer_does_not_overwrite_reconciled_payment():
+    """Test a charge answered after the reconciler failed its payment leaves it failed and flags the charge."""
+    with transaction() as conn:
+        payment_id = create_payment(conn, "123456", 1.50, "Late fees", "pay-late")
+    assert record_reconciliation(get_payment(payment_id), 'not_found', 'failed')
+    assert not update_payment_status(payment_id, 'completed', "txn_123456_1")
+    assert get_payment(payment_id)['status'] == 'failed'
+    drift = get_payment_drift()
+    assert [(d['local_status'], d['gateway_status'], d['transaction_id']) for d in drift] == \
+        [('failed', 'completed', "txn_123456_1")]
+
+def test_reconciler_leaves_payments_with_unfinished_jobs(make_gateway):
+    """Test a queued payment isn't settled by the reconciler before its job has run."""
+    book_id = add_overdue_loan()
+    enqueue_late_fee_payment("123456", book_id)
+    gateway = make_gateway()
+    gateway.find_payment.return_value = {"status": "not_found"}
+    assert reconcile_payments(gateway, rate_limiter=RateLimiter(1000), grace=0)['checked'] == 0
+    job = claim_payment_job()
+    assert reconcile_payments(gateway, rate_limiter=RateLimiter(1000), grace=0)['checked'] == 0
+    assert not record_reconciliation(get_payment(job['payment_id']), 'not_found', 'failed')
+    run_payment_job(job, gateway)
+    assert get_payment(job['payment_id'])['status'] == 'completed'
+    assert enqueue_late_fee_payment("123456", book_id)[1] == "No late fees to pay for this book."
+
+def test_ledger_api(client, make_gateway):
+    """Test the ledger lookups are exposed over the API."""
+    book_id = add_overdue_loan()
+    _, _, txn = pay_late_fees("123456", book_id, make_gateway())
+    assert client.get(f'/api/transactions/{txn}').get_json()['status'] == 'completed'
+    assert client.get('/api/transactions/txn_missing').status_code == 404
+    data = client.get('/api/patron/123456/payments').get_json()
+    assert data['count'] == 1
+    assert data['payments'][0]['transaction_id'] == txn
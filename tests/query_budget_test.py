@@ -0,0 +1,135 @@
+import logging
+import pytest
+from datetime import datetime, timedelta
+from database import (
+    insert_book, insert_borrow_record, get_book_by_id, get_book_by_isbn, configure_pool, DATABASE
+)
+from instrumentation import (
+    QueryBudgetExceeded, analyze_statements, assert_max_queries, capture_queries
+)
+from services.library_service import return_book_by_patron
+
+@pytest.fixture
+def make_app(make_app):
+    def make(**config):
+        return make_app(**{'TESTING': True, 'QUERY_BUDGET_MODE': 'raise', **config})
+    return make
+
+@pytest.fixture
+def client(make_app):
+    client = make_app().test_client()
+    insert_book("Budget Book", "Budget Author", "1234567890123", 3, 3)
+    book_id = get_book_by_isbn("1234567890123")['id']
+    due = datetime.now() - timedelta(days=3)
+    insert_borrow_record("111111", book_id, due - timedelta(days=14), due)
+    client.book_id = book_id
+    return client
+
+def test_routes_stay_within_their_query_budgets(client):
+    """Test every route with a declared budget runs within it (QUERY_BUDGET_MODE='raise' fails otherwise)."""
+    book_id = client.book_id
+    assert client.get('/catalog').status_code == 200
+    assert client.get('/search?q=budget&type=title').status_code == 200
+    assert client.get('/api/search?q=budget&type=title').status_code == 200
+    assert client.get('/api/books').status_code == 200
+    assert client.post('/borrow', data={'patron_id': '123456', 'book_id': book_id}).status_code == 302
+    assert client.post('/return', data={'patron_id': '123456', 'book_id': book_id}).status_code == 200
+    assert client.get(f'/api/late_fee/111111/{book_id}').status_code == 200
+    assert client.get('/api/patron/111111/status').status_code == 200
+    assert client.get('/api/patron/111111/payments').status_code == 200
+    assert client.get('/api/reports/overdue').status_code == 200
+
+def test_new_connection_setup_is_not_counted(client):
+    """Test the pragmas run on a freshly opened connection don't count against a route's budget."""
+    pool = configure_pool(DATABASE)
+    assert client.get(f'/api/late_fee/111111/{client.book_id}').status_code == 200
+    assert pool.stats()['size'] == 1
+
+def test_budget_exceeded_raises(make_app):
+    """Test a route going over its budget fails the request in 'raise' mode."""
+    app = make_app()
+
+    @app.route('/test/over-budget')
+    def over_budget():
+        for book_id in range(1, 4):
+            get_book_by_id(book_id)
+        return 'ok'
+    over_budget.query_budget = 1
+
+    with pytest.raises(QueryBudgetExceeded, match='ran 3 statements, budget is 1'):
+        app.test_client().get('/test/over-budget')
+
+def test_budget_exceeded_is_logged_in_warn_mode(caplog, make_app):
+    """Test 'warn' mode logs the overrun and still serves the page."""
+    app = make_app(QUERY_BUDGET_MODE='warn')
+
+    @app.route('/test/over-budget')
+    def over_budget():
+        get_book_by_id(1)
+        get_book_by_id(2)
+        return 'ok'
+    over_budget.query_budget = 1
+
+    with caplog.at_level(logging.WARNING, logger='library.sql'):
+        assert app.test_client().get('/test/over-budget').status_code == 200
+    assert 'GET /test/over-budget ran 2 statements, budget is 1' in caplog.text
+
+def test_query_tracing_flags_repeats_and_n_plus_one(caplog, make_app):
+    """Test QUERY_TRACING logs identical repeats and per-row lookups."""
+    app = make_app(QUERY_TRACING=True)
+    insert_book("Budget Book", "Budget Author", "1234567890123", 3, 3)
+
+    @app.route('/test/n-plus-one')
+    def n_plus_one():
+        for book_id in range(1, 7):
+            get_book_by_id(book_id)  # Misses aren't cached, so each one is a query
+        get_book_by_isbn("0000000000000")
+        get_book_by_isbn("0000000000000")
+        return 'ok'
+
+    with caplog.at_level(logging.WARNING, logger='library.sql'):
+        app.test_client().get('/test/n-plus-one')
+    assert 'looks like an N+1 query (6 runs): SELECT * FROM books WHERE id = ?' in caplog.text
+    assert "ran an identical statement 2 times: SELECT * FROM books WHERE isbn = ? ('0000000000000',)" in caplog.text
+
+def test_slow_queries_are_logged(caplog, make_app):
+    """Test statements over SLOW_QUERY_THRESHOLD are logged with their route."""
+    client = make_app(SLOW_QUERY_THRESHOLD=0).test_client()
+    with caplog.at_level(logging.WARNING, logger='library.sql'):
+        client.get('/catalog')
+    assert 'Slow query' in caplog.text
+    assert 'GET /catalog' in caplog.text
+    make_app()  # Restore the default threshold
+
+def test_assert_max_queries_for_service_calls():
+    """Test service functions can be held to a budget outside of a request."""
+    insert_book("Budget Book", "Budget Author", "1234567890123", 3, 3)
+    book_id = get_book_by_isbn("1234567890123")['id']
+    due = datetime.now() - timedelta(days=3)
+    insert_borrow_record("111111", book_id, due - timedelta(days=14), due)
+    with assert_max_queries(6):
+        assert return_book_by_patron("111111", book_id)[0]
+    with pytest.raises(QueryBudgetExceeded):
+        with assert_max_queries(1):
+            get_book_by_id(999)
+            get_book_by_id(998)
+
+def test_analyze_statements():
+    """Test repeats need identical parameters and N+1 needs different ones."""
+    select = 'SELECT * FROM books WHERE id = ?'
+    statements = [('BEGIN IMMEDIATE', (), 0.0)] * 2 + [(select, (i,), 0.001) for i in range(5)] + [(select, (1,), 0.2)]
+    report = analyze_statements(statements, slow=0.1)
+    assert report['count'] == 8
+    assert report['repeated'] == [{'sql': select, 'parameters': '(1,)', 'count': 2}]
+    assert report['n_plus_one'] == [{'sql': select, 'count': 6}]
+    assert report['slow'] == [{'sql': select, 'seconds': 0.2}]
+
+def test_capture_works_without_instrumentation(make_app):
+    """Test capture_queries installs its own observer when instrumentation is off."""
+    make_app(INSTRUMENTATION=False)
+    try:
+        with capture_queries() as captured:
+            get_book_by_id(999)
+        assert len(captured) == 1
+    finally:
+        make_app()
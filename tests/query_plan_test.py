@@ -0,0 +1,164 @@
+import pytest
+from database import get_db_connection, get_schema_version, migrate_database, MIGRATIONS
+
+def query_plan(sql, params=()):
+    """Return the EXPLAIN QUERY PLAN details for a statement."""
+    conn = get_db_connection()
+    try:
+        rows = conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+    finally:
+        conn.close()
+    return [row['detail'] for row in rows]
+
+def assert_no_full_scan(plan, *names):
+    """Fail if the plan reads every row of a table (given by name or alias)."""
+    for detail in plan:
+        words = detail.split()
+        assert not (words[0] == 'SCAN' and words[1] in names), plan
+
+def test_schema_is_at_latest_version():
+    """Test that init_database applied every migration."""
+    conn = get_db_connection()
+    try:
+        assert get_schema_version(conn) == MIGRATIONS[-1][0]
+        assert migrate_database(conn) == MIGRATIONS[-1][0]
+    finally:
+        conn.close()
+
+def test_patron_borrow_count_uses_active_loan_index():
+    """Test the borrowing-limit count reads only the patron's active loans."""
+    plan = query_plan('''
+        SELECT COUNT(*) as count FROM borrow_records
+        WHERE patron_id = ? AND return_date IS NULL
+    ''', ('123456',))
+    assert_no_full_scan(plan, 'borrow_records')
+    assert any(d.startswith('SEARCH borrow_records USING') for d in plan)
+
+def test_patron_borrowed_books_uses_index():
+    """Test the currently-borrowed listing does not scan borrow_records."""
+    plan = query_plan('''
+        SELECT br.*, b.title, b.author
+        FROM borrow_records br
+        JOIN books b ON br.book_id = b.id
+        WHERE br.patron_id = ? AND br.return_date IS NULL
+        ORDER BY br.borrow_date
+    ''', ('123456',))
+    assert_no_full_scan(plan, 'br', 'b')
+
+def test_return_date_update_uses_index():
+    """Test closing a loan finds the record through an index."""
+    plan = query_plan('''
+        UPDATE borrow_records
+        SET return_date = ?
+        WHERE patron_id = ? AND book_id = ? AND return_date IS NULL
+    ''', ('2024-01-01', '123456', 1))
+    assert_no_full_scan(plan, 'borrow_records')
+
+def test_status_report_history_uses_index():
+    """Test the patron history query is served in borrow_date order from an index."""
+    plan = query_plan('''
+        SELECT br.*, b.title, b.author, b.isbn
+        FROM borrow_records br
+        JOIN books b ON br.book_id = b.id
+        WHERE br.patron_id = ?
+        ORDER BY br.borrow_date DESC
+    ''', ('123456',))
+    assert_no_full_scan(plan, 'br', 'b')
+    assert not any('TEMP B-TREE' in d for d in plan)
+
+def test_overdue_lookup_uses_due_date_index():
+    """Test overdue loans are found by due date without scanning returned loans."""
+    plan = query_plan('''
+        SELECT * FROM borrow_records
+        WHERE return_date IS NULL AND due_date < ?
+    ''', ('2024-01-01',))
+    assert any('idx_borrow_records_active_due' in d for d in plan)
+
+def test_title_prefix_search_uses_nocase_index():
+    """Test case-insensitive title lookups use the NOCASE index."""
+    plan = query_plan("SELECT * FROM books WHERE title LIKE ?", ('gats%',))
+    assert any('idx_books_title_nocase' in d for d in plan)
+    plan = query_plan("SELECT * FROM books WHERE author = ? COLLATE NOCASE", ('harper lee',))
+    assert any('idx_books_author_nocase' in d for d in plan)
+
+def test_title_search_uses_full_text_index():
+    """Test title/author searches are answered by the FTS index, not a scan of books."""
+    plan = query_plan('''
+        SELECT b.* FROM books_fts f
+        JOIN books b ON b.id = f.rowid
+        WHERE books_fts MATCH ?
+        ORDER BY f.rank
+        LIMIT ?
+    ''', ('title : "gatsby"*', 100))
+    assert any('VIRTUAL TABLE' in d for d in plan)
+    assert_no_full_scan(plan, 'b')
+
+def test_isbn_search_uses_unique_index():
+    """Test exact ISBN searches hit the unique index."""
+    plan = query_plan('SELECT * FROM books WHERE isbn = ?', ('9780743273565',))
+    assert_no_full_scan(plan, 'books')
+
+def test_catalog_page_uses_keyset_index():
+    """Test a catalog page after a cursor is an index range scan, not a scan and sort."""
+    plan = query_plan('''
+        SELECT * FROM books
+        WHERE (title, id) > (?, ?)
+        ORDER BY title, id
+        LIMIT ?
+    ''', ('M', 10, 51))
+    assert any('idx_books_title_id' in d for d in plan)
+    assert not any('TEMP B-TREE' in d for d in plan)
+
+def test_overdue_fee_totals_use_due_date_index():
+    """Test the library-wide fee report only visits active loans."""
+    from database import OVERDUE_FEES_CTE
+    sql = OVERDUE_FEES_CTE.format(patron_filter='') + 'SELECT patron_id, SUM(fee_amount) FROM fees GROUP BY patron_id'
+    params = {'today': '2024-06-30', 'first_tier_rate': 0.5, 'first_tier_days': 7, 'later_rate': 1.0, 'max_fee': 15.0}
+    plan = query_plan(sql, params)
+    # Either partial index works: both contain only loans with return_date IS NULL
+    assert any(d.startswith(('SEARCH br USING INDEX idx_borrow_records_active',
+                             'SCAN br USING INDEX idx_borrow_records_active')) for d in plan)
+    assert_no_full_scan(plan, 'b')
+
+def test_patron_history_page_uses_index():
+    """Test a page of patron history is read in order from the (patron_id, borrow_date) index."""
+    plan = query_plan('''
+        SELECT br.id, b.title, b.author, b.isbn, br.borrow_date, br.due_date, br.return_date
+        FROM borrow_records br
+        JOIN books b ON br.book_id = b.id
+        WHERE br.patron_id = ? AND (br.borrow_date, br.id) < (?, ?)
+        ORDER BY br.borrow_date DESC, br.id DESC
+        LIMIT ?
+    ''', ('123456', '2024-01-01', 10, 51))
+    assert any('idx_borrow_records_patron_borrow_date' in d for d in plan)
+    assert_no_full_scan(plan, 'br', 'b')
+    assert not any('TEMP B-TREE' in d for d in plan)
+
+def test_outstanding_fees_use_allocation_index():
+    """Test paid amounts are looked up per loan through the allocations index."""
+    from database import OVERDUE_FEES_CTE
+    sql = (OVERDUE_FEES_CTE.format(patron_filter='AND br.patron_id = :patron_id')
+           + 'SELECT * FROM outstanding WHERE outstanding_amount > 0')
+    params = {'today': '2024-06-30', 'first_tier_rate': 0.5, 'first_tier_days': 7, 'later_rate': 1.0,
+              'max_fee': 15.0, 'patron_id': '123456'}
+    plan = query_plan(sql, params)
+    assert any('idx_payment_allocations_borrow_record' in d for d in plan)
+    assert_no_full_scan(plan, 'br', 'b', 'pa', 'p')
+
+def test_payment_lookups_use_indexes():
+    """Test ledger lookups by transaction ID and by patron are index searches."""
+    plan = query_plan("SELECT * FROM payments WHERE transaction_id = ? AND kind = 'charge'", ('txn_1',))
+    assert any('idx_payments_transaction' in d for d in plan)
+    plan = query_plan('SELECT * FROM payments WHERE patron_id = ? ORDER BY created_at DESC LIMIT 50', ('123456',))
+    assert any('idx_payments_patron' in d for d in plan)
+    assert not any('TEMP B-TREE' in d for d in plan)
+
+def test_reconciliation_candidates_use_indexes():
+    """Test finding unsettled and unchecked payments doesn't scan the ledger."""
+    plan = query_plan('''SELECT id FROM payments WHERE status IN ('pending', 'uncertain') AND updated_at < ?
+                         AND (reconciled_at IS NULL OR reconciled_at < ?) ORDER BY updated_at LIMIT 100''',
+                      ('2024-01-01', '2024-01-01'))
+    assert any('idx_payments_status' in d for d in plan)
+    plan = query_plan('''SELECT id FROM payments WHERE reconciled_at IS NULL AND status = 'completed'
+                         AND kind = 'charge' ORDER BY id LIMIT 100''')
+    assert any('idx_payments_unreconciled' in d for d in plan)
@@ -0,0 +1,176 @@
+import threading
+import time
+import pytest
+from datetime import datetime, timedelta
+from database import (
+    transaction, create_payment, update_payment_status, get_payment, get_payment_drift,
+    insert_book, insert_borrow_record, get_book_by_isbn, get_charge_by_transaction
+)
+from services.library_service import pay_late_fees
+from services.payment_service import PaymentGateway, PaymentGatewayError, CircuitOpenError
+from services.reconciliation import (
+    RateLimiter, check_payment, reconcile_payments, start_reconciler, stop_reconciler
+)
+
+@pytest.fixture(autouse=True)
+def no_global_reconciler():
+    stop_reconciler()
+    yield
+    stop_reconciler()
+
+def add_payment(status='pending', transaction_id="txn_123456_1", kind='charge'):
+    with transaction() as conn:
+        payment_id = create_payment(conn, "123456", 4.50, "Late fees", f"test-{time.monotonic_ns()}",
+                                    kind=kind, transaction_id=transaction_id)
+    if status != 'pending':
+        update_payment_status(payment_id, status)
+    return payment_id
+
+def reconcile(gateway, **options):
+    return reconcile_payments(gateway, rate_limiter=RateLimiter(1000), grace=0, **options)
+
+def test_pending_payment_settled_from_gateway(make_gateway):
+    """Test a pending charge the gateway reports as completed is marked completed."""
+    payment_id = add_payment()
+    gateway = make_gateway()
+    summary = reconcile(gateway)
+    assert summary['checked'] == 1
+    assert summary['settled'] == 1
+    assert get_payment(payment_id)['status'] == 'completed'
+    gateway.verify_payment_status.assert_called_once_with("txn_123456_1", timeout=5.0)
+    drift = get_payment_drift(resolved=True)
+    assert (drift[0]['local_status'], drift[0]['gateway_status']) == ('pending', 'completed')
+
+def test_uncertain_payment_not_found_is_failed(make_gateway):
+    """Test an uncertain charge unknown to the gateway is failed so its fees are payable again."""
+    payment_id = add_payment('uncertain')
+    assert reconcile(make_gateway(status="not_found"))['settled'] == 1
+    assert get_payment(payment_id)['status'] == 'failed'
+
+def test_pending_payment_within_grace_is_skipped(make_gateway):
+    """Test entries whose payment may still be in flight are left alone."""
+    add_payment()
+    gateway = make_gateway()
+    assert reconcile_payments(gateway, rate_limiter=RateLimiter(1000))['checked'] == 0
+    gateway.verify_payment_status.assert_not_called()
+
+def test_completed_charge_checked_once(make_gateway):
+    """Test a matching completed charge is checked once and then left alone."""
+    add_payment('completed')
+    gateway = make_gateway()
+    assert reconcile(gateway)['matched'] == 1
+    assert reconcile(gateway)['checked'] == 0
+    assert get_payment_drift(resolved=None) == []
+
+def test_completed_charge_drift_is_recorded_not_changed(make_gateway):
+    """Test a completed charge the gateway disagrees with is flagged, not overwritten."""
+    payment_id = add_payment('completed')
+    assert reconcile(make_gateway(status="not_found"))['drift'] == 1
+    assert get_payment(payment_id)['status'] == 'completed'
+    drift = get_payment_drift()
+    assert drift[0]['payment_id'] == payment_id
+    assert drift[0]['gateway_status'] == 'not_found'
+
+def test_timed_out_charge_found_by_idempotency_key(make_gateway):
+    """Test a charge whose gateway call timed out is looked up by its key and settled."""
+    insert_book("Late Book", "Author", "1234567890999", 1, 1)
+    book_id = get_book_by_isbn("1234567890999")['id']
+    due = datetime.now() - timedelta(days=3)
+    insert_borrow_record("123456", book_id, due - timedelta(days=14), due)
+    gateway = make_gateway()
+    gateway.process_payment.side_effect = PaymentGatewayError("ReadTimeout: timed out")
+    success, _, txn = pay_late_fees("123456", book_id, gateway)
+    assert (success, txn) == (False, None)
+    key = gateway.process_payment.call_args.kwargs['idempotency_key']
+    gateway.find_payment.return_value = {"transaction_id": "txn_123456_9", "status": "succeeded"}
+    assert reconcile(gateway)['settled'] == 1
+    gateway.find_payment.assert_called_once_with(key, timeout=5.0)
+    gateway.verify_payment_status.assert_not_called()
+    charge = get_charge_by_transaction("txn_123456_9")
+    assert (charge['status'], charge['idempotency_key']) == ('completed', key)
+    assert not pay_late_fees("123456", book_id, make_gateway())[0]
+
+def test_charge_without_transaction_not_found_is_failed(make_gateway):
+    """Test a charge the gateway has no record of under its key is failed so its fees are payable again."""
+    payment_id = add_payment('uncertain', transaction_id=None)
+    assert reconcile(make_gateway(status="not_found"))['settled'] == 1
+    payment = get_payment(payment_id)
+    assert (payment['status'], payment['transaction_id']) == ('failed', None)
+
+def test_charge_the_gateway_cannot_look_up_is_left_alone():
+    """Test the simulated gateway, which can't look charges up by key, doesn't fail them."""
+    payment_id = add_payment('uncertain', transaction_id=None)
+    assert reconcile(PaymentGateway())['inconclusive'] == 1
+    assert get_payment(payment_id)['status'] == 'uncertain'
+
+def test_refund_without_transaction_is_unverifiable(make_gateway):
+    """Test refunds without a transaction ID are flagged once and not retried every run."""
+    payment_id = add_payment('uncertain', transaction_id=None, kind='refund')
+    gateway = make_gateway()
+    assert reconcile(gateway)['unverifiable'] == 1
+    assert reconcile(gateway)['checked'] == 0
+    gateway.verify_payment_status.assert_not_called()
+    gateway.find_payment.assert_not_called()
+    assert get_payment_drift()[0]['gateway_status'] == 'unverifiable'
+    assert get_payment(payment_id)['status'] == 'uncertain'
+
+def test_inconclusive_and_errors_are_retried(make_gateway):
+    """Test entries are checked again when the gateway can't give an answer."""
+    payment_id = add_payment('uncertain')
+    assert reconcile(make_gateway(status="processing"))['inconclusive'] == 1
+    gateway = make_gateway()
+    gateway.verify_payment_status.side_effect = CircuitOpenError("Payment gateway unavailable")
+    assert reconcile(gateway)['errors'] == 1
+    assert get_payment(payment_id)['status'] == 'uncertain'
+    assert reconcile(make_gateway())['settled'] == 1
+
+def test_concurrency_is_bounded(make_gateway):
+    """Test no more than `concurrency` status checks are in flight at once."""
+    for i in range(8):
+        add_payment(transaction_id=f"txn_123456_{i}")
+    lock = threading.Lock()
+    in_flight = [0, 0]  # current, peak
+
+    def verify(transaction_id, timeout=None):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+        time.sleep(0.02)
+        with lock:
+            in_flight[0] -= 1
+        return {"status": "completed"}
+
+    gateway = make_gateway()
+    gateway.verify_payment_status.side_effect = verify
+    summary = reconcile(gateway, concurrency=3)
+    assert summary['settled'] == 8
+    assert 1 < in_flight[1] <= 3
+
+def test_rate_limiter_spaces_calls():
+    """Test calls beyond the burst wait for tokens to refill."""
+    limiter = RateLimiter(rate=50, burst=1)
+    start = time.monotonic()
+    for _ in range(6):
+        limiter.acquire()
+    assert time.monotonic() - start >= 0.09
+
+def test_background_reconciler_runs(make_gateway):
+    """Test the reconciler thread runs periodically until stopped."""
+    payment_id = add_payment()
+    reconciler = start_reconciler(0.01, gateway_factory=make_gateway, grace=0)
+    deadline = time.monotonic() + 5
+    while get_payment(payment_id)['status'] == 'pending' and time.monotonic() < deadline:
+        time.sleep(0.01)
+    stop_reconciler()
+    assert get_payment(payment_id)['status'] == 'completed'
+    assert reconciler.runs >= 1
+
+def test_drift_api(client, make_gateway):
+    """Test GET /api/payments/drift lists open drift."""
+    add_payment('completed')
+    reconcile(make_gateway(status="failed"))
+    data = client.get('/api/payments/drift').get_json()
+    assert data['count'] == 1
+    assert data['drift'][0]['gateway_status'] == 'failed'
+    assert client.get('/api/payments/drift?resolved=1').get_json()['count'] == 0
+    assert client.get('/api/payments/drift?resolved=x').status_code == 400
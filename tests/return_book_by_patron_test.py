@@ -1,4 +1,5 @@
 import pytest
+import sqlite3
 from datetime import datetime, timedelta
 from services.library_service import (
     borrow_book_by_patron,
@@ -6,6 +7,7 @@ from services.library_service import (
 )
 from database import (
     get_book_by_isbn,
+    get_patron_borrow_count,
     insert_book,
     insert_borrow_record
 )
@@ -63,22 +65,38 @@ def test_return_book_patron_id_too_long():
     assert success is False
     assert "invalid patron" in message
 
-def test_return_book_db_error(monkeypatch):
-    """Test returning a book with a database error."""
+def test_return_book_db_error_rolls_back(monkeypatch):
+    """Test that a database error while restocking leaves the loan open."""
     insert_book("Test Book", "Test Author", "1234567890999", 1, 1)
     book = get_book_by_isbn("1234567890999")
     borrow_book_by_patron("123456", book['id'])
-    monkeypatch.setattr("services.library_service.update_book_availability", lambda book_id, change: False)
+    def fail(*args):
+        raise sqlite3.OperationalError("disk I/O error")
+    monkeypatch.setattr("services.library_service.release_book_copy", fail)
     success, message = return_book_by_patron("123456", book['id'])
     assert success is False
     assert "Database error occured" in message
+    assert get_book_by_isbn("1234567890999")['available_copies'] == 0
+    assert get_patron_borrow_count("123456") == 1
 
 def test_return_book_db_error_on_return_date(monkeypatch):
     """Test returning a book with another database error."""
     insert_book("Test Book", "Test Author", "1234567890998", 1, 1)
     book = get_book_by_isbn("1234567890998")
     borrow_book_by_patron("123456", book['id'])
-    monkeypatch.setattr("services.library_service.update_borrow_record_return_date", lambda patron_id, book_id, return_date: False)
+    monkeypatch.setattr("services.library_service.close_borrow_record", lambda conn, record_id, return_date: False)
+    success, message = return_book_by_patron("123456", book['id'])
+    assert success is False
+    assert "Database error occured while updating return date." in message
+    assert get_book_by_isbn("1234567890998")['available_copies'] == 0
+
+def test_return_book_restores_copy():
+    """Test that returning a book puts the copy back and closes the loan."""
+    insert_book("Test Book", "Test Author", "1234567890997", 2, 2)
+    book = get_book_by_isbn("1234567890997")
+    borrow_book_by_patron("123456", book['id'])
+    return_book_by_patron("123456", book['id'])
+    assert get_book_by_isbn("1234567890997")['available_copies'] == 2
+    assert get_patron_borrow_count("123456") == 0
     success, message = return_book_by_patron("123456", book['id'])
     assert success is False
-    assert "Database error occured while updating return date." in message
\ No newline at end of file
@@ -3,7 +3,8 @@ from services.library_service import (
     search_books_in_catalog
 )
 from database import (
-    insert_book
+    insert_book,
+    clear_database
 )
 
 def test_search_books_by_title():
@@ -58,4 +59,34 @@ def test_search_books_by_isbn_not_found():
     """Test searching for a book by ISBN that doesn't exist."""
     insert_book("ISBN Book", "ISBN Author", "1234567890131", 5, 5)
     results = search_books_in_catalog("9999999999999", "isbn")
-    assert len(results) == 0
\ No newline at end of file
+    assert len(results) == 0
+
+def test_search_books_case_insensitive():
+    """Test title search ignores case."""
+    insert_book("The Great Gatsby", "F. Scott Fitzgerald", "1234567890132", 5, 5)
+    results = search_books_in_catalog("great GATS", "title")
+    assert [b['isbn'] for b in results] == ["1234567890132"]
+
+def test_search_books_ranked_by_relevance():
+    """Test the closest title match is returned first."""
+    insert_book("Python", "Author A", "1234567890133", 5, 5)
+    insert_book("Python for Data Analysis and Machine Learning in Practice", "Author B", "1234567890134", 5, 5)
+    results = search_books_in_catalog("python", "title")
+    assert [b['isbn'] for b in results] == ["1234567890133", "1234567890134"]
+
+def test_search_books_ignores_accents():
+    """Test searching without accents finds accented titles."""
+    insert_book("Café Society", "Author", "1234567890135", 5, 5)
+    results = search_books_in_catalog("cafe", "title")
+    assert len(results) == 1
+
+def test_search_books_punctuation_only():
+    """Test a search term with no words returns nothing instead of failing."""
+    insert_book("Test Book", "Test Author", "1234567890136", 5, 5)
+    assert search_books_in_catalog('"*()', "title") == []
+
+def test_search_books_index_follows_deletes():
+    """Test the search index drops books removed from the catalog."""
+    insert_book("Vanishing Book", "Test Author", "1234567890137", 5, 5)
+    clear_database()
+    assert search_books_in_catalog("Vanishing", "title") == []
@@ -0,0 +1,111 @@
+import os
+import re
+import signal
+import subprocess
+import sys
+import pytest
+import requests
+import database
+from app import create_app
+from database import DATABASE
+from services import payment_queue, reconciliation
+from serving import create_server_app, init_worker, shutdown_worker, load_settings, parse_bind
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def server_app():
+    app = create_server_app({'DATABASE': DATABASE, 'PAYMENT_WORKERS': 2, 'RECONCILE_INTERVAL': 60}, threads=4)
+    yield app
+    shutdown_worker(timeout=5)
+
+def test_load_settings_from_environment():
+    """Test LIBRARY_* variables become typed app settings and server options."""
+    config, options = load_settings({
+        'LIBRARY_DATABASE': '/data/library.db', 'LIBRARY_DB_POOL_SIZE': '16', 'LIBRARY_PROFILING': 'true',
+        'LIBRARY_RECONCILE_INTERVAL': '0', 'LIBRARY_WORKERS': '3', 'LIBRARY_WARM_PATHS': '/catalog, /api/books',
+    })
+    assert config == {'DATABASE': '/data/library.db', 'DB_POOL_SIZE': 16, 'PROFILING': True,
+                      'RECONCILE_INTERVAL': 0.0}
+    assert options['workers'] == 3
+    assert options['warm_paths'] == ('/catalog', '/api/books')
+    assert options['threads'] == 8
+    assert load_settings({})[1]['workers'] == 1
+
+def test_parse_bind():
+    """Test host:port parsing with the host defaulting to all interfaces."""
+    assert parse_bind('127.0.0.1:8000') == ('127.0.0.1', 8000)
+    assert parse_bind(':8000') == ('0.0.0.0', 8000)
+    with pytest.raises(ValueError):
+        parse_bind('localhost')
+
+def test_background_tasks_can_be_left_off():
+    """Test BACKGROUND_TASKS=False starts no payment workers, reconciler or checkpointer."""
+    create_app({'DATABASE': DATABASE, 'BACKGROUND_TASKS': False})
+    assert payment_queue._workers is None
+    assert reconciliation._reconciler is None
+    assert database._checkpointer is None
+
+def test_master_keeps_no_connections_open(server_app):
+    """Test the app created before forking leaves no connections to be inherited."""
+    stats = database.get_pool_stats()
+    assert stats['idle'] == 0
+    assert payment_queue._workers is None
+
+def test_pool_fits_request_and_background_threads(server_app):
+    """Test the pool has room for the request threads, payment workers and reconciler checks together."""
+    assert database.get_pool_stats()['max_size'] == 4 + 2 + reconciliation.RECONCILE_CONCURRENCY
+    create_server_app({'DATABASE': DATABASE, 'PAYMENT_WORKERS': 0, 'RECONCILE_INTERVAL': 0}, threads=4)
+    assert database.get_pool_stats()['max_size'] == database.POOL_SIZE
+
+def test_reset_pool_after_fork():
+    """Test a worker gets a new pool with the same settings and the inherited one is left open."""
+    inherited = database.configure_pool(DATABASE, max_size=3, timeout=2.0)
+    inherited.warm(1)
+    pool = database.reset_pool_after_fork()
+    assert pool is not inherited
+    assert (pool.database, pool.max_size, pool.timeout) == (DATABASE, 3, 2.0)
+    assert pool.stats()['size'] == 0
+    assert inherited.stats()['idle'] == 1
+    database.configure_pool(DATABASE)
+
+def test_init_worker_warms_and_starts_background_tasks(server_app):
+    """Test a worker opens its connections up front and the primary also runs the reconciler."""
+    init_worker(server_app, primary=True)
+    # Size rather than idle: the payment workers may already be holding a connection
+    stats = database.get_pool_stats()
+    assert stats['size'] == stats['max_size']
+    assert payment_queue._workers is not None
+    assert reconciliation._reconciler is not None
+
+    init_worker(server_app, primary=False)
+    assert payment_queue._workers is not None
+    assert reconciliation._reconciler is None
+
+    shutdown_worker(timeout=5)
+    assert payment_queue._workers is None
+    assert database.get_pool_stats()['idle'] == 0
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='Prefork serving needs os.fork')
+def test_prefork_server_serves_and_shuts_down(tmp_path):
+    """Test the server forks workers that answer requests and exit cleanly on SIGTERM."""
+    env = dict(os.environ, LIBRARY_DATABASE=str(tmp_path / 'library.db'), LIBRARY_RECONCILE_INTERVAL='0')
+    process = subprocess.Popen([sys.executable, 'serving.py', '--workers', '2', '--threads', '2',
+                                '--bind', '127.0.0.1:0', '--graceful-timeout', '5'],
+                               cwd=ROOT, env=env, stderr=subprocess.PIPE, text=True)
+    try:
+        log = ''
+        while 'Worker ready' not in log or log.count('Worker ready') < 2:
+            line = process.stderr.readline()
+            assert line, log
+            log += line
+        port = re.search(r'Listening on http://127.0.0.1:(\d+)', log).group(1)
+        for _ in range(4):
+            assert requests.get(f'http://127.0.0.1:{port}/catalog', timeout=5).status_code == 200
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=10) == 0
+        assert process.stderr.read().count('Worker stopped') == 2
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stderr.close()
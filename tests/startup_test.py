@@ -0,0 +1,54 @@
+import os
+import subprocess
+import sys
+import database
+from database import init_database, add_sample_data, read_schema_version, SCHEMA_VERSION, DATABASE
+from instrumentation import capture_queries
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_current_schema_skips_ddl():
+    """Test init_database on an up-to-date database only reads schema_version."""
+    init_database()
+    with capture_queries() as captured:
+        init_database()
+    statements = [sql for sql, parameters, seconds in captured]
+    assert 'SELECT MAX(version) FROM schema_version' in statements
+    assert not [sql for sql in statements if 'CREATE' in sql.upper()]
+
+def test_new_database_is_created_and_migrated(tmp_path):
+    """Test a new file gets every table and ends at SCHEMA_VERSION."""
+    database.configure_pool(str(tmp_path / 'new.db'))
+    try:
+        conn = database.get_db_connection()
+        assert read_schema_version(conn) == 0
+        conn.close()
+        init_database()
+        add_sample_data()
+        conn = database.get_db_connection()
+        assert read_schema_version(conn) == SCHEMA_VERSION
+        assert conn.execute('SELECT COUNT(*) FROM books').fetchone()[0] == 3
+        conn.close()
+    finally:
+        database.get_pool().close_all()
+        database.configure_pool(DATABASE)
+
+def test_sample_data_check_is_one_query():
+    """Test a populated database is detected without counting every book."""
+    add_sample_data()
+    with capture_queries() as captured:
+        add_sample_data()
+    assert [sql for sql, parameters, seconds in captured] == [
+        'SELECT EXISTS (SELECT 1 FROM books) AS has_books'
+    ]
+
+def test_catalog_traffic_does_not_load_the_http_client(tmp_path):
+    """Test importing the app and serving the catalog leaves `requests` unimported."""
+    code = ("import sys; from app import create_app; "
+            f"app = create_app({{'DATABASE': {str(tmp_path / 'library.db')!r}, "
+            "'PAYMENT_WORKERS': 0, 'RECONCILE_INTERVAL': 0}); "
+            "assert app.test_client().get('/catalog').status_code == 200; "
+            "print('requests' in sys.modules)")
+    completed = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, timeout=60)
+    assert completed.returncode == 0, completed.stderr
+    assert completed.stdout.strip() == 'False'
@@ -0,0 +1,52 @@
+import pytest
+from database import (
+    get_db_connection, run_checkpoint, configure_storage,
+    start_checkpointer, stop_checkpointer, STORAGE_SETTINGS
+)
+
+def test_database_uses_wal_journal():
+    """Test that init_database switches the database file to WAL."""
+    conn = get_db_connection()
+    mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+    conn.close()
+    assert mode == 'wal'
+
+def test_connection_pragmas_applied():
+    """Test that pooled connections carry the tuned pragmas."""
+    conn = get_db_connection()
+    busy_timeout = conn.execute('PRAGMA busy_timeout').fetchone()[0]
+    synchronous = conn.execute('PRAGMA synchronous').fetchone()[0]
+    cache_size = conn.execute('PRAGMA cache_size').fetchone()[0]
+    conn.close()
+    assert busy_timeout == STORAGE_SETTINGS['busy_timeout']
+    assert synchronous == 1  # NORMAL
+    assert cache_size == STORAGE_SETTINGS['cache_size']
+
+def test_configure_storage_rejects_unknown_setting():
+    """Test that a typo in the storage settings is reported."""
+    with pytest.raises(ValueError):
+        configure_storage({'journal_mod': 'WAL'})
+
+def test_run_checkpoint():
+    """Test running a manual WAL checkpoint."""
+    result = run_checkpoint('PASSIVE')
+    assert result['busy'] is False
+    assert result['log_frames'] >= result['checkpointed_frames']
+
+def test_run_checkpoint_invalid_mode():
+    """Test that an unknown checkpoint mode is rejected."""
+    with pytest.raises(ValueError):
+        run_checkpoint('SOMETIMES')
+
+def test_background_checkpointer_runs():
+    """Test that the background checkpointer checkpoints on its interval."""
+    checkpointer = start_checkpointer(interval=0.01)
+    try:
+        for _ in range(200):
+            if checkpointer.runs:
+                break
+            checkpointer.join(0.01)
+    finally:
+        stop_checkpointer()
+    assert checkpointer.runs > 0
+    assert not checkpointer.is_alive()
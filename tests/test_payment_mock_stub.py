@@ -13,7 +13,7 @@ def test_pay_late_fees_success(mocker):
     assert success is True
     assert txn == "txn_123456"
     assert "successful" in message
-    gateway.process_payment.assert_called_once_with(patron_id="123456", amount=4.50, description=ANY)
+    gateway.process_payment.assert_called_once_with(patron_id="123456", amount=4.50, description=ANY, idempotency_key=ANY)
 
 def test_pay_late_fees_payment_declined(mocker):
     mocker.patch('services.library_service.get_book_by_id', return_value={'id': 2, 'title': 'Book B'})
@@ -24,7 +24,7 @@ def test_pay_late_fees_payment_declined(mocker):
     assert success is False
     assert txn == None
     assert "failed" in message
-    gateway.process_payment.assert_called_once_with(patron_id="123456", amount=2.00, description=ANY)
+    gateway.process_payment.assert_called_once_with(patron_id="123456", amount=2.00, description=ANY, idempotency_key=ANY)
 
 def test_pay_late_fees_invalid_patron_id(mocker):
     mocker.patch('services.library_service.get_book_by_id', return_value={'id': 3, 'title': 'Book C'})
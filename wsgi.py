@@ -0,0 +1,11 @@
+"""
+WSGI entry point for servers that import the app (e.g. `gunicorn -c gunicorn.conf.py wsgi:app`).
+
+Settings come from LIBRARY_* environment variables (see serving.py). The app
+is created with background tasks off; the server's per-worker hooks start them.
+"""
+
+from serving import create_server_app, load_settings
+
+config, options = load_settings()
+app = create_server_app(config, options['threads'])